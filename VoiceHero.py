@@ -1,255 +1,426 @@
-import sounddevice as sd
-import aubio
-import numpy as np
-import librosa
-import soundfile as sf
 import time
+_launched = time.perf_counter()  # startup report: launch -> karaoke prompt
+import numpy as np
 import sys
-import shlex
-import demucs.separate #library used for source seperation
 import os
-import whisper 
+import json
+import getpass
 import pyfiglet 
-from PyQt6.QtWidgets import QApplication, QWidget, QLabel, QVBoxLayout, QPushButton, QFileDialog
-from PyQt6.QtGui import QDragEnterEvent, QDropEvent
-from PyQt6.QtCore import Qt
+from song_cache import SongCache, make_key, song_id
+from separation import STEMS
+from analysis import extract_pitch_and_loudness, TranscriptionService, transcribe_voiced, whisper_workers
+from lyric_index import LyricIndex
+from reference_file import ReferenceFile, write_reference
+from renderer import Renderer
+from alignment import FrameAligner, device_hop_size, resample, load_round_trip_latency
+from oltw import OnlineTimeWarper
+from instrumentation import CallbackProfiler, DOWNMIX, PITCH, LOOKUP, SCORING, ENQUEUE, RECORD
+from take_recorder import TakeRecorder
+from results_store import ResultsStore, SessionResult, average_score
+from latency_profiles import REFERENCE_HOP, get_profile, reference_at, decimate_f0, decimation
+from session import Session, PitchTracker, MultiPitchTracker, ArrayBacking, FileBacking, ERROR, default_samplerate
+# Qt, Demucs, Whisper and librosa are imported where they are used (drop_window.py, progressive.py,
+# analysis.py), a song that is already in the cache starts without loading any of them
+_imported = time.perf_counter()
 
 # GLOBAL SETUP 
 print("GETTING SET UP!")
 print("HOLD TIGHT :)")
-hop_size = 512
+latency_profile = "classic"  # mic block + detector window: ultra-low, balanced, classic or efficient (see latency_profiles.py)
+hop_size = get_profile(latency_profile).hop_size  # one mic block = one reference frame
+reference_hop = REFERENCE_HOP  # songs are analysed once at this hop, every profile's frames come from it
 loudness_threshold = 7.0e-5  # Used to filter out silence
+fmin, fmax = 50, 600  # Pitch range used for the reference vocals
+demucs_model = "mdx_extra"  # "htdemucs" separates ~4x faster for a quick preview, a bit less clean
+parallel_separation = False  # True = separate in overlapping segments on all cores, for long live recordings
+separation_memory_gb = 6  # memory the parallel separation may use (8 GB machine -> 6)
+whisper_model = "base"  # You can use "small", "medium", or "large" for better accuracy
+progressive_mode = False  # True = start singing after the first chunk is analysed (see progressive.py)
+pitch_method = "yin"  # live pitch detector: yin, yinfast, yinfft, mcomb, schmitt or numpy_yin (see pitch_benchmark.py)
+singers = 1  # group mode: one mic per singer on a multi-channel interface (EX: 4), every channel scored on its own
+singer_parts = []  # reference (.vhref or library folder) per singer when they sing different parts, empty = all sing the vocals
+alignment_mode = "fixed"  # "fixed" = score against the playback position, "oltw" = follow the singer (see oltw.py)
+duplex_mode = False  # True = backing track and mic on one sd.Stream (one clock), needs a device that does both
+timings_file = None  # EX: "timings.json" (report) or "timings.csv" (every block) to export callback timings
+take_file = None  # EX: "takes/take.flac" keeps the mic audio + live pitch of every song (see take_recorder.py)
+cache = SongCache()  # Stores stems, f0, rms and lyrics of songs we already processed
+last_song_file = os.path.join(cache.root, "last_song.json")  # stem folder (+ reference key) of the song sung last time
+results_db = os.path.join(cache.root, "results.db")  # every finished song is stored here (see results_store.py), None = off
+singer_name = None  # name the results are stored under, None = the login name
+store_frame_scores = False  # also store the score of every frame, not just per line / note / song
 
 # UTILITY FUNCTIONS 
-def frequency_to_note(frequency):
-    ''' Converts frequency to Notes and octave - EX: A4'''
-    note_names = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
-    if frequency <= 0:
-        return "N/A"
-    midi_note = round(69 + 12 * np.log2(frequency / 440.0))
-    note_index = midi_note % 12
-    octave = (midi_note // 12) - 1
-    return f"{note_names[note_index]}{octave}"
-
 def calculate_accuracy(original_freq, live_freq):
     '''Calculates the acurracy in pitch between two vocals'''
     if original_freq > 0 and live_freq > 0:
         return max(0, 100 - (abs(original_freq - live_freq) / original_freq * 100))
     return 0
 
-def print_text(text, accuracy):
-    '''Formats and outputs '''
-    if accuracy != -1: 
-        if accuracy > 90.0: 
-            feedback = "Excellent!!!"
-            large_text = pyfiglet.figlet_format(f"{str(int(accuracy))}%")
-            print(f"\033[30;32m{large_text} \n {feedback} \033[0m") 
-        elif accuracy > 75.0 and accuracy < 90.0:
-            feedback = "good job"
-            large_text = pyfiglet.figlet_format(f"{str(int(accuracy))}%")
-            print(f"\033[30;33m{large_text} \n {feedback} \033[0m") 
-        elif accuracy > 50 and accuracy < 75.0:
-            feedback = "not very good :/"
-            large_text = pyfiglet.figlet_format(f"{str(int(accuracy))}%")
-            print(f"\033[30;35m{large_text} \n {feedback} \033[0m") 
-        else: 
-            feedback = "You Suck!"
-            large_text = pyfiglet.figlet_format(f"{str(int(accuracy))}%")
-            print(f"\033[30;31m{large_text} \n {feedback} \033[0m") 
-
-        print(f"\033[1;37;90m{text}\033[0m")
-
-
-#CLASS -- SOURCE SEPERATION 
-class DragDropWindow(QWidget):
-    def __init__(self):
-        '''initializes drag and drop window (label and button)'''
-       
-        super().__init__()
-        self.setWindowTitle("Drop Window") #set title
-        self.setGeometry(500, 500, 500, 500) #set size and position
-
-        #instert prompt for user 
-        self.label = QLabel("Drag and drop the song you want to sing!", self)
-        self.label.setAlignment(Qt.AlignmentFlag.AlignCenter) #align text
-
-        #manually browse button 
-        self.button = QPushButton("Browse Files", self)
-        self.button.clicked.connect(self.browse_file)
-
-        layout = QVBoxLayout() #vertical layout
-        layout.addWidget(self.label) #label for layout 
-        layout.addWidget(self.button) # add button
-        self.setLayout(layout) #set layout 
-
-        # Enable drag-and-drop
-        self.setAcceptDrops(True)
-
-    def dragEnterEvent(self, event: QDragEnterEvent):
-        '''Handles when file is dragged to the window'''
-        if event.mimeData().hasUrls(): # check for file URL 
-            event.acceptProposedAction() # accept file if it has file URL
-
-    def dropEvent(self, event: QDropEvent):
-        """Handles file drop event"""
-        files = [url.toLocalFile() for url in event.mimeData().urls()] #get the local file path
-        if files:
-            file_path = files[0]  # Get the first dropped file (assuming single file is given)
-            self.label.setText(f"File Selected: {file_path}") # label with new path
-            self.separate_audio(file_path) #process the file with source seperation 
-
-    def browse_file(self):
-        """Opens file dialog for selecting an audio file"""
-        file_path, _ = QFileDialog.getOpenFileName(self, "Select Audio File", "", "Audio Files (*.wav *.mp3 *.flac)")
-        if file_path:
-            self.label.setText(f"File Selected: {file_path}")
-            self.separate_audio(file_path)
-
-    def separate_audio(self, input_file):
-        """Runs Demucs to separate vocals"""
-        script_dir = os.getcwd()
-        #create command-line arguments for Demcus 
-        args = f'--mp3 --two-stems vocals -n mdx_extra -o "{script_dir}"  "{input_file}"'
-        
-        # Execute Demucs with the constructed arguments
-        print("STARTING SOURCE SEPERATION")
-        demucs.separate.main(shlex.split(args))
-
-        song_name = os.path.splitext(os.path.basename(input_file))[0]
-        demucs_output_dir = os.path.join(script_dir, "mdx_extra", song_name)
-        stems = ["vocals.mp3", "no_vocals.mp3"]
-        
-        for stem in stems:
-            src = os.path.join(demucs_output_dir, stem)  # File from Demucs output folder
-            dst = os.path.join(script_dir, stem)  # Move it to the script folder
-            if os.path.exists(dst):  # Remove old version if it exists
-                os.remove(dst)
-            os.rename(src, dst)  # Move file
-
-    # Cleanup: Remove the now-empty Demucs output folder
-        os.rmdir(demucs_output_dir)
-        self.close()
-
-#WHISPER--LYRIC GENERATION 
-def generate_lyrics_with_whisper(vocal_path="vocals.mp3"):
-    '''Transcribes the lyrics from the original Vocals'''       
+def calculate_accuracies(original_freqs, live_freqs):
+    '''calculate_accuracy for every singer at once (arrays, 0 where either side has no pitch)'''
+    with np.errstate(divide="ignore", invalid="ignore"):
+        accuracy = np.maximum(0, 100 - np.abs(original_freqs - live_freqs) / original_freqs * 100)
+    accuracy[~((original_freqs > 0) & (live_freqs > 0))] = 0
+    return accuracy
+
+def load_part(path, samplerate, part_hop_size=hop_size):
+    '''f0 of one singer's part (a .vhref or a library song folder) at part_hop_size, must match the main song's frames'''
+    reference = ReferenceFile(path if path.endswith(".vhref") else os.path.join(path, "reference.vhref"))
+    if reference.samplerate != samplerate or part_hop_size % reference.hop_size:
+        raise ValueError(f"{path} was analysed at {reference.samplerate} Hz / hop {reference.hop_size}, "
+                         f"the song at {samplerate} Hz / hop {part_hop_size}")
+    return decimate_f0(reference.f0, decimation(reference.hop_size, part_hop_size))
+
+def remember_song(song_dir, reference_key=None, song=None):
+    '''Saves which song folder to sing when the player answers "no" next time
+
+    With the reference key the next start opens the analysis straight away, without hashing the vocals again.
+    The analysis settings go with it, a key made with other settings (EX: an older reference_hop) is not reused.
+    song is its song_id(), the name the results store keeps its sessions under.'''
+    with open(last_song_file, "w") as f:
+        json.dump({"stems": song_dir, "reference": reference_key, "settings": analysis_settings(), "song": song}, f)
+
+def last_song():
+    '''{"stems": folder, "reference": key or None, "song": song id} of the last song, None if there is none (or the cache dropped it)'''
+    if not os.path.exists(last_song_file):
+        return None
+    try:
+        with open(last_song_file) as f:
+            song = json.load(f)
+    except ValueError:
+        return None
+    if not song.get("song"):
+        return None  # saved before songs had ids, the player picks it again
+    if song.get("settings") != analysis_settings():
+        song["reference"] = None  # analysed with other settings, main hashes the vocals for the current key
+    stems_dir = os.path.abspath(song["stems"])
+    if not all(os.path.exists(os.path.join(stems_dir, stem)) for stem in STEMS):
+        return None
+    if os.path.dirname(stems_dir) == os.path.abspath(cache.root):  # a cache entry: mark it used, or LRU eviction drops it first
+        cache.touch(os.path.basename(stems_dir))
+    return song
+
+def startup_report(loading_started):
+    '''One line with the import time, the time spent getting the song ready and the peak RSS'''
+    report = (f"STARTUP: imports {_imported - _launched:.2f} s, "
+              f"song ready in {time.perf_counter() - loading_started:.2f} s")
+    try:
+        import resource  # not on Windows
+    except ImportError:
+        return report
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_mb = peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024  # bytes on macOS, KB on Linux
+    return f"{report}, peak RSS {peak_mb:.0f} MB"
+
+#REFERENCE ANALYSIS (CACHED)
+def analysis_settings():
+    '''Settings the reference analysis depends on, part of its cache key'''
+    return {"hop_size": reference_hop, "fmin": fmin, "fmax": fmax, "whisper_model": whisper_model}
+
+def reference_key(vocal_path):
+    '''Cache key of the analysis of one vocals file with the current settings'''
+    return make_key(vocal_path, **analysis_settings())
+
+def load_reference(vocal_path, key=None):
+    '''Returns f0, rms, lyrics, sample rate and notes (NoteIndex) of the vocals, from the cache when the song was already analysed
+
+    Cached songs are a memory-mapped .vhref file (see reference_file.py), so loading them is near instant.
+    key is reference_key(vocal_path) when the caller already knows it (saves hashing the vocals).
+    The analysis is at reference_hop, what comes back has one frame per hop_size (the latency profile's block).'''
+    key = key or reference_key(vocal_path)
+    if cache.has(key, ["reference.vhref"]):
+        print("SONG FOUND IN CACHE -- SKIPPING ANALYSIS")
+        return open_reference(cache.path(key, "reference.vhref"))
+
+    # The Whisper workers load their models while we extract pitch and loudness here, then
+    # transcribe only the parts where the rms says somebody sings, several parts at once
     print("Transcribing vocals with Whisper... this may take a moment.")
-
-    model = whisper.load_model("base")  # You can use "small", "medium", or "large" for better accuracy
-    result = model.transcribe(vocal_path)
-    lyrics = result["segments"]  # List of dicts: start, end, text
-
-    return lyrics
+    transcriber = TranscriptionService(whisper_model, use_worker=True, workers=whisper_workers())
+    try:
+        f0, rms, sr = extract_pitch_and_loudness(vocal_path, reference_hop, fmin, fmax)
+        lyrics = transcribe_voiced(vocal_path, rms, f0, sr, reference_hop, threshold=loudness_threshold,
+                                   service=transcriber)
+    finally:
+        transcriber.close()
+
+    path = cache.save_file(key, "reference.vhref", lambda path: write_reference(
+        path, f0, rms, lyrics, sr, reference_hop, fmin=fmin, fmax=fmax, whisper_model=whisper_model))
+    return open_reference(path)
+
+def open_reference(path, profile_hop_size=hop_size):
+    '''f0, rms, lyrics, sample rate and notes of a .vhref, one frame per profile_hop_size'''
+    reference = ReferenceFile(path)
+    f0, rms, notes = reference_at(reference.f0, reference.rms, reference.notes, reference.hop_size, profile_hop_size)
+    return f0, rms, reference.lyrics, reference.samplerate, notes
 
 #AUDIO PROCESSING
-def start_audio_processing(f0, rms_values, lyrics, samplerate, backing_track):
-    '''Initializes all things needed for the callback function'''
-    current_frame = 0
-    current_lyric_index = 0
+def start_audio_processing(f0, rms_values, lyrics, samplerate, backing_track, device_samplerate=None,
+                           audio=None, out=sys.stdout, timings_path=None, singers=1, parts=None, duplex=None,
+                           notes=None, record_path=None, song=None, results_path=None, profile=None):
+    '''Initializes all things needed for the callback function
+
+    samplerate is the rate of the song files, device_samplerate the rate the sound card runs at
+    (the backing track is resampled once so the driver does not have to). audio is the stream
+    backend (None = sounddevice, EX: a VirtualDevice from simulate.py), out is where the score is drawn.
+    timings_path (.json or .csv) is where the callback timings get exported, the summary is always printed.
+    singers > 1 is group mode: input channel i is singer i, scored against parts[i] (f0 arrays) or against f0
+    when parts is None. duplex (default duplex_mode) plays and records on one stream.
+    backing_track is an array at samplerate or anything with read(out) already at the device rate
+    (FileBacking, StreamingBacking). notes (note_index.NoteIndex of f0) adds per-note results at the end.
+    record_path (default take_file) records the take there, with the live pitch next to it (take_recorder.py).
+    song names the song in the results store (results_path, default results_db), None = results not stored.
+    profile (default latency_profile) sets the mic block and detector window, f0 / rms / notes / parts
+    must have one frame per profile hop (open_reference, load_part).
+    Returns the list of accuracies (one list per singer in group mode).'''
+    timings_path = timings_path or timings_file
+    profile = get_profile(profile or latency_profile)
+    hop_size = profile.hop_size
+    duplex = duplex_mode if duplex is None else duplex
+    device_samplerate = device_samplerate or samplerate
+    streaming = hasattr(backing_track, "read")  # streamed from disk, or chunk by chunk in progressive mode
+    if not streaming:
+        backing_track = resample(backing_track, samplerate, device_samplerate)
+    block_size = device_hop_size(hop_size, samplerate, device_samplerate)  # same duration as one reference hop
+    win_size = device_hop_size(profile.win_size, samplerate, device_samplerate)  # detector window, same in ms
+    # a virtual device reports its latencies exactly, the saved calibration is for the real sound card
+    aligner = FrameAligner(samplerate, hop_size, device_samplerate, load_round_trip_latency() if audio is None else None)
+    warper = OnlineTimeWarper(f0) if alignment_mode == "oltw" else None
+    # binary search over segment end times (progressive mode hands us an index that keeps growing)
+    lyric_index = lyrics if isinstance(lyrics, LyricIndex) else LyricIndex(lyrics)
     text_2 = ""
-    pitch_detector = aubio.pitch("yin", 1024, hop_size, samplerate)
-    pitch_detector.set_unit("Hz")
-    pitch_detector.set_tolerance(0.8)
+    pitch_tracker = PitchTracker(device_samplerate, block_size, win_size, method=pitch_method)
     accuracy_list =[]
     prev_accuracy = 0.0
+    renderer = Renderer(out=out)  # draws the score on its own thread, banners are pre-rendered here
+
+    profiler = CallbackProfiler(block_size / device_samplerate)  # per-stage timings, xruns, deadline misses
+    if notes is not None:  # right / sung frames per note of the song
+        note_hits = np.zeros(len(notes), dtype=np.int32)
+        note_frames = np.zeros(len(notes), dtype=np.int32)
+    mark = profiler.mark
+    record_path = record_path or take_file
+    results_path = results_path or results_db
+    frame_table = np.full((singers, len(f0)), np.nan)  # score per reference frame and singer, for the results store
+    frame_scores = frame_table[0]
+    recorder = TakeRecorder(record_path, device_samplerate, singers, block_size) if record_path else None
+
+    if singers > 1:  # group mode, every singer goes through the same callback
+        if parts and len(parts) != singers:
+            raise ValueError(f"{singers} singers but {len(parts)} parts")
+        group_tracker = MultiPitchTracker(device_samplerate, singers, block_size, win_size, method=pitch_method)
+        if parts:
+            part_table = np.zeros((singers, max(len(part) for part in parts)))
+            for i, part in enumerate(parts):
+                part_table[i, :len(part)] = part
+        ref_pitch = np.zeros(singers)
+        prev_accuracies = np.zeros(singers)
+        singer_lists = [[] for _ in range(singers)]
 
     def callback(indata, frames, time, status):
-        '''Listens for audio input and calls all print and comparsion functions'''
-        nonlocal current_frame, current_lyric_index,text_2, accuracy_list, prev_accuracy
+        '''Listens for audio input, compares it and queues the result for the renderer (no printing here)'''
+        nonlocal text_2, accuracy_list, prev_accuracy
         
-        if status: print(status)
+        if status: renderer.push_status(status)
 
         # Process live mic input
-        mono_audio = np.mean(indata, axis=1)
-        mono_audio = mono_audio[:hop_size] if len(mono_audio) >= hop_size else np.pad(mono_audio, (0, hop_size - len(mono_audio)))
-        live_pitch = pitch_detector(mono_audio)[0]
-        confidence = pitch_detector.get_confidence()
-
-        # Get corresponding pitch from original vocals
-        original_pitch = f0[current_frame] if current_frame < len(f0) else 0
-        original_loudness = rms_values[current_frame] if current_frame < len(rms_values) else 0
-        current_time = current_frame * hop_size / samplerate
-        current_frame += 1
-
-        text = ""
-        if current_lyric_index < len(lyrics):
-            start = lyrics[current_lyric_index]['start']
-            end = lyrics[current_lyric_index]['end']
-            text = lyrics[current_lyric_index]['text']     
-            if current_time > end:
-                    current_lyric_index += 1
+        pitch_tracker.downmix(indata)
+        mark(DOWNMIX)
+        live_pitch, confidence, voiced = pitch_tracker.detect()
+        mark(PITCH)
+
+        # Get corresponding pitch from original vocals (frame from the stream timestamps, not a counter)
+        current_frame = aligner.frame_for(time, frames)
+        if warper is not None and current_frame >= 0:  # follow the singer around the playback position
+            current_frame = warper.update(live_pitch if voiced else 0.0, current_frame)
+        original_pitch = f0[current_frame] if 0 <= current_frame < len(f0) else 0
+        original_loudness = rms_values[current_frame] if 0 <= current_frame < len(rms_values) else 0
+        current_time = aligner.song_time
+
+        text = lyric_index.text_at(current_time)
+        note = notes.note_at(current_frame) if notes is not None else -1
+        mark(LOOKUP)
 
         # Only display if confidence is high
-        if 50 <= live_pitch <= 600 and confidence > 0.8:
-            live_note = frequency_to_note(live_pitch)
-            original_note = frequency_to_note(original_pitch)
+        if voiced:
             accuracy = calculate_accuracy(original_pitch, live_pitch)
-            
+            if 0 <= current_frame < len(frame_scores):
+                frame_scores[current_frame] = accuracy
+            if note >= 0:
+                note_frames[note] += 1
+                if notes.is_hit(note, live_pitch):
+                    note_hits[note] += 1
+
             if accuracy != prev_accuracy:
                 accuracy_list.append(accuracy)
                 prev_accuracy = accuracy
+            mark(SCORING)
 
-            print_text(text,accuracy)       
+            renderer.push(text, accuracy)
         else:
+            mark(SCORING)
             if text != text_2:
-                accuracy =-1
-                print_text(text,accuracy)
+                renderer.push(text, -1)  # only the lyric changed
                 text_2 = text 
-
-    with sd.InputStream(callback=lambda indata, frames, time_info, status:
-                    callback(indata, frames, time_info, status),
-                    samplerate=samplerate, channels=1, blocksize=hop_size):
-        sd.play(backing_track, samplerate)
-        try:
-            while sd.get_stream().active:
-                time.sleep(0.01)
-        except KeyboardInterrupt:
-            average = sum(accuracy_list) / len(accuracy_list)
-            end_game = pyfiglet.figlet_format(f"GAME   ENDED")
-            game_acr = pyfiglet.figlet_format(f"Your Accuracy was:") 
-            avg_txt = pyfiglet.figlet_format(f"{int(average)}%") 
-            print(end_game)
-            print(game_acr)
-            print(avg_txt)
+        mark(ENQUEUE)
+        if recorder is not None:
+            recorder.push(indata, live_pitch, confidence, current_frame)  # copy into the ring, no disk here
+            mark(RECORD)
+
+    def group_callback(indata, frames, time, status):
+        '''Same as callback, for every singer (one input channel each) at once'''
+        nonlocal text_2
+
+        if status: renderer.push_status(status)
+
+        group_tracker.split(indata)  # one row per singer instead of a mono mix
+        mark(DOWNMIX)
+        live_pitch, confidence, voiced = group_tracker.detect()
+        mark(PITCH)
+
+        current_frame = aligner.frame_for(time, frames)
+        if parts:
+            if 0 <= current_frame < part_table.shape[1]:
+                ref_pitch[:] = part_table[:, current_frame]
+            else:
+                ref_pitch.fill(0)
+        else:  # everybody sings the same vocal line
+            ref_pitch.fill(f0[current_frame] if 0 <= current_frame < len(f0) else 0)
+        text = lyric_index.text_at(aligner.song_time)
+        mark(LOOKUP)
+
+        accuracies = calculate_accuracies(ref_pitch, live_pitch)
+        if 0 <= current_frame < frame_table.shape[1]:
+            np.copyto(frame_table[:, current_frame], accuracies, where=voiced)
+        for i in np.flatnonzero(voiced):
+            if accuracies[i] != prev_accuracies[i]:
+                singer_lists[i].append(accuracies[i])
+                prev_accuracies[i] = accuracies[i]
+        mark(SCORING)
+
+        if voiced.any():
+            renderer.push(text, accuracies[voiced].mean())  # big banner = the group's score
+            renderer.push_singers(np.where(voiced, accuracies, -1))
+        elif text != text_2:
+            renderer.push(text, -1)
+            text_2 = text
+        mark(ENQUEUE)
+        if recorder is not None:
+            recorder.push(indata, live_pitch, confidence, current_frame)
+            mark(RECORD)
+
+    # The session owns both streams, the main thread just sleeps until the song ends or Ctrl+C
+    if not streaming:
+        backing_track = ArrayBacking(backing_track)
+    session = Session(group_callback if singers > 1 else callback, device_samplerate, block_size,
+                      channels=singers, backing=backing_track,
+                      on_silence=aligner.delay, audio=audio, profiler=profiler, duplex=duplex)  # late chunks / pauses push the song clock back
+    renderer.start()
+    if recorder is not None:
+        recorder.start()
+    started = time.time()
+    try:
+        session.start()
+        aligner.start(session.input_stream, session.output_stream)
+        reason = session.wait()
+    finally:
+        session.stop()
+        renderer.stop()
+        if recorder is not None:
+            recorder.close()  # streams are closed, nothing pushes anymore
+
+    if reason == ERROR:
+        print(f"Audio stream failed: {session.error}")
+    print(profiler.summary())
+    if recorder is not None:
+        print(recorder.summary())
+    if timings_path:
+        print(f"Callback timings saved to {profiler.export(timings_path)}")
+
+    # Results go to the database on the store's writer thread while the scores are printed
+    store = ResultsStore(results_path) if song is not None and results_path else None
+    if store is not None:
+        name = singer_name or getpass.getuser()
+        lines = [{"start": start, "end": end, "text": text}
+                 for start, end, text in zip(lyric_index.starts, lyric_index.ends, lyric_index.texts)]
+        for i in range(singers):
+            store.save_session(SessionResult(
+                name if singers == 1 else f"{name} (singer {i + 1})", song, started, time.time(), frame_table[i],
+                samplerate, hop_size, lines, notes if singers == 1 else None,
+                note_hits if notes is not None else None, note_frames if notes is not None else None,
+                reason, record_path, keep_frames=store_frame_scores))
+    if singers > 1:
+        print(pyfiglet.figlet_format(f"GAME   ENDED"))
+        for i in range(singers):
+            singer_average = average_score(frame_table[i]) or 0  # same number the results store keeps
+            print(pyfiglet.figlet_format(f"Singer {i + 1}: {int(singer_average)}%"))
+        if store is not None:
+            store.close()  # waits for the last writes
+        return singer_lists
+    if notes is not None:
+        print("\n".join(notes.feedback(note_hits, note_frames, hop_size / samplerate)))
+    average = average_score(frame_scores) or 0  # same number the results store keeps, nothing sung -> 0
+    end_game = pyfiglet.figlet_format(f"GAME   ENDED")
+    game_acr = pyfiglet.figlet_format(f"Your Accuracy was:") 
+    avg_txt = pyfiglet.figlet_format(f"{int(average)}%") 
+    print(end_game)
+    print(game_acr)
+    print(avg_txt)
+    if store is not None:
+        store.close()  # waits for the last writes
+    return accuracy_list
     
 #MAIN FLOW 
 if __name__ == "__main__":
     
-    app = QApplication(sys.argv) #Initializes application window for the drag and drop function 
     answer = input("Do you want to sing a new song? (yes/no): ").strip().lower()
+    loading_started = time.perf_counter()
     
     #If yes open drag and drop for users... If no continue unless there are no files then drag and drop will open 
-    if answer == "yes": 
-        window = DragDropWindow()
-        window.show()
-        app.exec()  # Blocks execution until the window is closed
-    else:
-        # Check if both files exist
-        if not os.path.exists("vocals.mp3") or not os.path.exists("no_vocals.mp3"):
-            input("No previous song found. Press ENTER to add a song.")
-            window = DragDropWindow()
-            window.show()
-            app.exec()
+    window = None
+    pipeline = None  # progressive mode only
+    song = None if answer == "yes" else last_song()  # fast path: everything comes from the cache
+    if answer != "yes" and song is None:
+        input("No previous song found. Press ENTER to add a song.")
+    if song is None:
+        from drop_window import pick_song  # Qt + Demucs, only when there is a new song to separate
+        window = pick_song(cache, demucs_model, progressive_mode, parallel_separation,
+                           separation_memory_gb * 1024 ** 3,
+                           on_song=lambda song_dir, song_file: remember_song(song_dir, song=song_id(song_file)))
 
     print(" LOADING YOUR SONG ")
 
-    #started getting set up for vocal processing 
-    y, sr = librosa.load("vocals.mp3" , sr=None)  # Load file at native sample rate
-    backing, _ = librosa.load("no_vocals.mp3", sr=None)  # Load file at native sample rate
-    f0 = librosa.yin(y, fmin=50, fmax=600, sr=sr, hop_length=hop_size) # Extract pitch from original vocals
-    f0 = np.nan_to_num(f0)  # Replace NaN with 0 for unvoiced parts
-    rms = librosa.feature.rms(y=y, frame_length=hop_size)[0]
-
-    # Set up microphone input for live vocal processing
-    device_info = sd.query_devices(kind="input")
-    samplerate = int(device_info["default_samplerate"])
-    pitch_detector = aubio.pitch("yin", 1024, hop_size, samplerate)
-    pitch_detector.set_unit("Hz")
-    pitch_detector.set_tolerance(0.8)
-
-    lyrics = generate_lyrics_with_whisper("vocals.mp3")
-    
+    # Set up microphone input for live vocal processing (runs at the device's native rate)
+    samplerate = default_samplerate()
+
+    if window is not None and window.selected_file:
+        # Progressive: separate / analyse / transcribe in chunks, start once the first ones are done
+        from progressive import ProgressivePipeline
+        pipeline = ProgressivePipeline(window.selected_file, samplerate, hop_size, fmin, fmax, demucs_model, whisper_model)
+        pipeline.start()
+        pipeline.wait_ready()
+        f0, rms, lyrics, sr, backing = pipeline.f0, pipeline.rms, pipeline.lyric_index, pipeline.samplerate, pipeline.backing
+        notes = None  # f0 still fills in while singing, nothing to cut into notes yet
+        song_name = song_id(window.selected_file)
+    else:
+        #started getting set up for vocal processing (f0, rms and lyrics come from the cache for songs we already did)
+        song_dir = window.song_dir if window is not None else song["stems"]
+        if song_dir is None:
+            sys.exit("No song to sing, the separation did not finish.")
+        vocal_path = os.path.join(song_dir, "vocals.wav")
+        key = (song and song.get("reference")) or reference_key(vocal_path)
+        f0, rms, lyrics, sr, notes = load_reference(vocal_path, key)
+        song_name = song_id(window.sung_file) if window is not None else song["song"]  # same id for every setting
+        remember_song(song_dir, key, song_name)
+        backing = FileBacking(os.path.join(song_dir, "no_vocals.wav"), samplerate)  # streamed, never all in memory
+
+    print(startup_report(loading_started))
     input("Press ENTER to start karaoke ! ! ! ! !")
     
-    start_audio_processing(f0, rms, lyrics, sr, backing)
-    
\ No newline at end of file
+    parts = [load_part(path, sr) for path in singer_parts] or None
+    start_audio_processing(f0, rms, lyrics, sr, backing, samplerate, singers=singers, parts=parts,
+                           notes=notes, song=song_name)
+    if pipeline is not None:
+        try:
+            pipeline.check()  # a failure while singing only ended the backing track early
+        except Exception as error:
+            sys.exit(f"The progressive pipeline failed: {error}")
@@ -0,0 +1,125 @@
+import os
+import sys
+import json
+import numpy as np
+
+# MIC <-> REFERENCE ALIGNMENT
+# The reference f0 has one value per hop of the original vocals (hop_size samples at the
+# file's sample rate). Counting callbacks to find "the current frame" drifts: it ignores
+# the time between playing a sample and hearing it back in the mic, and every dropped
+# block shifts the rest of the song. Instead we use PortAudio's timestamps:
+#
+#   song time of a mic block = inputBufferAdcTime - (DAC time of the first backing track sample) - correction
+#
+# where correction is the difference between the round trip we measured (speaker -> mic)
+# and the latencies PortAudio reports. The song time is then turned into a reference frame
+# with the file's sample rate, so the mic can run at whatever rate the device wants.
+LATENCY_FILE = os.path.join(os.path.expanduser("~"), ".voicehero_latency.json")
+
+
+def device_hop_size(hop_size, ref_samplerate, device_samplerate):
+    '''Mic block size covering the same time as one reference hop - EX: 512 @ 44.1k -> 557 @ 48k'''
+    return max(1, int(round(hop_size * device_samplerate / ref_samplerate)))
+
+
+def resample(audio, from_rate, to_rate):
+    '''Resamples audio once up front so the device can run at its native rate'''
+    if from_rate == to_rate:
+        return audio
+    import librosa
+    return librosa.resample(audio, orig_sr=from_rate, target_sr=to_rate)
+
+
+class FrameAligner:
+    def __init__(self, ref_samplerate, hop_size, device_samplerate, measured_round_trip=None):
+        '''Maps mic blocks to reference frames (measured_round_trip in seconds, None = trust PortAudio)'''
+        self.frames_per_second = ref_samplerate / hop_size
+        self.device_samplerate = device_samplerate
+        self.measured_round_trip = measured_round_trip
+        self.correction = 0.0
+        self.dac_start = None  # stream time the first backing track sample leaves the speakers
+        self.samples_seen = 0  # fallback clock when the host API gives no timestamps
+        self.samples_at_start = 0
+        self.reported_latency = 0.0
+        self.song_time = 0.0
+
+    def start(self, input_stream, output_stream):
+        '''Call right after the backing track started playing'''
+        self.reported_latency = _latency(input_stream, "input") + _latency(output_stream, "output")
+        if self.measured_round_trip is not None:
+            self.correction = self.measured_round_trip - self.reported_latency
+        self.samples_at_start = self.samples_seen
+        self.dac_start = output_stream.time + _latency(output_stream, "output")  # set last, the callback checks it
+
+    def delay(self, seconds):
+        '''Backing track paused for seconds (EX: silence played while waiting for the next chunk)'''
+        if self.dac_start is not None:
+            self.dac_start += seconds
+
+    def frame_for(self, time_info, frames):
+        '''Reference frame for the mic block that just arrived (negative before playback starts)'''
+        block_start = self.samples_seen
+        self.samples_seen += frames
+        if self.dac_start is None:
+            self.song_time = -1.0
+            return -1
+
+        adc_time = time_info.inputBufferAdcTime if time_info is not None else 0
+        if adc_time > 0:
+            self.song_time = adc_time - self.dac_start - self.correction
+        else:  # no timestamps -> count samples since playback started (cannot see dropped blocks)
+            elapsed = (block_start - self.samples_at_start) / self.device_samplerate
+            self.song_time = elapsed - self.reported_latency - self.correction
+        return int(round(self.song_time * self.frames_per_second))
+
+
+def _latency(stream, kind):
+    '''Reported latency in seconds of one direction of a stream'''
+    latency = stream.latency
+    if isinstance(latency, (tuple, list)):  # duplex streams report (input, output)
+        return latency[0] if kind == "input" else latency[1]
+    return latency
+
+
+#LATENCY CALIBRATION
+def measure_round_trip_latency(samplerate, duration=1.0):
+    '''Plays a click through the speakers, records it with the mic and returns the delay in seconds
+
+    Needs speakers (not headphones) and a quiet room, returns None if the click was not heard.'''
+    import sounddevice as sd
+    n = int(samplerate * duration)
+    click = np.zeros(n, dtype=np.float32)
+    click_length = int(0.005 * samplerate)
+    t = np.arange(click_length) / samplerate
+    click[:click_length] = 0.5 * np.sin(2 * np.pi * 1000 * t) * np.hanning(click_length)
+
+    recording = sd.playrec(click, samplerate, channels=1, blocking=True)[:, 0]
+    size = 2 * n
+    xcorr = np.fft.irfft(np.fft.rfft(recording, size) * np.conj(np.fft.rfft(click, size)), size)[:n]
+    lag = int(np.argmax(np.abs(xcorr)))
+    if np.abs(xcorr[lag]) < 10 * np.median(np.abs(xcorr)) + 1e-9:
+        return None  # no clear peak, mic did not pick up the click
+    return lag / samplerate
+
+
+def load_round_trip_latency():
+    '''Round trip saved by the last calibration, None if never calibrated'''
+    if not os.path.exists(LATENCY_FILE):
+        return None
+    with open(LATENCY_FILE) as f:
+        return json.load(f).get("round_trip")
+
+
+if __name__ == "__main__":
+    # Calibrate once per audio setup: python alignment.py
+    import sounddevice as sd
+    samplerate = int(sd.query_devices(kind="input")["default_samplerate"])
+    print("Turn your speakers up and stay quiet...")
+    measurements = [m for m in (measure_round_trip_latency(samplerate) for _ in range(5)) if m is not None]
+    if not measurements:
+        print("Could not hear the click through the mic, using the latencies PortAudio reports.")
+        sys.exit(1)
+    round_trip = float(np.median(measurements))
+    with open(LATENCY_FILE, "w") as f:
+        json.dump({"round_trip": round_trip, "samplerate": samplerate}, f)
+    print(f"Round trip latency: {round_trip * 1000:.1f} ms (saved to {LATENCY_FILE})")
@@ -0,0 +1,205 @@
+import os
+import numpy as np
+from concurrent.futures import Future, ProcessPoolExecutor
+from separation import read_stem
+
+# ANALYSIS SETUP
+# Reference analysis of the separated vocals: pitch (f0), loudness (rms) and lyrics.
+# Shared by the karaoke (VoiceHero.py) and the batch ingest (batch_ingest.py).
+# librosa and Whisper (torch) are imported on first use, importing this module is cheap.
+HOP_SIZE = 512
+FMIN, FMAX = 50, 600  # Human singing range
+WHISPER_MODEL = "base"  # You can use "small", "medium", or "large" for better accuracy
+WHISPER_SAMPLERATE = 16000  # rate Whisper expects when we hand it arrays instead of files
+LOUDNESS_THRESHOLD = 7.0e-5  # rms below this is silence (same value as the game's loudness_threshold)
+MIN_GAP_SECONDS = 1.0  # quieter stretches shorter than this stay inside one region (Whisper wants whole lines)
+REGION_PAD_SECONDS = 0.25  # kept around every region so first / last words aren't clipped
+MIN_REGION_SECONDS = 0.3  # shorter blips are breaths or bleed from the backing track
+BLOCK_SECONDS = 10.0  # yin / rms run on blocks this long, so memory doesn't grow with the song (or a small hop)
+YIN_FRAME = 2048  # librosa.yin's frame_length, frames are centred so a block needs half of it on each side
+
+
+def extract_pitch_and_loudness(vocal_path="vocals.wav", hop_size=HOP_SIZE, fmin=FMIN, fmax=FMAX, samplerate=None):
+    '''Returns f0 and rms of the original vocals (one value per hop) and the sample rate
+
+    vocal_path can also be the mono vocals array at samplerate (EX: Stems.mono() straight from the separator).'''
+    if isinstance(vocal_path, str):
+        y, sr = read_stem(vocal_path)  # native sample rate, float WAV stems are memory-mapped
+    else:
+        y, sr = np.asarray(vocal_path, dtype=np.float32), samplerate
+    import librosa
+    # librosa.yin keeps every frame of the signal in memory (several GB for a long song at a small hop),
+    # so it runs on blocks of whole hops, each with enough audio on both sides for its edge frames.
+    # The frames come out the same as from one call on the whole song.
+    n_frames = 1 + len(y) // hop_size
+    f0 = np.zeros(n_frames, dtype=np.float64)
+    rms = np.zeros(n_frames, dtype=np.float32)
+    block = max(1, round(BLOCK_SECONDS * sr / hop_size)) * hop_size
+    context = -(-YIN_FRAME // 2 // hop_size) * hop_size
+    for start in range(0, len(y), block):
+        first, last = start // hop_size, min((start + block) // hop_size, n_frames)
+        if start + block >= len(y):
+            last = n_frames  # the final frame sits on the last sample
+        window_start = max(0, start - context)
+        window = np.asarray(y[window_start:start + block + context], dtype=np.float32)
+        skip = (start - window_start) // hop_size
+        block_f0 = librosa.yin(window, fmin=fmin, fmax=fmax, sr=sr, hop_length=hop_size) # Extract pitch from original vocals
+        block_rms = librosa.feature.rms(y=window, frame_length=hop_size, hop_length=hop_size)[0]  # one value per f0 frame
+        f0[first:last] = block_f0[skip:skip + last - first]
+        rms[first:last] = block_rms[skip:skip + last - first]
+    f0 = np.nan_to_num(f0)  # Replace NaN with 0 for unvoiced parts
+    return f0, rms, sr
+
+
+#WHISPER--LYRIC GENERATION 
+class TranscriptionService:
+    '''Keeps one Whisper model loaded and reuses it for every song
+
+    With use_worker=True the model lives in a separate worker process instead,
+    so submit() can transcribe in the background while we do other analysis.
+    The workers start (and load their models) as soon as the service is created.'''
+
+    def __init__(self, model_size=WHISPER_MODEL, use_worker=False, workers=1):
+        '''workers > 1 (with use_worker) transcribes that many regions at once, each process with its share of the cores'''
+        self.model_size = model_size
+        self.model = None  # loaded on first use
+        self.pool = None
+        if use_worker:
+            cores = int(os.environ.get("OMP_NUM_THREADS", 0)) or os.cpu_count() or 1  # batch workers get a share
+            threads = max(1, cores // workers) if workers > 1 else None
+            self.pool = ProcessPoolExecutor(max_workers=workers, initializer=_start_worker,
+                                            initargs=(model_size, threads))
+            for _ in range(workers):  # the pool starts a process per submit(), so start them all now to load the models
+                self.pool.submit(_worker_ready)
+
+    def load(self):
+        '''Loads the model once, later calls are free'''
+        if self.model is None:
+            import whisper
+            self.model = whisper.load_model(self.model_size)
+        return self.model
+
+    def transcribe(self, vocal_path, offset=0.0, word_timestamps=False):
+        '''Returns the lyric segments (list of dicts: start, end, text), waits until done
+
+        vocal_path can also be a mono float32 array at 16 kHz (WHISPER_SAMPLERATE), EX: one chunk
+        of a song, offset (seconds) is then added to the timestamps so they count from the song start.
+        word_timestamps=True also gives every segment its "words" (start, end, word).'''
+        if self.pool is not None:
+            return self.submit(vocal_path, offset, word_timestamps).result()
+        if word_timestamps:
+            result = self.load().transcribe(vocal_path, word_timestamps=True)
+        else:
+            result = self.load().transcribe(vocal_path)
+        segments = []
+        for seg in result["segments"]:
+            segment = {"start": seg["start"] + offset, "end": seg["end"] + offset, "text": seg["text"]}
+            if word_timestamps:
+                segment["words"] = [{"start": word["start"] + offset, "end": word["end"] + offset,
+                                     "word": word["word"]} for word in seg.get("words", [])]
+            segments.append(segment)
+        return segments
+
+    def submit(self, vocal_path, offset=0.0, word_timestamps=False):
+        '''Starts transcribing and returns a Future with the lyric segments'''
+        if self.pool is None:
+            future = Future()
+            future.set_result(self.transcribe(vocal_path, offset, word_timestamps))
+            return future
+        return self.pool.submit(_worker_transcribe, vocal_path, offset, word_timestamps)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+
+# Worker process side: the model is loaded once when the process starts
+_worker_service = None
+
+def _start_worker(model_size, threads=None):
+    global _worker_service
+    if threads:  # several workers share the cores
+        import torch
+        torch.set_num_threads(threads)
+    _worker_service = TranscriptionService(model_size)
+    _worker_service.load()
+
+def _worker_ready():
+    return True  # the initializer did the work
+
+def _worker_transcribe(vocal_path, offset=0.0, word_timestamps=False):
+    return _worker_service.transcribe(vocal_path, offset, word_timestamps)
+
+
+_services = {}  # one service per model size for this process
+
+def get_transcription_service(model_size=WHISPER_MODEL):
+    '''Shared in-process service, so the model is only loaded once per process'''
+    if model_size not in _services:
+        _services[model_size] = TranscriptionService(model_size)
+    return _services[model_size]
+
+
+#VOICE ACTIVITY -- ONLY TRANSCRIBE WHERE SOMEBODY SINGS
+def whisper_workers():
+    '''Whisper processes for one song: half the cores we may use (at most 4, every one holds a model)'''
+    cores = int(os.environ.get("OMP_NUM_THREADS", 0)) or os.cpu_count() or 1
+    return max(1, min(4, cores // 2))
+
+
+def voiced_regions(rms, f0, samplerate, hop_size=HOP_SIZE, threshold=LOUDNESS_THRESHOLD,
+                   min_gap=MIN_GAP_SECONDS, pad=REGION_PAD_SECONDS, min_length=MIN_REGION_SECONDS):
+    '''(start, end) seconds of the parts of the vocal stem with singing, from the rms / f0 we already have
+
+    Instrumental stretches (the separated vocals are near silent there) are left out, gaps
+    shorter than min_gap are bridged so a line is not cut in the middle.'''
+    n = min(len(rms), len(f0))
+    active = (np.asarray(rms[:n]) > threshold) & (np.asarray(f0[:n]) > 0)
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], active.astype(np.int8), [0]])))
+    frame_seconds = hop_size / samplerate
+    regions = []
+    for start, end in zip(edges[::2] * frame_seconds, edges[1::2] * frame_seconds):
+        if regions and start - regions[-1][1] < min_gap:
+            regions[-1][1] = end
+        else:
+            regions.append([start, end])
+    duration = n * frame_seconds
+    return [(max(0.0, start - pad), min(duration, end + pad)) for start, end in regions if end - start >= min_length]
+
+
+def transcribe_voiced(vocals, rms, f0, samplerate, hop_size=HOP_SIZE, model_size=WHISPER_MODEL, workers=None,
+                      word_timestamps=False, threshold=LOUDNESS_THRESHOLD, service=None):
+    '''Lyric segments of the voiced regions only, transcribed in parallel, timestamps count from the song start
+
+    vocals is the vocal stem (file, or mono array at samplerate). service is a TranscriptionService
+    to use (EX: one started earlier so the models load while we extract pitch), else one with
+    workers processes (default: whisper_workers()) is made and closed here.'''
+    import librosa
+    if isinstance(vocals, str):
+        audio, _ = librosa.load(vocals, sr=WHISPER_SAMPLERATE, mono=True)
+    else:
+        audio = librosa.resample(np.asarray(vocals, dtype=np.float32), orig_sr=samplerate, target_sr=WHISPER_SAMPLERATE)
+    regions = voiced_regions(rms, f0, samplerate, hop_size, threshold)
+    if not regions:
+        return []
+    own_service = service is None
+    if own_service:
+        service = TranscriptionService(model_size, use_worker=True, workers=min(workers or whisper_workers(), len(regions)))
+    try:
+        futures = [service.submit(audio[int(start * WHISPER_SAMPLERATE):int(end * WHISPER_SAMPLERATE)],
+                                  offset=start, word_timestamps=word_timestamps) for start, end in regions]
+        return [segment for future in futures for segment in future.result()]  # regions are in song order
+    finally:
+        if own_service:
+            service.close()
+
+
+def generate_lyrics_with_whisper(vocal_path="vocals.wav", model_size=WHISPER_MODEL, samplerate=None):
+    '''Transcribes the lyrics from the original Vocals (a file, or a mono array at samplerate)'''
+    print("Transcribing vocals with Whisper... this may take a moment.")
+    if not isinstance(vocal_path, str):
+        import librosa
+        vocal_path = librosa.resample(np.asarray(vocal_path, dtype=np.float32), orig_sr=samplerate,
+                                      target_sr=WHISPER_SAMPLERATE)
+    return get_transcription_service(model_size).transcribe(vocal_path)
@@ -0,0 +1,261 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from song_cache import song_id
+from reference_file import write_reference
+from separation import (DEMUCS_MODEL, PREVIEW_MODEL, STEMS, ARCHIVE_STEMS, run_demucs, run_demucs_parallel,
+                        separate_in_process, export_mp3)
+from analysis import FMIN, FMAX, WHISPER_MODEL, extract_pitch_and_loudness, transcribe_voiced
+from latency_profiles import REFERENCE_HOP
+
+# BATCH INGEST
+# Headless version of the "Do you want to sing a new song?" flow for a whole library.
+# Every song gets its own folder in the library instead of stems at fixed names in the cwd:
+#
+#   library/<song name>-<hash>/
+#       vocals.wav, no_vocals.wav   float32 stems from Demucs (+ vocals.mp3, no_vocals.mp3 with --archive-mp3)
+#       f0.npy, rms.npy, sr.json    reference pitch, loudness and sample rate (every 128 samples, any latency profile
+#                                   takes its frames from these, see latency_profiles.py)
+#       lyrics.json                 Whisper segments (+ per-word timing with --word-timestamps)
+#       reference.vhref             all of the above in the memory-mapped game format (see reference_file.py)
+#       meta.json                   settings + stage timings, written last (= song is done)
+#
+# Each stage is skipped when its files are already there, so a crashed or
+# interrupted run just picks up where it left off when started again.
+#
+# EX: python batch_ingest.py ~/Music/new_songs --library library
+#     python batch_ingest.py manifest.txt --workers 4
+#     python batch_ingest.py live_recordings --parallel-separation --memory-gb 6   (long tracks, 8 GB node)
+#     python batch_ingest.py ~/Music/new_songs --in-process   (stems go from Demucs to the analysis in memory)
+#     python batch_ingest.py ~/Music/new_songs --word-timestamps --whisper-workers 2
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".flac", ".ogg", ".m4a")
+STAGES = ["separation", "pitch", "lyrics"]
+
+
+def find_songs(source):
+    '''Lists the songs to ingest from a folder (searched recursively) or a manifest file (one path per line)'''
+    if os.path.isdir(source):
+        songs = []
+        for dirpath, _, filenames in os.walk(source):
+            songs += [os.path.join(dirpath, name) for name in sorted(filenames)
+                      if name.lower().endswith(AUDIO_EXTENSIONS)]
+        return sorted(songs)
+
+    base_dir = os.path.dirname(os.path.abspath(source))
+    songs = []
+    with open(source) as manifest:
+        for line in manifest:
+            line = line.strip()
+            if line and not line.startswith("#"):  # skip blank lines and comments
+                songs.append(line if os.path.isabs(line) else os.path.join(base_dir, line))
+    return songs
+
+
+def _save(path, write_fn):
+    '''Writes to a temp file and renames it, so a half written file never looks finished'''
+    tmp_path = path + ".tmp"
+    write_fn(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _save_array(path, array):
+    def write(tmp):
+        with open(tmp, "wb") as f:
+            np.save(f, array)
+    _save(path, write)
+
+
+def _save_json(path, data):
+    def write(tmp):
+        with open(tmp, "w") as f:
+            json.dump(data, f, indent=2)
+    _save(path, write)
+
+
+def _init_worker(threads):
+    '''Limits the math libraries to their share of the cores (the pool already uses the rest)'''
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "NUMBA_NUM_THREADS"):
+        os.environ[var] = str(threads)  # Demucs runs as a child process and inherits these
+
+
+def ingest_song(input_file, library_dir, settings, memory_budget=None, in_process=False, archive_mp3=False,
+                whisper_workers=None):
+    '''Runs separation, pitch/loudness extraction and transcription for one song
+
+    memory_budget (bytes) separates the song in parallel segments within that budget instead of
+    one Demucs run. in_process=True runs Demucs in this process and hands the stems to the analysis
+    as arrays. archive_mp3=True also keeps mp3 copies of the stems. whisper_workers is the number
+    of processes transcribing the voiced regions of the song (default: see transcribe_voiced).
+    Returns a summary dict with the time spent in each stage (0 for skipped stages).'''
+    song_dir = os.path.join(library_dir, song_id(input_file))
+    meta_path = os.path.join(song_dir, "meta.json")
+    timings = {stage: 0.0 for stage in STAGES}
+
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get("settings") == settings:
+            return {"song": input_file, "dir": song_dir, "skipped": True, "timings": timings}
+        # Settings changed since last time -> redo the analysis, the stems are still good
+        # unless the Demucs model changed too
+        for name in ["f0.npy", "rms.npy", "sr.json", "lyrics.json", "reference.vhref", "meta.json"]:
+            if os.path.exists(os.path.join(song_dir, name)):
+                os.remove(os.path.join(song_dir, name))
+        if meta.get("settings", {}).get("demucs_model") != settings["demucs_model"]:
+            for stem in STEMS + ARCHIVE_STEMS:
+                if os.path.exists(os.path.join(song_dir, stem)):
+                    os.remove(os.path.join(song_dir, stem))
+    os.makedirs(song_dir, exist_ok=True)
+
+    # SEPARATION
+    vocal_path = os.path.join(song_dir, "vocals.wav")
+    stems = None  # in memory when separated in this process, the analysis then skips reading the files
+    separated = all(os.path.exists(os.path.join(song_dir, stem)) for stem in STEMS)
+    if not separated and in_process:
+        start = time.perf_counter()
+        stems = separate_in_process(input_file, settings["demucs_model"])
+        stems.save(song_dir)
+        timings["separation"] = time.perf_counter() - start
+    elif not separated:
+        start = time.perf_counter()
+        work_dir = tempfile.mkdtemp(prefix="demucs_")
+        try:
+            if memory_budget:
+                demucs_output_dir = run_demucs_parallel(input_file, work_dir, settings["demucs_model"],
+                                                        memory_budget=memory_budget)
+            else:
+                demucs_output_dir = run_demucs(input_file, work_dir, settings["demucs_model"])
+            for stem in STEMS:
+                shutil.move(os.path.join(demucs_output_dir, stem), os.path.join(song_dir, stem + ".tmp"))
+                os.replace(os.path.join(song_dir, stem + ".tmp"), os.path.join(song_dir, stem))
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        timings["separation"] = time.perf_counter() - start
+    if archive_mp3 and not all(os.path.exists(os.path.join(song_dir, stem)) for stem in ARCHIVE_STEMS):
+        export_mp3(song_dir)
+    vocals, vocals_samplerate = (stems.mono("vocals"), stems.samplerate) if stems is not None else (vocal_path, None)
+
+    # PITCH + LOUDNESS
+    f0_path, rms_path = os.path.join(song_dir, "f0.npy"), os.path.join(song_dir, "rms.npy")
+    sr_path = os.path.join(song_dir, "sr.json")
+    if not (os.path.exists(f0_path) and os.path.exists(rms_path) and os.path.exists(sr_path)):
+        start = time.perf_counter()
+        f0, rms, sr = extract_pitch_and_loudness(vocals, settings["hop_size"], settings["fmin"], settings["fmax"],
+                                                 samplerate=vocals_samplerate)
+        _save_array(f0_path, f0)
+        _save_array(rms_path, rms)
+        _save_json(sr_path, {"sr": sr})
+        timings["pitch"] = time.perf_counter() - start
+    with open(sr_path) as f:
+        sr = json.load(f)["sr"]
+
+    # LYRICS (only the voiced regions, found with the rms / f0 from above)
+    lyrics_path = os.path.join(song_dir, "lyrics.json")
+    if not os.path.exists(lyrics_path):
+        start = time.perf_counter()
+        _save_json(lyrics_path, transcribe_voiced(vocals, np.load(rms_path), np.load(f0_path), sr, settings["hop_size"],
+                                                  settings["whisper_model"], whisper_workers,
+                                                  word_timestamps=settings.get("word_timestamps", False)))
+        timings["lyrics"] = time.perf_counter() - start
+
+    # REFERENCE FILE (what the game and the scoring tools open)
+    with open(lyrics_path) as f:
+        lyrics = json.load(f)
+    write_reference(os.path.join(song_dir, "reference.vhref"), np.load(f0_path), np.load(rms_path), lyrics, sr,
+                    settings["hop_size"], **{key: value for key, value in settings.items() if key != "hop_size"})
+
+    _save_json(meta_path, {"source": os.path.abspath(input_file), "sr": sr,
+                           "settings": settings, "timings": timings})
+    return {"song": input_file, "dir": song_dir, "skipped": False, "timings": timings}
+
+
+def print_summary(results, failures, elapsed):
+    '''Prints songs/hour and the time spent per stage'''
+    processed = [r for r in results if not r["skipped"]]
+    skipped = len(results) - len(processed)
+
+    print("\nBATCH SUMMARY")
+    print(f"  processed: {len(processed)}  skipped (already done): {skipped}  failed: {len(failures)}")
+    print(f"  wall time: {elapsed:.1f} s")
+    if processed and elapsed > 0:
+        print(f"  throughput: {len(processed) / elapsed * 3600:.1f} songs/hour")
+    for stage in STAGES:
+        times = [r["timings"][stage] for r in processed if r["timings"][stage] > 0]
+        if times:
+            print(f"  {stage:<10} total {sum(times):8.1f} s | mean {np.mean(times):6.1f} s/song | {len(times)} songs")
+    for song, error in failures:
+        print(f"  FAILED {song}: {error}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Separate, analyse and transcribe a whole folder of songs.")
+    parser.add_argument("source", help="folder with songs, or a manifest file with one song path per line")
+    parser.add_argument("--library", default="library", help="where the per-song folders go (default: ./library)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="songs processed at the same time (default: half the CPU cores)")
+    parser.add_argument("--demucs-model", default=DEMUCS_MODEL)
+    parser.add_argument("--preview", action="store_true", help=f"fast, lighter separation with {PREVIEW_MODEL}")
+    parser.add_argument("--parallel-separation", action="store_true",
+                        help="separate each song in overlapping segments on all cores, one song at a time")
+    parser.add_argument("--memory-gb", type=float, default=6.0, help="memory budget of --parallel-separation")
+    parser.add_argument("--in-process", action="store_true",
+                        help="run Demucs inside the workers and pass the stems to the analysis in memory")
+    parser.add_argument("--archive-mp3", action="store_true", help="also keep mp3 copies of the WAV stems")
+    parser.add_argument("--whisper-model", default=WHISPER_MODEL)
+    parser.add_argument("--whisper-workers", type=int, default=None,
+                        help="Whisper processes per song, each takes its share of the song's threads")
+    parser.add_argument("--word-timestamps", action="store_true", help="also keep the timing of every sung word")
+    parser.add_argument("--hop-size", type=int, default=REFERENCE_HOP,
+                        help="reference resolution, the latency profiles' blocks must be multiples of it")
+    parser.add_argument("--fmin", type=float, default=FMIN)
+    parser.add_argument("--fmax", type=float, default=FMAX)
+    args = parser.parse_args(argv)
+
+    songs = find_songs(args.source)
+    if not songs:
+        print(f"No songs found in {args.source}")
+        return 1
+    os.makedirs(args.library, exist_ok=True)
+
+    cores = os.cpu_count() or 1
+    if args.parallel_separation:  # the cores go to the segments of one song instead of several songs
+        workers = 1
+        memory_budget = args.memory_gb * 1024 ** 3
+    else:
+        workers = max(1, min(args.workers or cores // 2, len(songs)))
+        memory_budget = None
+    threads = max(1, cores // workers)
+    settings = {"demucs_model": PREVIEW_MODEL if args.preview else args.demucs_model, "whisper_model": args.whisper_model,
+                "hop_size": args.hop_size, "fmin": args.fmin, "fmax": args.fmax}
+    if args.word_timestamps:  # only in the settings when on, so libraries ingested without it stay valid
+        settings["word_timestamps"] = True
+    print(f"INGESTING {len(songs)} SONGS INTO {args.library} ({workers} workers x {threads} threads)")
+
+    results, failures = [], []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(threads,)) as pool:
+        futures = {pool.submit(ingest_song, song, args.library, settings, memory_budget,
+                                         args.in_process, args.archive_mp3, args.whisper_workers): song for song in songs}
+        for done, future in enumerate(as_completed(futures), 1):
+            song = futures[future]
+            try:
+                result = future.result()
+                results.append(result)
+                status = "skipped" if result["skipped"] else f"{sum(result['timings'].values()):.1f} s"
+                print(f"[{done}/{len(songs)}] {os.path.basename(song)} ({status})")
+            except Exception as error:
+                failures.append((song, str(error)))
+                print(f"[{done}/{len(songs)}] {os.path.basename(song)} FAILED: {error}")
+
+    print_summary(results, failures, time.perf_counter() - start)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,40 +1,31 @@
-import sounddevice as sd
-import aubio
+import sys
 import numpy as np
+from reference_file import ReferenceFile
+from session import Session, PitchTracker, default_samplerate, hz_to_midi, frequency_to_note
+from latency_profiles import get_profile, decimate_f0, decimation
 
 
 # boring stuff
-BUFFER_SIZE = 1024 # samples per buffer
-HOP_SIZE = 512 # step size between pitch analysis's(?) smaller means more frequent, may need to optimize this value
-DEVICE_INFO = sd.query_devices(kind='input')
-SAMPLERATE = int(DEVICE_INFO['default_samplerate'])
-
-ref_pitches = # pre proccesed reference track
+PROFILE = get_profile("classic") # latency profile, sets both numbers below (see latency_profiles.py)
+BUFFER_SIZE = PROFILE.win_size # samples per buffer
+HOP_SIZE = PROFILE.hop_size # step size between pitch analysis's(?) smaller means more frequent
+SAMPLERATE = default_samplerate()
+
+# pre proccesed reference track - EX: python comparison_algorithm.py library/song/reference.vhref (or an f0.npy)
+ref_path = sys.argv[1]
+if ref_path.endswith(".vhref"): # reference frames taken down to one per HOP_SIZE
+    reference = ReferenceFile(ref_path)
+    ref_pitches = decimate_f0(reference.f0, decimation(reference.hop_size, HOP_SIZE))
+else: # f0.npy has no hop size in it, must already be at HOP_SIZE
+    ref_pitches = np.load(ref_path)
 
 scores = [] # keeps track of all scores to give final rating at the end, 1 score per frame
 frame_index = 0 # keeps track of where we are in the ref track, to compare against our most recent user input
 
-pitch_detector = aubio.pitch("yin", BUFFER_SIZE, HOP_SIZE, SAMPLERATE)
-pitch_detector.set_unit("Hz")
-pitch_detector.set_tolerance(0.8) # might need to fiddle with tolerance
-
-note_names = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"] # can either compare notes or freq
-
-# midi notes are better for our purposes 
-def hz_to_midi(frequency):
-    if frequency <= 0:
-        return None
-    return 69 + 12 * np.log2(frequency / 440.0)
+pitch_tracker = PitchTracker(SAMPLERATE, HOP_SIZE, BUFFER_SIZE, tolerance=0.8) # might need to fiddle with tolerance
 
-# spits out note and octave from given frequency
+# midi notes are better for our purposes, hz_to_midi / frequency_to_note live in session.py
 # even if we compare frequences might be most legible for users to get note feedback during gameplay
-def frequency_to_note(frequency): 
-    if frequency <= 0:
-        return "N/A"
-    midi_note = round(hz_to_midi(frequency))
-    note_index = midi_note % 12
-    octave = (midi_note // 12) - 1
-    return f"{note_names[note_index]}{octave}"
 
 # compares incoming user pitch to the ref track and outputs current score while also
 # keeping track of all scores in the scores array defined globally
@@ -62,11 +53,9 @@ def callback(indata, frames, time, status):
     if status:
         print(f"Stream status: {status}") # for errors
 
-    mono_audio = np.mean(indata, axis=1) # collapse audio to mono
-    pitch = pitch_detector(mono_audio)[0] # estimate pitch via aubio
-    confidence = pitch_detector.get_confidence() # aubio confidence
+    pitch, confidence, voiced = pitch_tracker.process(indata) # mono + aubio pitch and confidence
 
-    if confidence > 0.8 and 50 <= pitch <= 600: # only processes if high confidence and pitch is in human vocal range
+    if voiced: # only processes if high confidence and pitch is in human vocal range
         user_note = frequency_to_note(pitch) # freq to note for real time visual feedback (personally think a note is better for realtime feedback
                                              # as its easier to read than a 3 digit number)
         ref_note = frequency_to_note(ref_pitches[frame_index]) if frame_index < len(ref_pitches) else "N/A"
@@ -80,11 +69,8 @@ def callback(indata, frames, time, status):
 
 print("Start Singing!\n")
 # live input stream
-try:
-    # callback gets called (or should) everytime the microphone stream gets updated
-    with sd.InputStream(callback=callback, samplerate=SAMPLERATE, channels=1, blocksize=HOP_SIZE):
-        while True:
-            pass # aslong as mic is running so will our program
-except KeyboardInterrupt: # prints final scores upon completion
-    final_score = round(np.mean(scores) * 100, 2) if scores else 0
-    print(f"Final Score: {final_score}/100")
+# callback gets called everytime the microphone stream gets updated, the main thread sleeps until Ctrl+C
+Session(callback, SAMPLERATE, HOP_SIZE).run()
+# prints final scores upon completion
+final_score = round(np.mean(scores) * 100, 2) if scores else 0
+print(f"Final Score: {final_score}/100")
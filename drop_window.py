@@ -0,0 +1,222 @@
+import os
+import sys
+import queue
+from separation import separate_song, SeparationCancelled
+from PyQt6.QtWidgets import QApplication, QWidget, QLabel, QVBoxLayout, QPushButton, QFileDialog, QProgressBar
+from PyQt6.QtGui import QDragEnterEvent, QDropEvent
+from PyQt6.QtCore import Qt, QThread, pyqtSignal
+
+# SONG PICKER (GUI)
+# The drag and drop window of VoiceHero.py and the thread that runs Demucs behind it. It lives
+# in its own module so Qt is only imported when a new song has to be picked: singing a song
+# that is already in the cache goes straight to the karaoke without loading any of this.
+
+
+#CLASS -- SOURCE SEPERATION (BACKGROUND WORKER)
+class SeparationWorker(QThread):
+    '''Runs Demucs on queued songs one after another, off the GUI thread'''
+    progress = pyqtSignal(str, int)  # file, percent
+    file_done = pyqtSignal(str, str)  # file, folder with its stems
+    file_failed = pyqtSignal(str, str)  # file, error message
+
+    def __init__(self, cache, model, parallel=False, memory_budget=None):
+        '''Stems go to cache, separated with the Demucs model (parallel = segments on all cores, see separation.py)'''
+        super().__init__()
+        self.cache = cache
+        self.model = model
+        self.parallel = parallel
+        self.memory_budget = memory_budget
+        self.jobs = queue.Queue()
+        self.process = None  # Demucs process currently running
+        self.added = 0  # jobs queued so far, each job is numbered in that order
+        self.current = -1  # number of the job running now
+        self.cancelled_below = 0  # jobs numbered below this were cancelled, songs queued later still run
+
+    def add(self, input_file, dest_dir=None):
+        '''Queues a song, dest_dir is where its stems get copied when done (None = they stay in the cache)'''
+        self.jobs.put((self.added, input_file, dest_dir))
+        self.added += 1
+
+    def run(self):
+        '''Takes songs off the queue until stop() is called'''
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            self.current, input_file, dest_dir = job
+            if self.current < self.cancelled_below:
+                self.file_failed.emit(input_file, "cancelled")
+                continue
+            try:
+                key = separate_song(input_file, self.cache, dest_dir, self.model,
+                                    on_progress=lambda percent: self.progress.emit(input_file, percent),
+                                    on_start=self._set_process, parallel=self.parallel,
+                                    memory_budget=self.memory_budget)
+                self.file_done.emit(input_file, self.cache.entry_dir(key))
+            except SeparationCancelled:
+                self.file_failed.emit(input_file, "cancelled")
+            except Exception as error:
+                self.file_failed.emit(input_file, str(error))
+            self.process = None
+
+    def _set_process(self, process):
+        self.process = process
+        if self.current < self.cancelled_below:  # cancel() came in before the process existed
+            process.terminate()
+
+    def cancel(self):
+        '''Kills the running separation and drops everything queued so far (songs added afterwards run)'''
+        self.cancelled_below = self.added
+        if self.process is not None:
+            self.process.terminate()
+
+    def stop(self):
+        '''Lets the thread finish once the queue is empty'''
+        self.jobs.put(None)
+
+
+#CLASS -- SOURCE SEPERATION 
+class DragDropWindow(QWidget):
+    def __init__(self, cache, model, progressive=False, parallel=False, memory_budget=None, on_song=None):
+        '''initializes drag and drop window (label and button)
+
+        progressive=True only picks the song (it gets separated while singing), otherwise every
+        dropped song is separated into cache and on_song(stem folder, song file) is called for the one we sing.'''
+
+        super().__init__()
+        self.progressive = progressive
+        self.on_song = on_song
+        self.setWindowTitle("Drop Window") #set title
+        self.setGeometry(500, 500, 500, 500) #set size and position
+
+        #instert prompt for user 
+        self.label = QLabel("Drag and drop the song you want to sing!", self)
+        self.label.setAlignment(Qt.AlignmentFlag.AlignCenter) #align text
+
+        #manually browse button 
+        self.button = QPushButton("Browse Files", self)
+        self.button.clicked.connect(self.browse_file)
+
+        #cancel button, stops the running separation and empties the queue
+        self.cancel_button = QPushButton("Cancel", self)
+        self.cancel_button.clicked.connect(self.cancel)
+        self.cancel_button.setEnabled(False)
+
+        #start button, sing as soon as our song is separated (the rest of the queue gets cancelled)
+        self.start_button = QPushButton("Start Singing", self)
+        self.start_button.clicked.connect(self.close)
+        self.start_button.setEnabled(False)
+
+        layout = QVBoxLayout() #vertical layout
+        layout.addWidget(self.label) #label for layout 
+        layout.addWidget(self.button) # add button
+        layout.addWidget(self.start_button) # add start button
+        layout.addWidget(self.cancel_button) # add cancel button
+        self.setLayout(layout) #set layout 
+
+        # Enable drag-and-drop
+        self.setAcceptDrops(True)
+
+        # Separation runs in the background, one progress bar per queued song
+        self.progress_bars = {}
+        self.pending = 0
+        self.song_selected = False  # first song queued is the one we sing
+        self.sung_file = None
+        self.song_dir = None  # its stem folder once separated
+        self.selected_file = None  # progressive mode: the song to separate while singing
+        self.worker = SeparationWorker(cache, model, parallel, memory_budget)
+        self.worker.progress.connect(self.update_progress)
+        self.worker.file_done.connect(self.file_done)
+        self.worker.file_failed.connect(self.file_failed)
+        self.worker.start()
+
+    def dragEnterEvent(self, event: QDragEnterEvent):
+        '''Handles when file is dragged to the window'''
+        if event.mimeData().hasUrls(): # check for file URL 
+            event.acceptProposedAction() # accept file if it has file URL
+
+    def dropEvent(self, event: QDropEvent):
+        """Handles file drop event"""
+        files = [url.toLocalFile() for url in event.mimeData().urls()] #get the local file paths
+        if files:
+            self.separate_audio(files) #queue every dropped file for source seperation 
+
+    def browse_file(self):
+        """Opens file dialog for selecting one or more audio files"""
+        file_paths, _ = QFileDialog.getOpenFileNames(self, "Select Audio Files", "", "Audio Files (*.wav *.mp3 *.flac)")
+        if file_paths:
+            self.separate_audio(file_paths)
+
+    def separate_audio(self, input_files):
+        """Queues songs for Demucs, the first one is the one we sing"""
+        if self.progressive:  # the song gets separated chunk by chunk while we sing instead
+            self.selected_file = input_files[0]
+            self.close()
+            return
+        for input_file in input_files:
+            if input_file in self.progress_bars:  # dropped twice, it already has its bar and its job
+                continue
+            bar = QProgressBar(self)
+            bar.setFormat(f"{os.path.basename(input_file)} - %p%")
+            self.layout().addWidget(bar)
+            self.progress_bars[input_file] = bar
+
+            if not self.song_selected:
+                self.label.setText(f"File Selected: {input_file}") # label with new path
+                self.song_selected = True
+                self.sung_file = input_file
+            self.pending += 1
+            self.worker.add(input_file)
+        self.cancel_button.setEnabled(True)
+        print("STARTING SOURCE SEPERATION")
+
+    def update_progress(self, input_file, percent):
+        self.progress_bars[input_file].setValue(percent)
+
+    def file_done(self, input_file, song_dir):
+        self.progress_bars[input_file].setValue(100)
+        if input_file == self.sung_file:
+            self.song_dir = song_dir
+            if self.on_song:
+                self.on_song(song_dir, input_file)
+            self.label.setText(f"Ready to sing: {os.path.basename(input_file)}")
+            self.start_button.setEnabled(True)
+        self.job_finished()
+
+    def file_failed(self, input_file, error):
+        bar = self.progress_bars.pop(input_file)  # the error stays on screen, dropping the song again retries it
+        bar.setFormat(f"{os.path.basename(input_file)} - {error}")
+        print(f"Separation failed for {input_file}: {error}")
+        if input_file == self.sung_file:  # the next song dropped is the one we sing
+            self.song_selected = False
+            self.sung_file = None
+            self.label.setText(f"{os.path.basename(input_file)} failed ({error}), drop a song to sing")
+        self.job_finished()
+
+    def job_finished(self):
+        '''Closes the window once every queued song is done and ours made it (Start Singing closes it earlier)'''
+        self.pending -= 1
+        if self.pending == 0 and self.song_dir is not None:
+            self.close()
+
+    def cancel(self):
+        self.label.setText("Cancelling...")
+        self.worker.cancel()
+
+    def closeEvent(self, event):
+        '''Stops the worker thread before the window goes away, songs still queued are cancelled'''
+        if self.pending:
+            print(f"Cancelling {self.pending} queued song(s), drop them again to separate them")
+            self.worker.cancel()
+        self.worker.stop()
+        self.worker.wait()
+        event.accept()
+
+
+def pick_song(cache, model, progressive=False, parallel=False, memory_budget=None, on_song=None):
+    '''Shows the window until the songs are separated (or it is closed) and returns it'''
+    app = QApplication.instance() or QApplication(sys.argv)
+    window = DragDropWindow(cache, model, progressive, parallel, memory_budget, on_song)
+    window.show()
+    app.exec()  # Blocks execution until the window is closed
+    return window
@@ -0,0 +1,120 @@
+import csv
+import json
+import time
+import numpy as np
+
+# CALLBACK INSTRUMENTATION
+# Every mic block has hop_size / samplerate seconds (11.6 ms at 512 / 44.1k) to be handled
+# before the next one arrives. The profiler times each stage of the callback into a ring
+# buffer that is allocated up front (the audio thread only writes into it, nothing grows),
+# counts the xruns PortAudio reports through the status flags and, at the end of the
+# session, reports percentiles per stage and how often a block went over its deadline.
+#
+#   profiler.begin()            <- Session does begin/end around the whole callback
+#   ...downmix...               profiler.mark(DOWNMIX)
+#   ...pitch detection...       profiler.mark(PITCH)
+#   ...                         (RECORD = take_recorder.TakeRecorder.push, 0 when not recording)
+#   profiler.end()
+STAGES = ["downmix", "pitch", "lookup", "scoring", "enqueue", "record"]
+DOWNMIX, PITCH, LOOKUP, SCORING, ENQUEUE, RECORD = range(len(STAGES))
+CAPACITY = 1 << 16  # blocks kept, ~12 minutes at 86 blocks a second
+XRUN_FLAGS = ["input_overflow", "input_underflow", "output_overflow", "output_underflow"]
+PERCENTILES = [50, 90, 99, 99.9]
+
+
+class CallbackProfiler:
+    def __init__(self, deadline, stages=STAGES, capacity=CAPACITY):
+        '''deadline is the time budget of one block in seconds (hop_size / samplerate)'''
+        self.deadline = deadline
+        self.deadline_ns = int(deadline * 1e9)
+        self.stages = list(stages)
+        self.capacity = capacity
+        self.timings = np.zeros((capacity, len(self.stages) + 1), dtype=np.int64)  # ns per stage + total
+        self.xruns = np.zeros(len(XRUN_FLAGS), dtype=np.int64)
+        self.blocks = 0  # every block ever timed, the ring buffer keeps the last capacity of them
+        self.deadline_misses = 0
+        self.worst_ns = 0
+        self._row = 0
+        self._start = 0
+        self._last = 0
+
+    # AUDIO THREAD SIDE -- writes into preallocated arrays only
+    def begin(self):
+        self._row = self.blocks % self.capacity
+        self.timings[self._row] = 0  # stages skipped in this block stay 0
+        self._start = self._last = time.perf_counter_ns()
+
+    def mark(self, stage):
+        '''Ends one stage, its time is measured from the previous mark (or begin)'''
+        now = time.perf_counter_ns()
+        self.timings[self._row, stage] = now - self._last
+        self._last = now
+
+    def end(self):
+        total = time.perf_counter_ns() - self._start
+        self.timings[self._row, -1] = total
+        if total > self.deadline_ns:
+            self.deadline_misses += 1
+        if total > self.worst_ns:
+            self.worst_ns = total
+        self.blocks += 1
+
+    def count_status(self, status):
+        '''Counts the xrun flags of a stream status (sounddevice.CallbackFlags)'''
+        for i, flag in enumerate(XRUN_FLAGS):
+            if getattr(status, flag, False):
+                self.xruns[i] += 1
+
+    # REPORTING (after the session)
+    def _recorded(self):
+        '''Recorded rows, oldest first'''
+        if self.blocks <= self.capacity:
+            return self.timings[:self.blocks]
+        start = self.blocks % self.capacity
+        return np.concatenate([self.timings[start:], self.timings[:start]])
+
+    def report(self):
+        '''Percentiles (us) per stage and in total, deadline misses and xrun counts'''
+        rows = self._recorded() / 1000.0
+        names = self.stages + ["total"]
+        stages = {}
+        for i, name in enumerate(names):
+            if len(rows):
+                stages[name] = {f"p{p:g}": float(np.percentile(rows[:, i], p)) for p in PERCENTILES}
+                stages[name]["mean"] = float(rows[:, i].mean())
+        return {
+            "blocks": self.blocks,
+            "deadline_us": self.deadline * 1e6,
+            "deadline_misses": self.deadline_misses,
+            "deadline_miss_rate": self.deadline_misses / self.blocks if self.blocks else 0.0,
+            "worst_us": self.worst_ns / 1000.0,
+            "xruns": {flag: int(count) for flag, count in zip(XRUN_FLAGS, self.xruns)},
+            "stages_us": stages,
+        }
+
+    def summary(self):
+        '''A few lines for the terminal'''
+        report = self.report()
+        lines = [f"callback: {report['blocks']} blocks, deadline {report['deadline_us']:.0f} us, "
+                 f"{report['deadline_misses']} missed ({report['deadline_miss_rate'] * 100:.2f}%), "
+                 f"worst {report['worst_us']:.0f} us"]
+        for name, values in report["stages_us"].items():
+            lines.append(f"  {name:<8} p50 {values['p50']:8.1f} us  p99 {values['p99']:8.1f} us  "
+                         f"p99.9 {values['p99.9']:8.1f} us")
+        xruns = ", ".join(f"{flag} {count}" for flag, count in report["xruns"].items())
+        lines.append(f"  xruns: {xruns}")
+        return "\n".join(lines)
+
+    def export(self, path):
+        '''Writes the report as .json, or every recorded block as .csv (microseconds)'''
+        if path.endswith(".csv"):
+            with open(path, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(["block"] + [f"{name}_us" for name in self.stages + ["total"]])
+                first = max(0, self.blocks - self.capacity)
+                for i, row in enumerate(self._recorded()):
+                    writer.writerow([first + i] + [f"{value / 1000:.3f}" for value in row])
+        else:
+            with open(path, "w") as f:
+                json.dump(self.report(), f, indent=2)
+        return path
@@ -0,0 +1,171 @@
+import sys
+import json
+import argparse
+import numpy as np
+from note_index import NoteIndex
+
+# LATENCY PROFILES
+# How fast the game reacts comes down to two numbers: the mic block (= one reference frame)
+# and the pitch detector window. A profile sets both, and the reference frame rate with them:
+#
+#   profile      block  window   frame every   detector looks back
+#   ultra-low     128     512      2.9 ms         11.6 ms            (44.1 kHz)
+#   balanced      256    1024      5.8 ms         23.2 ms
+#   classic       512    1024     11.6 ms         23.2 ms            what the game always used
+#   efficient     512    2048     11.6 ms         46.4 ms            steadier pitch on low voices, half the callbacks of balanced
+#
+# The reference vocals are analysed once, at REFERENCE_HOP (the smallest block of any profile),
+# and every profile takes its frames from that: f0 keeps every n-th value (librosa.yin centres
+# frame i on sample i * hop, so that is the value a coarser analysis gives), rms averages the
+# power of the n frames it covers and notes get their onsets / offsets divided. Switching
+# profile never means analysing the song again.
+#
+# EX: python latency_profiles.py                  (feedback latency and CPU of every profile)
+#     python latency_profiles.py --profiles ultra-low balanced --method yinfast
+REFERENCE_HOP = 128
+
+
+class LatencyProfile:
+    def __init__(self, name, hop_size, win_size, description=""):
+        '''hop_size = mic block and reference frame, win_size = pitch detector window (samples at the song rate)'''
+        self.name = name
+        self.hop_size = hop_size
+        self.win_size = win_size
+        self.description = description
+
+    def __repr__(self):
+        return f"LatencyProfile({self.name!r}, hop_size={self.hop_size}, win_size={self.win_size})"
+
+
+PROFILES = {profile.name: profile for profile in [
+    LatencyProfile("ultra-low", 128, 512, "fastest feedback, 4x the callbacks of classic"),
+    LatencyProfile("balanced", 256, 1024, "half the delay of classic"),
+    LatencyProfile("classic", 512, 1024, "the original settings"),
+    LatencyProfile("efficient", 512, 2048, "fewest callbacks, steadier pitch on low voices, slowest to react"),
+]}
+DEFAULT_PROFILE = "classic"
+
+
+def get_profile(name=DEFAULT_PROFILE):
+    '''LatencyProfile by name (a LatencyProfile is passed through)'''
+    if isinstance(name, LatencyProfile):
+        return name
+    if name not in PROFILES:
+        raise ValueError(f"Unknown latency profile {name!r}, use one of {', '.join(PROFILES)}")
+    return PROFILES[name]
+
+
+#DECIMATION (reference frames -> profile frames)
+def decimation(reference_hop, hop_size):
+    '''How many reference frames make one profile frame'''
+    if hop_size % reference_hop:
+        raise ValueError(f"reference was analysed with hop {reference_hop}, a hop of {hop_size} can't be taken from it "
+                         f"(analyse at hop {REFERENCE_HOP} to use every profile)")
+    return hop_size // reference_hop
+
+
+def decimate_f0(f0, factor):
+    '''Every factor-th pitch value, as a plain float array'''
+    f0 = np.asarray(f0, dtype=np.float64)
+    return f0[::factor].copy() if factor > 1 else f0
+
+
+def decimate_rms(rms, factor):
+    '''rms over factor frames: root of the mean power of the frames centred on each coarse frame'''
+    rms = np.asarray(rms, dtype=np.float32)
+    if factor == 1:
+        return rms
+    power = np.convolve(rms.astype(np.float64) ** 2, np.ones(factor) / factor, mode="same")
+    return np.sqrt(power[::factor]).astype(np.float32)
+
+
+def decimate_notes(notes, factor):
+    '''NoteIndex with onsets / offsets in coarse frames (a note never shrinks to nothing)'''
+    if notes is None or factor == 1:
+        return notes
+    onsets = notes.onsets // factor
+    offsets = np.maximum(-(-notes.offsets // factor), onsets + 1)
+    return NoteIndex(onsets, offsets, notes.midi, notes.stability)
+
+
+def reference_at(f0, rms, notes, reference_hop, hop_size):
+    '''f0, rms and notes of a reference analysed at reference_hop, one value per hop_size'''
+    factor = decimation(reference_hop, hop_size)
+    return decimate_f0(f0, factor), decimate_rms(rms, factor), decimate_notes(notes, factor)
+
+
+#BENCHMARK
+def reaction_times(pitch, confidence, frequency, hop_size, samplerate, cents=50):
+    '''Seconds from every note change of the signal to the first block whose pitch is the new note'''
+    from offline_scoring import voicing_mask
+    changes = np.flatnonzero(np.diff(frequency)) + 1
+    block_ends = np.arange(1, len(pitch) + 1) * hop_size
+    ok = voicing_mask(pitch, confidence)
+    times = []
+    for change in changes:
+        target = frequency[change]
+        after = np.flatnonzero((block_ends > change) & ok)
+        hits = after[np.abs(1200 * np.log2(np.maximum(pitch[after], 1e-6) / target)) <= cents]
+        if len(hits):
+            times.append((block_ends[hits[0]] - change) / samplerate)
+    return np.array(times)
+
+
+def benchmark(profiles=tuple(PROFILES), method="yin", samplerate=44100, seconds=8.0, device_latency=0.01):
+    '''Feedback latency and CPU per profile
+
+    A note change has to reach the mic callback (device input latency), fill the block and the
+    detector window until the new pitch wins (measured on steady tones), be processed (callback
+    p99) and get drawn (on average half a renderer frame).'''
+    from pitch_benchmark import make_signal, run_detector
+    from renderer import FPS
+    audio, frequency, _ = make_signal("tones", samplerate, seconds)
+    results = {}
+    for name in profiles:
+        profile = get_profile(name)
+        pitch, confidence, call_us, cpu_us = run_detector(method, audio, samplerate, profile.hop_size, profile.win_size)
+        reaction = reaction_times(pitch, confidence, frequency, profile.hop_size, samplerate)
+        p99 = float(np.percentile(call_us, 99)) / 1e6
+        detection = float(np.median(reaction)) if len(reaction) else None
+        results[name] = {
+            "hop_size": profile.hop_size, "win_size": profile.win_size,
+            "block_ms": profile.hop_size / samplerate * 1000,
+            "detection_ms": detection * 1000 if detection is not None else None,
+            "feedback_ms": (device_latency + detection + p99 + 0.5 / FPS) * 1000 if detection is not None else None,
+            "callback_p99_us": p99 * 1e6,
+            "cpu_percent": cpu_us / (profile.hop_size / samplerate * 1e6) * 100,  # of one core, detector only
+        }
+    return results
+
+
+def print_results(results, method):
+    print(f"{'profile':<10} {'block':>6} {'window':>6} {'frame ms':>9} {'detect ms':>10} {'feedback ms':>12} "
+          f"{'p99 us':>8} {'cpu %':>6}   ({method})")
+    for name, r in results.items():
+        detection = f"{r['detection_ms']:10.1f}" if r["detection_ms"] is not None else f"{'-':>10}"
+        feedback = f"{r['feedback_ms']:12.1f}" if r["feedback_ms"] is not None else f"{'-':>12}"
+        print(f"{name:<10} {r['hop_size']:6d} {r['win_size']:6d} {r['block_ms']:9.1f} {detection} {feedback} "
+              f"{r['callback_p99_us']:8.1f} {r['cpu_percent']:6.2f}")
+
+
+def main(argv=None):
+    from pitch_detectors import METHODS
+    parser = argparse.ArgumentParser(description="Feedback latency and CPU of every latency profile.")
+    parser.add_argument("--profiles", nargs="+", choices=list(PROFILES), default=list(PROFILES))
+    parser.add_argument("--method", choices=METHODS, default="yin", help="live pitch detector")
+    parser.add_argument("--samplerate", type=int, default=44100)
+    parser.add_argument("--seconds", type=float, default=8.0)
+    parser.add_argument("--device-latency", type=float, default=0.01, help="input latency of the sound card (s)")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args(argv)
+
+    results = benchmark(args.profiles, args.method, args.samplerate, args.seconds, args.device_latency)
+    print_results(results, args.method)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+import sys
+import json
+import time
+import asyncio
+import argparse
+import numpy as np
+from scoring_server import HOST, PORT, LENGTH
+
+# LOAD TEST CLIENT
+# Simulates many singers against scoring_server.py on one box. Each simulated singer opens a
+# connection, streams one of the WAV files (cycled over the singers) in chunks, paced like a
+# live mic unless --speed says otherwise, and measures how long every chunk takes to come back
+# scored. Prints the latency percentiles over all chunks, the sessions that failed and the
+# server side metrics (backpressure, queue depth).
+#
+# EX: python load_test.py takes/*.wav --song My_Song-1a2b3c4d --singers 200
+CHUNK_SECONDS = 0.1  # audio per message, a bit more than what one mic callback delivers
+
+
+async def sing(singer, audio_files, song, host, port, chunk_seconds, speed, results):
+    '''One simulated singer, appends its outcome to results'''
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        path, audio_by_rate = audio_files[singer % len(audio_files)]
+        writer.write(json.dumps({"song": song, "samplerate": audio_by_rate["samplerate"]}).encode() + b"\n")
+        reply = json.loads(await reader.readline())
+        if "error" in reply:
+            results.append({"singer": singer, "error": reply["error"]})
+            return
+        audio = audio_by_rate["audio"]
+        chunk_samples = max(1, int(chunk_seconds * reply["samplerate"]))
+        sent = {}  # chunk number -> send time
+        latencies = []
+
+        async def receive():
+            while True:
+                message = json.loads(await reader.readline())
+                if "chunk" in message:
+                    latencies.append(time.perf_counter() - sent[message["chunk"]])
+                else:
+                    return message
+
+        receiver = asyncio.create_task(receive())
+        start = time.perf_counter()
+        for chunk, offset in enumerate(range(0, len(audio), chunk_samples)):
+            pcm = audio[offset:offset + chunk_samples].tobytes()
+            sent[chunk] = time.perf_counter()
+            writer.write(LENGTH.pack(len(pcm)) + pcm)
+            await writer.drain()  # blocks when the server stops reading (backpressure)
+            if speed:
+                due = start + (offset + chunk_samples) / reply["samplerate"] / speed
+                await asyncio.sleep(max(0.0, due - time.perf_counter()))
+        writer.write(LENGTH.pack(0))
+        await writer.drain()
+        final = await receiver
+        if "error" in final:
+            results.append({"singer": singer, "error": final["error"]})
+        else:
+            results.append({"singer": singer, "file": path, "latencies": latencies, "average": final["average"],
+                            "metrics": final["metrics"]})
+    except (ConnectionError, asyncio.IncompleteReadError, json.JSONDecodeError) as error:
+        results.append({"singer": singer, "error": f"{type(error).__name__}: {error}"})
+    finally:
+        writer.close()
+
+
+async def run(args):
+    import librosa
+    audio_files = []
+    for path in args.files:
+        audio, samplerate = librosa.load(path, sr=args.samplerate, mono=True)
+        audio_files.append((path, {"audio": audio.astype(np.float32), "samplerate": int(samplerate)}))
+
+    results = []
+    start = time.perf_counter()
+    singers = []
+    for singer in range(args.singers):
+        singers.append(asyncio.create_task(sing(singer, audio_files, args.song, args.host, args.port,
+                                                args.chunk_seconds, args.speed, results)))
+        if args.ramp:
+            await asyncio.sleep(args.ramp / args.singers)  # spread the connections over the ramp time
+    await asyncio.gather(*singers)
+    return results, time.perf_counter() - start
+
+
+def print_report(results, wall_seconds):
+    done = [r for r in results if "error" not in r]
+    failed = [r for r in results if "error" in r]
+    latencies = np.concatenate([r["latencies"] for r in done]) * 1000 if done else np.zeros(0)
+    audio_seconds = sum(r["metrics"]["audio_seconds"] for r in done)
+    print(f"{len(done)} sessions done, {len(failed)} failed, {audio_seconds:.0f} s of audio in {wall_seconds:.1f} s "
+          f"({audio_seconds / wall_seconds:.1f}x real time over all singers)")
+    if len(latencies):
+        print(f"chunk latency: p50 {np.percentile(latencies, 50):.1f} ms, p99 {np.percentile(latencies, 99):.1f} ms, "
+              f"max {latencies.max():.1f} ms")
+    if done:
+        print(f"server: max queue depth {max(r['metrics']['max_queue_depth'] for r in done)}, "
+              f"backpressure {sum(r['metrics']['backpressure_seconds'] for r in done):.2f} s total")
+    for r in failed[:10]:
+        print(f"  singer {r['singer']}: {r['error']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate many singers against the scoring server.")
+    parser.add_argument("files", nargs="+", help="WAV (or any audio) takes, cycled over the singers")
+    parser.add_argument("--song", required=True, help="library folder name of the song on the server")
+    parser.add_argument("--singers", type=int, default=100)
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--samplerate", type=int, default=None, help="resample the takes first (default: file rate)")
+    parser.add_argument("--chunk-seconds", type=float, default=CHUNK_SECONDS)
+    parser.add_argument("--speed", type=float, default=1.0, help="1 = real time like a mic, 0 = as fast as possible")
+    parser.add_argument("--ramp", type=float, default=1.0, help="seconds over which the singers connect")
+    parser.add_argument("--json", help="write every session's result to this file")
+    args = parser.parse_args(argv)
+
+    results, wall_seconds = asyncio.run(run(args))
+    print_report(results, wall_seconds)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump([{key: value for key, value in r.items() if key != "latencies"} for r in results], f, indent=2)
+    return 1 if any("error" in r for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
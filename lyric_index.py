@@ -0,0 +1,47 @@
+import bisect
+
+# LYRIC TIME INDEX
+# Whisper gives us a list of segments ({"start", "end", "text"}) sorted by time.
+# Instead of walking that list with a counter that can only move forward, we keep
+# the segment end times in a sorted list and binary search it, so looking up the
+# lyric for any position (including after a seek or restart) costs O(log n).
+
+
+class LyricIndex:
+    def __init__(self, lyrics=()):
+        '''Builds the index from Whisper segments'''
+        self.texts = []
+        self.starts = []
+        self.ends = []
+        self.add(lyrics)
+
+    def add(self, lyrics):
+        '''Appends segments that come after the ones already in the index (EX: the next chunk of a song)
+
+        Safe while the audio thread is reading: the end time goes in last, and
+        a line only becomes visible to index_at once its end time is there.'''
+        latest = self.ends[-1] if self.ends else float("-inf")
+        for segment in lyrics:  # keep the end times sorted even if Whisper overlaps two segments
+            latest = max(latest, float(segment["end"]))
+            self.texts.append(segment["text"])
+            self.starts.append(float(segment["start"]))
+            self.ends.append(latest)
+
+    def __len__(self):
+        return len(self.ends)
+
+    def index_at(self, time):
+        '''Index of the lyric line to show at time (seconds), len(self) once the song is over
+
+        A line stays on screen until its end time, then the next line is shown
+        straight away (even before it starts) so the singer can read ahead.'''
+        return bisect.bisect_left(self.ends, time)
+
+    def text_at(self, time):
+        '''Lyric text to show at time (seconds), "" after the last line'''
+        index = self.index_at(time)
+        return self.texts[index] if index < len(self.ends) else ""
+
+    def is_active(self, index, time):
+        '''True if line index is actually being sung at time (between its start and end)'''
+        return 0 <= index < len(self.ends) and self.starts[index] <= time <= self.ends[index]
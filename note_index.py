@@ -0,0 +1,115 @@
+import bisect
+import numpy as np
+from session import NOTE_NAMES
+
+# NOTE INDEX
+# The reference f0 has one value per hop (86 a second). Singers think in notes, so the
+# analysis also cuts the f0 into note events: where a note starts and ends (frames), its
+# median midi pitch, how steady it was held and its name, all worked out once offline.
+#
+#   f0 (cents)  ____/‾‾‾‾‾‾‾‾\____/‾‾‾~~~‾‾‾‾\___
+#   notes           [  C4    ]    [   D4     ]
+#
+# The game looks up the note under the current frame with a binary search over the note
+# ends (O(log n), same idea as LyricIndex) and checks the live pitch against the Hz range
+# of that note, precomputed here: no log2 or note name building in the audio callback.
+# A few thousand notes take ~12 bytes each instead of 4 bytes for every hop.
+MIN_NOTE_FRAMES = 5  # shorter runs (~60 ms at 512 / 44.1k) are glides or vibrato, they join the note before
+SMOOTHING_FRAMES = 7  # median filter over the pitch before rounding it to semitones
+HIT_CENTS = 50  # live pitch within half a semitone of the note = right note
+HIT_SHARE = 0.5  # a note counts as hit when at least this share of its sung frames were right
+NOTE_HOP = 512  # hop the frame counts above are for, finer references scale them (see latency_profiles.py)
+
+
+def _semitones(cents, smoothing=SMOOTHING_FRAMES):
+    '''Median filtered pitch rounded to midi notes, 0 where unvoiced'''
+    pitch = np.where(cents > 0, cents, np.nan).astype(np.float64)
+    if len(pitch) == 0:
+        return np.zeros(0, dtype=np.int32)
+    half = smoothing // 2
+    padded = np.pad(pitch, half, constant_values=np.nan)
+    windows = np.lib.stride_tricks.sliding_window_view(padded, smoothing)
+    with np.errstate(all="ignore"):
+        smooth = np.nanmedian(np.where(np.isnan(windows).all(axis=1, keepdims=True), 0, windows), axis=1)
+    semitones = np.round(smooth / 100).astype(np.int32)
+    semitones[cents <= 0] = 0
+    return semitones
+
+
+def segment_notes(f0_cents, min_frames=MIN_NOTE_FRAMES, smoothing=SMOOTHING_FRAMES, hop_size=NOTE_HOP):
+    '''NoteIndex of a reference pitch track in midi cents (reference_file.hz_to_cents), one value per hop_size'''
+    scale = NOTE_HOP / hop_size  # same durations in ms whatever the frame rate
+    min_frames = max(1, int(round(min_frames * scale)))
+    smoothing = max(1, int(round(smoothing * scale)) // 2 * 2 + 1)  # odd, centred on the frame
+    cents = np.asarray(f0_cents, dtype=np.int32)
+    semitones = _semitones(cents, smoothing)
+    edges = np.flatnonzero(np.diff(semitones)) + 1
+    starts = np.concatenate([[0], edges]).astype(np.int64)
+    ends = np.concatenate([edges, [len(semitones)]]).astype(np.int64)
+
+    notes = []  # [onset, offset] of voiced runs, short ones glued to the note they follow
+    for start, end in zip(starts, ends):
+        if len(semitones) == 0 or semitones[start] == 0:
+            continue
+        if notes and notes[-1][1] == start and end - start < min_frames:
+            notes[-1][1] = end
+        else:
+            notes.append([start, end])
+    notes = [note for note in notes if note[1] - note[0] >= min_frames]  # lone blips are not notes
+
+    onsets = np.array([note[0] for note in notes], dtype=np.int32)
+    offsets = np.array([note[1] for note in notes], dtype=np.int32)
+    midi = np.zeros(len(notes), dtype=np.int16)
+    stability = np.zeros(len(notes), dtype=np.float16)
+    for i, (onset, offset) in enumerate(notes):
+        sung = cents[onset:offset]
+        sung = sung[sung > 0]
+        median = np.median(sung)
+        midi[i] = int(round(median / 100))
+        stability[i] = np.mean(np.abs(sung - median) <= HIT_CENTS)
+    return NoteIndex(onsets, offsets, midi, stability)
+
+
+class NoteIndex:
+    def __init__(self, onsets, offsets, midi, stability):
+        '''Note events: first frame, frame after the last, median midi note and share of frames held on pitch'''
+        self.onsets = np.asarray(onsets, dtype=np.int32)
+        self.offsets = np.asarray(offsets, dtype=np.int32)
+        self.midi = np.asarray(midi, dtype=np.int16)
+        self.stability = np.asarray(stability, dtype=np.float16)
+        self.names = [f"{NOTE_NAMES[note % 12]}{note // 12 - 1}" for note in self.midi.tolist()]
+        # Hz range that counts as this note, so the callback compares floats it already has
+        self.low_hz = (440.0 * 2 ** ((self.midi - 69 - HIT_CENTS / 100) / 12)).tolist()
+        self.high_hz = (440.0 * 2 ** ((self.midi - 69 + HIT_CENTS / 100) / 12)).tolist()
+        self._onsets = self.onsets.tolist()  # plain lists, bisect on them is faster than numpy for one value
+        self._offsets = self.offsets.tolist()
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def note_at(self, frame):
+        '''Index of the note sounding at frame, -1 between notes'''
+        index = bisect.bisect_right(self._offsets, frame)
+        if index < len(self._offsets) and self._onsets[index] <= frame:
+            return index
+        return -1
+
+    def is_hit(self, index, frequency):
+        '''True if frequency (Hz) is the note index'''
+        return self.low_hz[index] <= frequency < self.high_hz[index]
+
+    def feedback(self, hits, frames, seconds_per_frame, worst=5):
+        '''Per-note results as text lines: notes hit overall and the weakest notes with their time
+
+        hits / frames are per-note counts of right and sung frames (notes never sung are left out).'''
+        hits, frames = np.asarray(hits), np.asarray(frames)
+        sung = np.flatnonzero(frames > 0)
+        if not len(sung):
+            return ["NOTES: none sung"]
+        scores = hits[sung] / frames[sung]
+        lines = [f"NOTES: {int(np.sum(scores >= HIT_SHARE))}/{len(sung)} hit"]
+        for i in sung[np.argsort(scores, kind="stable")[:worst]]:
+            start = self.onsets[i] * seconds_per_frame
+            lines.append(f"  {self.names[i]:<4} at {int(start // 60)}:{start % 60:04.1f}  "
+                         f"{hits[i] / frames[i] * 100:3.0f}% on pitch")
+        return lines
@@ -0,0 +1,170 @@
+import os
+import sys
+import json
+import argparse
+import numpy as np
+from pitch_detectors import METHODS, detect_pitch as detect_pitch_frames
+from latency_profiles import PROFILES, DEFAULT_PROFILE, get_profile, decimate_f0, decimation
+
+# OFFLINE SCORING
+# Scores a whole recorded take in one go with numpy instead of frame by frame.
+# Uses the same rules as the live game:
+#   "percent"  -> calculate_accuracy in VoiceHero.py   (100 - % frequency error)
+#   "semitone" -> compare_notes in comparison_algorithm.py (1 - semitones off / tolerance)
+# so we can re-score archived takes whenever we tune the scoring. A .pitch.npz from the take
+# recorder (take_recorder.py) is scored with the pitch the live game detected, no detection here.
+#
+# EX: python offline_scoring.py take1.wav take2.wav --reference library/My_Song-1a2b3c4d
+#     python offline_scoring.py takes/take.pitch.npz --reference library/My_Song-1a2b3c4d
+HOP_SIZE = 512
+MIN_PITCH, MAX_PITCH = 50, 600  # Human singing range
+MIN_CONFIDENCE = 0.8
+RULES = ["percent", "semitone"]
+ALIGNMENTS = ["fixed", "oltw"]  # fixed = frame i vs reference frame i, oltw = follow the singer (see oltw.py)
+
+
+def hz_to_midi(frequency):
+    '''Frequency array (Hz) to midi note numbers, NaN where there is no pitch'''
+    frequency = np.asarray(frequency, dtype=np.float64)
+    midi = np.full(frequency.shape, np.nan)
+    voiced = frequency > 0
+    midi[voiced] = 69 + 12 * np.log2(frequency[voiced] / 440.0)
+    return midi
+
+
+def cents_error(live_pitch, ref_pitch):
+    '''Signed distance in cents from the reference pitch (positive = singing sharp)'''
+    return 100 * (hz_to_midi(live_pitch) - hz_to_midi(ref_pitch))
+
+
+def detect_pitch(take_path, samplerate, hop_size=HOP_SIZE, win_size=1024, method="yin"):
+    '''Live pitch and confidence for every hop of a recorded take (same detector settings as the game)'''
+    import librosa
+    audio, _ = librosa.load(take_path, sr=samplerate, mono=True)  # resampled to the reference rate
+    return detect_pitch_frames(audio, samplerate, method, hop_size, win_size)
+
+
+def voicing_mask(live_pitch, confidence, min_confidence=MIN_CONFIDENCE):
+    '''Frames the live game would have scored (confident pitch in the singing range)'''
+    live_pitch = np.asarray(live_pitch)
+    return (live_pitch >= MIN_PITCH) & (live_pitch <= MAX_PITCH) & (np.asarray(confidence) > min_confidence)
+
+
+def score_frames(live_pitch, confidence, ref_f0, rule="percent", tolerance_semitones=2):
+    '''Score (0-100) for every frame, NaN for frames that are not scored
+
+    Frames past the end of the reference are compared against 0 Hz (score 0), like the live game.'''
+    live_pitch = np.asarray(live_pitch, dtype=np.float64)
+    ref = np.zeros(len(live_pitch))
+    n = min(len(ref), len(ref_f0))
+    ref[:n] = ref_f0[:n]
+
+    scores = np.zeros(len(live_pitch))
+    both_voiced = (ref > 0) & (live_pitch > 0)
+    if rule == "percent":
+        error = np.abs(ref[both_voiced] - live_pitch[both_voiced]) / ref[both_voiced] * 100
+        scores[both_voiced] = np.maximum(0, 100 - error)
+    elif rule == "semitone":
+        diff = np.abs(hz_to_midi(live_pitch[both_voiced]) - hz_to_midi(ref[both_voiced]))
+        scores[both_voiced] = np.maximum(0.0, 1.0 - diff / tolerance_semitones) * 100
+    else:
+        raise ValueError(f"Unknown scoring rule {rule!r}, use one of {RULES}")
+
+    scores[~voicing_mask(live_pitch, confidence)] = np.nan
+    return scores
+
+
+def score_lines(frame_scores, lyrics, samplerate, hop_size=HOP_SIZE):
+    '''Average score per lyric line, using the frames that fall inside each line'''
+    if not lyrics:
+        return []
+    times = np.arange(len(frame_scores)) * hop_size / samplerate
+    starts = np.array([line["start"] for line in lyrics], dtype=np.float64)
+    ends = np.maximum.accumulate(np.array([line["end"] for line in lyrics], dtype=np.float64))
+
+    line = np.searchsorted(ends, times, side="left")  # same lookup as LyricIndex.index_at
+    inside = (line < len(lyrics)) & ~np.isnan(frame_scores)
+    inside[inside] &= times[inside] >= starts[line[inside]]  # only while the line is actually sung
+
+    totals = np.bincount(line[inside], weights=frame_scores[inside], minlength=len(lyrics))
+    counts = np.bincount(line[inside], minlength=len(lyrics))
+    breakdown = []
+    for i, segment in enumerate(lyrics):
+        score = totals[i] / counts[i] if counts[i] else None
+        breakdown.append({"text": segment["text"], "start": segment["start"], "end": segment["end"],
+                          "score": score, "frames": int(counts[i])})
+    return breakdown
+
+
+def score_take(live_pitch, confidence, ref_f0, lyrics, samplerate, hop_size=HOP_SIZE, rule="percent", alignment="fixed"):
+    '''Scores a whole take: per-frame scores, the overall average and the per-line breakdown'''
+    if alignment == "oltw":
+        from oltw import align_reference  # imported here, oltw itself imports this module
+        ref_f0 = align_reference(live_pitch, confidence, ref_f0)
+    elif alignment != "fixed":
+        raise ValueError(f"Unknown alignment {alignment!r}, use one of {ALIGNMENTS}")
+    frame_scores = score_frames(live_pitch, confidence, ref_f0, rule)
+    scored = ~np.isnan(frame_scores)
+    average = float(np.mean(frame_scores[scored])) if scored.any() else 0.0
+    return {"rule": rule, "alignment": alignment, "average": average, "scored_frames": int(scored.sum()),
+            "frame_scores": frame_scores, "lines": score_lines(frame_scores, lyrics, samplerate, hop_size)}
+
+
+def load_reference_dir(song_dir):
+    '''Loads f0, lyrics, sample rate and hop size from a library song folder (see batch_ingest.py)'''
+    vhref_path = os.path.join(song_dir, "reference.vhref")
+    if os.path.exists(vhref_path):
+        from reference_file import ReferenceFile
+        reference = ReferenceFile(vhref_path)
+        return np.asarray(reference.f0), reference.lyrics, reference.samplerate, reference.hop_size
+    with open(os.path.join(song_dir, "meta.json")) as f:
+        meta = json.load(f)
+    with open(os.path.join(song_dir, "lyrics.json")) as f:
+        lyrics = json.load(f)
+    f0 = np.load(os.path.join(song_dir, "f0.npy"))
+    return f0, lyrics, meta["sr"], meta["settings"]["hop_size"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score recorded takes against a reference song.")
+    parser.add_argument("takes", nargs="+", help="recorded vocal files, or .pitch.npz files of recorded takes")
+    parser.add_argument("--reference", required=True, help="library song folder with f0.npy, lyrics.json, meta.json")
+    parser.add_argument("--rule", choices=RULES, default="percent")
+    parser.add_argument("--alignment", choices=ALIGNMENTS, default="fixed")
+    parser.add_argument("--detector", choices=METHODS, default="yin", help="live pitch detector (see pitch_detectors.py)")
+    parser.add_argument("--profile", choices=list(PROFILES), default=DEFAULT_PROFILE,
+                        help="latency profile the take is scored at, like the game (see latency_profiles.py)")
+    parser.add_argument("--json", help="write the results (without per-frame scores) to this file")
+    args = parser.parse_args(argv)
+
+    ref_f0, lyrics, sr, ref_hop_size = load_reference_dir(args.reference)
+    profile = get_profile(args.profile)
+    hop_size = profile.hop_size
+    ref_f0 = decimate_f0(ref_f0, decimation(ref_hop_size, hop_size))
+    results = {}
+    for take in args.takes:
+        if take.endswith(".npz"):  # pitch the game saw live (first singer in group mode), put on the frames it was scored at
+            from take_recorder import load_pitch
+            pitch, recorded_confidence, frames = load_pitch(take)
+            scored = frames >= 0
+            live_pitch = np.zeros(frames.max() + 1 if scored.any() else 0)
+            confidence = np.zeros(len(live_pitch))
+            live_pitch[frames[scored]] = np.nan_to_num(pitch[scored, 0])
+            confidence[frames[scored]] = recorded_confidence[scored, 0]
+        else:
+            live_pitch, confidence = detect_pitch(take, sr, hop_size, profile.win_size, args.detector)
+        result = score_take(live_pitch, confidence, ref_f0, lyrics, sr, hop_size, args.rule, args.alignment)
+        print(f"{os.path.basename(take)}: {result['average']:.1f}% ({result['scored_frames']} frames scored)")
+        for line in result["lines"]:
+            if line["score"] is not None:
+                print(f"    {line['score']:5.1f}%  {line['text'].strip()}")
+        results[take] = {key: value for key, value in result.items() if key != "frame_scores"}
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+import sys
+import time
+import numpy as np
+from offline_scoring import voicing_mask
+
+# ONLINE TIME WARPING
+# The fixed lookup assumes the singer is exactly on f0[current_frame], so singing a
+# little early or late scores near zero. This follows where the singer actually is in
+# the reference instead, with a streaming DTW restricted to a band of frames around the
+# playback position:
+#
+#   D[i] = local_cost(i) + min(D_prev[i] + penalty,    singer held the note (ref did not move)
+#                              D_prev[i - 1],          normal speed
+#                              D_prev[i - 2] + penalty) singer caught up (ref moved 2 frames)
+#
+# Only the last column of D is kept, so each hop costs O(band) time and memory.
+# The reported position is the cheapest cell of that column.
+BAND = 40  # frames either side of the playback position (~0.46 s at 512 / 44.1k)
+MAX_SEMITONES = 4.0  # pitch errors larger than this all cost the same
+UNVOICED_COST = 1.0  # singer has a pitch but the reference is silent there
+STEP_PENALTY = 0.05  # small cost for holding / skipping, so without evidence we follow the clock
+
+
+class OnlineTimeWarper:
+    def __init__(self, ref_f0, band=BAND, max_semitones=MAX_SEMITONES,
+                 unvoiced_cost=UNVOICED_COST, step_penalty=STEP_PENALTY):
+        '''Allocates the DTW column once (ref_f0 is read as we go, so it may still be filling up)'''
+        self.ref_f0 = ref_f0
+        self.band = band
+        self.width = 2 * band + 1
+        self.max_semitones = max_semitones
+        self.unvoiced_cost = unvoiced_cost
+        self.step_penalty = step_penalty
+
+        self.cost = np.full(self.width, np.inf)  # last DTW column
+        self.offset = 0  # reference frame of self.cost[0]
+        self.position = -1
+        # scratch buffers, reused every hop so update() does not allocate big arrays
+        self._local = np.empty(self.width)
+        self._ref = np.empty(self.width)
+        self._prev = np.empty(self.width + 2)
+        self._best = np.empty(self.width)
+
+    def update(self, live_pitch, clock_frame=None):
+        '''Feeds one live hop (Hz, 0 = no confident pitch) and returns the matching reference frame
+
+        clock_frame is where playback is (EX: from FrameAligner), the search band is centred on it.
+        Without it the band follows our own estimate.'''
+        center = clock_frame if clock_frame is not None else self.position + 1
+        new_offset = max(0, center - self.band)
+
+        # Local cost of this live frame against every reference frame in the band
+        ref = self._ref
+        ref.fill(0.0)
+        end = min(len(self.ref_f0), new_offset + self.width)
+        if end > new_offset:
+            ref[:end - new_offset] = self.ref_f0[new_offset:end]
+        with np.errstate(divide="ignore", invalid="ignore"):  # Hz -> midi in place, 0 Hz -> NaN
+            np.divide(ref, 440.0, out=ref)
+            np.log2(ref, out=ref)
+            ref *= 12
+            ref += 69
+        ref[~np.isfinite(ref)] = np.nan
+        local = self._local
+        if live_pitch > 0:
+            live_midi = 69 + 12 * np.log2(live_pitch / 440.0)
+            np.subtract(ref, live_midi, out=local)
+            np.abs(local, out=local)
+            np.minimum(local, self.max_semitones, out=local)
+            local /= self.max_semitones
+            local[np.isnan(ref)] = self.unvoiced_cost
+        else:
+            local.fill(0.0)  # singer is silent -> no evidence either way
+
+        if self.position < 0:  # first hop, nothing to come from yet
+            self.cost[:] = local
+        else:
+            # previous column re-indexed to the new band, with 2 extra cells in front for the i-1 / i-2 steps
+            prev = self._prev
+            prev.fill(np.inf)
+            shift = new_offset - 2 - self.offset  # index into self.cost of prev[0]
+            lo, hi = max(0, -shift), min(len(prev), self.width - shift)
+            if hi > lo:
+                prev[lo:hi] = self.cost[lo + shift:hi + shift]
+
+            best = self._best
+            np.add(prev[2:], self.step_penalty, out=best)           # hold
+            np.minimum(best, prev[1:-1], out=best)                  # advance 1
+            np.minimum(best, prev[:-2] + self.step_penalty, out=best)  # advance 2
+            np.add(best, local, out=self.cost)
+            if not np.isfinite(self.cost).any():  # band jumped past every path (EX: a seek) -> restart
+                self.cost[:] = local
+
+        self.cost -= self.cost.min()  # keep the numbers small, only differences matter
+        self.offset = new_offset
+        self.position = new_offset + int(np.argmin(self.cost))
+        return self.position
+
+
+def align_reference(live_pitch, confidence, ref_f0, band=BAND):
+    '''Reference f0 warped onto the live frames of a whole take (offline version of update)'''
+    warper = OnlineTimeWarper(ref_f0, band)
+    voiced = voicing_mask(live_pitch, confidence)
+    aligned = np.zeros(len(live_pitch))
+    for frame, (pitch, is_voiced) in enumerate(zip(live_pitch, voiced)):
+        position = warper.update(pitch if is_voiced else 0.0, clock_frame=frame)
+        aligned[frame] = ref_f0[position] if position < len(ref_f0) else 0.0
+    return aligned
+
+
+#BENCHMARK
+def benchmark(n_hops=20000, bands=(10, 20, 40, 80, 160), hop_size=512, samplerate=44100):
+    '''Per-hop cost of the fixed lookup vs the warper, compared to the callback budget'''
+    rng = np.random.default_rng(0)
+    ref_f0 = np.where(rng.random(n_hops) > 0.3, rng.uniform(100, 400, n_hops), 0.0)
+    live = ref_f0 * 2 ** (rng.normal(0, 0.3, n_hops) / 12)
+    budget_us = hop_size / samplerate * 1e6
+    print(f"callback budget: {budget_us:.0f} us per hop ({hop_size} samples @ {samplerate} Hz)")
+
+    start = time.perf_counter()
+    for frame in range(n_hops):  # what the callback does today
+        original_pitch = ref_f0[frame] if frame < len(ref_f0) else 0
+    fixed_us = (time.perf_counter() - start) / n_hops * 1e6
+    print(f"fixed lookup      : {fixed_us:8.2f} us/hop ({fixed_us / budget_us * 100:5.2f}% of budget)")
+
+    for band in bands:
+        warper = OnlineTimeWarper(ref_f0, band)
+        start = time.perf_counter()
+        for frame in range(n_hops):
+            warper.update(live[frame], clock_frame=frame)
+        oltw_us = (time.perf_counter() - start) / n_hops * 1e6
+        print(f"oltw band={band:<4}   : {oltw_us:8.2f} us/hop ({oltw_us / budget_us * 100:5.2f}% of budget)")
+
+
+if __name__ == "__main__":
+    # EX: python oltw.py
+    benchmark(*(int(arg) for arg in sys.argv[1:2]))
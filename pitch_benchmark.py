@@ -0,0 +1,200 @@
+import sys
+import json
+import time
+import argparse
+import numpy as np
+from pitch_detectors import METHODS, HOP_SIZE, WIN_SIZE, make_detector
+from offline_scoring import voicing_mask
+
+# PITCH DETECTOR BENCHMARK
+# Runs every detector in pitch_detectors.py hop by hop (like the mic callback does) over synthetic
+# signals where the true pitch is known, and reports for each one:
+#   cpu      -> CPU time per hop (process time, mean)
+#   p50/p99  -> wall time of a single call, what eats into the callback budget
+#   gpe      -> gross pitch error, % of frames voiced in both truth and output that are off by > 20%
+#   fine     -> mean error in cents of the frames that are not gross errors
+#   voicing  -> % of frames where voiced / unvoiced matches the truth (same check as the game)
+# and at the end the cheapest detector (lowest p99) that meets the accuracy bar on every signal.
+#
+# EX: python pitch_benchmark.py --methods yin yinfast numpy_yin --max-gpe 2
+SAMPLERATE = 44100
+SECONDS = 4
+SNR_DB = 10  # noise level of the "noisy_vocal" signal
+GPE_TOLERANCE = 0.2  # relative error that counts as a gross error
+SIGNALS = ["tones", "vibrato", "glide", "noisy_vocal"]
+
+
+#SYNTHETIC SIGNALS (audio + true pitch and voicing per sample)
+def _oscillator(frequency, samplerate, harmonics=1):
+    '''Sums harmonics of a (time-varying) frequency, 1/k amplitudes'''
+    phase = 2 * np.pi * np.cumsum(frequency) / samplerate
+    audio = sum(np.sin(k * phase) / k for k in range(1, harmonics + 1))
+    return 0.5 * audio / np.max(np.abs(audio))
+
+
+def make_signal(kind, samplerate=SAMPLERATE, seconds=SECONDS, snr_db=SNR_DB, seed=0):
+    '''One test signal - EX: make_signal("glide") -> audio, frequency, voiced (all per sample)'''
+    rng = np.random.default_rng(seed)
+    n = int(seconds * samplerate)
+    t = np.arange(n) / samplerate
+    voiced = np.ones(n, dtype=bool)
+
+    if kind == "tones":  # steady notes, one per second
+        notes = np.array([110.0, 220.0, 330.0, 440.0])
+        frequency = notes[(t.astype(int)) % len(notes)]
+        audio = _oscillator(frequency, samplerate)
+    elif kind == "vibrato":  # 220 Hz, +-50 cents at 5.5 Hz
+        frequency = 220.0 * 2 ** (0.5 * np.sin(2 * np.pi * 5.5 * t) / 12)
+        audio = _oscillator(frequency, samplerate)
+    elif kind == "glide":  # exponential sweep 100 -> 500 Hz
+        frequency = 100.0 * 5 ** (t / seconds)
+        audio = _oscillator(frequency, samplerate)
+    elif kind == "noisy_vocal":  # harmonic "syllables" with gaps, vibrato and background noise
+        notes = rng.uniform(120, 450, int(np.ceil(seconds / 0.6)))
+        syllable = (t / 0.6).astype(int)
+        frequency = notes[syllable] * 2 ** (0.3 * np.sin(2 * np.pi * 5 * t) / 12)
+        voiced = (t % 0.6) < 0.4  # 0.4 s sung, 0.2 s breath
+        envelope = np.convolve(voiced.astype(float), np.hanning(441) / np.hanning(441).sum(), mode="same")
+        audio = _oscillator(frequency, samplerate, harmonics=8) * envelope
+        noise_power = np.mean(audio[voiced] ** 2) / 10 ** (snr_db / 10)
+        audio = audio + rng.normal(0, np.sqrt(noise_power), n)
+        frequency = np.where(voiced, frequency, 0.0)
+    else:
+        raise ValueError(f"unknown signal {kind!r}, pick one of {', '.join(SIGNALS)}")
+    return audio.astype(np.float32), frequency, voiced
+
+
+def frame_truth(frequency, voiced, n_hops, hop_size=HOP_SIZE, win_size=WIN_SIZE):
+    '''True pitch / voicing per hop, taken at the centre of the window the detector saw'''
+    centers = np.arange(1, n_hops + 1) * hop_size - win_size // 2
+    valid = centers >= 0
+    centers = np.clip(centers, 0, len(frequency) - 1)
+    return np.where(valid, frequency[centers], 0.0), valid & voiced[centers]
+
+
+#BENCHMARK
+def run_detector(method, audio, samplerate, hop_size=HOP_SIZE, win_size=WIN_SIZE):
+    '''Feeds the signal hop by hop, returns pitch, confidence, per-call wall times (us) and CPU time'''
+    detector = make_detector(method, samplerate, hop_size, win_size)
+    n_hops = len(audio) // hop_size
+    blocks = audio[:n_hops * hop_size].reshape(n_hops, hop_size)
+    pitch = np.zeros(n_hops)
+    confidence = np.zeros(n_hops)
+    call_us = np.zeros(n_hops)
+    cpu_start = time.process_time()
+    for i, block in enumerate(blocks):
+        start = time.perf_counter_ns()
+        pitch[i], confidence[i] = detector(block)
+        call_us[i] = (time.perf_counter_ns() - start) / 1000
+    cpu_us = (time.process_time() - cpu_start) / n_hops * 1e6
+    return pitch, confidence, call_us, cpu_us
+
+
+def evaluate(pitch, confidence, true_pitch, true_voiced):
+    '''Gross pitch error (%), fine error (cents) and voicing accuracy (%)'''
+    detected = voicing_mask(pitch, confidence)
+    both = detected & true_voiced
+    result = {"voicing": float(np.mean(detected == true_voiced) * 100)}
+    if not both.any():
+        result.update(gpe=None, fine_cents=None)
+        return result
+    relative = np.abs(pitch[both] - true_pitch[both]) / true_pitch[both]
+    gross = relative > GPE_TOLERANCE
+    cents = np.abs(1200 * np.log2(pitch[both][~gross] / true_pitch[both][~gross]))
+    result["gpe"] = float(np.mean(gross) * 100)
+    result["fine_cents"] = float(np.mean(cents)) if len(cents) else None
+    return result
+
+
+def benchmark(methods=METHODS, signals=SIGNALS, samplerate=SAMPLERATE, hop_size=HOP_SIZE, win_size=WIN_SIZE,
+              seconds=SECONDS, snr_db=SNR_DB):
+    '''Results per detector and signal, plus a "worst" row over all signals'''
+    test_signals = {kind: make_signal(kind, samplerate, seconds, snr_db) for kind in signals}
+    results = {}
+    for method in methods:
+        results[method] = {}
+        all_calls, cpu = [], []
+        for kind, (audio, frequency, voiced) in test_signals.items():
+            pitch, confidence, call_us, cpu_us = run_detector(method, audio, samplerate, hop_size, win_size)
+            true_pitch, true_voiced = frame_truth(frequency, voiced, len(pitch), hop_size, win_size)
+            result = evaluate(pitch, confidence, true_pitch, true_voiced)
+            result.update(cpu_us=cpu_us, p50_us=float(np.percentile(call_us, 50)),
+                          p99_us=float(np.percentile(call_us, 99)))
+            results[method][kind] = result
+            all_calls.append(call_us)
+            cpu.append(cpu_us)
+        calls = np.concatenate(all_calls)
+        per_signal = list(results[method].values())
+        results[method]["worst"] = {  # cost over every call, accuracy of the hardest signal
+            "cpu_us": float(np.mean(cpu)), "p50_us": float(np.percentile(calls, 50)),
+            "p99_us": float(np.percentile(calls, 99)),
+            "gpe": _worst(max, [r["gpe"] for r in per_signal]),
+            "fine_cents": _worst(max, [r["fine_cents"] for r in per_signal]),
+            "voicing": min(r["voicing"] for r in per_signal),
+        }
+    return results
+
+
+def _worst(pick, values):
+    values = [value for value in values if value is not None]
+    return float(pick(values)) if values else None
+
+
+def cheapest(results, max_gpe, max_fine_cents, min_voicing):
+    '''Detector with the lowest p99 call time that meets the bar on every signal (None if none do)'''
+    passing = []
+    for method, summary in results.items():
+        worst = summary["worst"]
+        if worst["gpe"] is None or worst["gpe"] > max_gpe or worst["voicing"] < min_voicing:
+            continue
+        if worst["fine_cents"] is not None and worst["fine_cents"] > max_fine_cents:
+            continue
+        passing.append((worst["p99_us"], method))
+    return min(passing)[1] if passing else None
+
+
+def _fmt(value, spec):
+    return "-" if value is None else format(value, spec)
+
+
+def print_results(results, samplerate, hop_size):
+    budget_us = hop_size / samplerate * 1e6
+    print(f"callback budget: {budget_us:.0f} us per hop ({hop_size} samples @ {samplerate} Hz)")
+    print(f"{'detector':<10} {'signal':<12} {'cpu us':>8} {'p50 us':>8} {'p99 us':>8} "
+          f"{'gpe %':>6} {'fine c':>7} {'voicing %':>9}")
+    for method, per_signal in results.items():
+        for kind, r in per_signal.items():
+            print(f"{method:<10} {kind:<12} {r['cpu_us']:8.1f} {r['p50_us']:8.1f} {r['p99_us']:8.1f} "
+                  f"{_fmt(r['gpe'], '6.1f')} {_fmt(r['fine_cents'], '7.1f')} {r['voicing']:9.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare pitch detectors on synthetic signals.")
+    parser.add_argument("--methods", nargs="+", choices=METHODS, default=METHODS)
+    parser.add_argument("--signals", nargs="+", choices=SIGNALS, default=SIGNALS)
+    parser.add_argument("--samplerate", type=int, default=SAMPLERATE)
+    parser.add_argument("--hop-size", type=int, default=HOP_SIZE)
+    parser.add_argument("--win-size", type=int, default=WIN_SIZE)
+    parser.add_argument("--seconds", type=float, default=SECONDS)
+    parser.add_argument("--snr", type=float, default=SNR_DB, help="noise level of noisy_vocal in dB")
+    parser.add_argument("--max-gpe", type=float, default=5.0, help="accuracy bar: gross pitch error %% on every signal")
+    parser.add_argument("--max-fine-cents", type=float, default=25.0, help="accuracy bar: fine error in cents")
+    parser.add_argument("--min-voicing", type=float, default=85.0, help="accuracy bar: voicing accuracy %%")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args(argv)
+
+    results = benchmark(args.methods, args.signals, args.samplerate, args.hop_size, args.win_size,
+                        args.seconds, args.snr)
+    print_results(results, args.samplerate, args.hop_size)
+    best = cheapest(results, args.max_gpe, args.max_fine_cents, args.min_voicing)
+    print(f"\ncheapest detector with gpe <= {args.max_gpe}%, fine <= {args.max_fine_cents} cents "
+          f"and voicing >= {args.min_voicing}% on every signal: {best or 'none'}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,172 @@
+import numpy as np
+
+# PITCH DETECTORS
+# Every detector takes one hop of mono float32 audio and returns (pitch in Hz, confidence 0-1),
+# keeping its own window of the last win_size samples like aubio does. They are interchangeable:
+#   yin, yinfast, yinfft, mcomb, schmitt -> aubio backends
+#   numpy_yin                            -> YIN written with numpy (FFT difference function)
+# Backends that don't report a confidence (yinfft, mcomb, schmitt) report 1 for any pitch and 0
+# for none, so the usual "confidence > 0.8" voicing check works with all of them.
+# pitch_benchmark.py compares them on accuracy and cost.
+WIN_SIZE = 1024
+HOP_SIZE = 512
+TOLERANCE = 0.8
+YIN_THRESHOLD = 0.15  # numpy_yin: first dip of the normalised difference below this is the period
+FMIN, FMAX = 50, 600  # numpy_yin only searches lags inside this range
+AUBIO_METHODS = ["yin", "yinfast", "yinfft", "mcomb", "schmitt"]
+AUBIO_CONFIDENCE = {"yin", "yinfast"}  # the others always report 0
+METHODS = AUBIO_METHODS + ["numpy_yin"]
+
+
+class AubioDetector:
+    '''One of aubio's pitch methods - EX: AubioDetector("yinfft", 44100)'''
+
+    def __init__(self, method, samplerate, hop_size=HOP_SIZE, win_size=WIN_SIZE, tolerance=TOLERANCE):
+        import aubio  # only needed for the aubio backends
+        self.name = method
+        self.hop_size = hop_size
+        self.detector = aubio.pitch(method, win_size, hop_size, samplerate)
+        self.detector.set_unit("Hz")
+        if method in AUBIO_CONFIDENCE:
+            self.detector.set_tolerance(tolerance)
+        self.has_confidence = method in AUBIO_CONFIDENCE
+
+    def __call__(self, block):
+        pitch = float(self.detector(block)[0])
+        if self.has_confidence:
+            return pitch, float(self.detector.get_confidence())
+        return pitch, 1.0 if pitch > 0 else 0.0
+
+
+def yin_frames(frames, samplerate, fmin=FMIN, fmax=FMAX, threshold=YIN_THRESHOLD):
+    '''YIN for a whole batch of frames at once (n_frames, win_size) -> pitch (Hz), confidence
+
+    Difference function through the FFT, cumulative mean normalisation, first local minimum
+    under the threshold (best minimum if none is) and parabolic interpolation.'''
+    frames = np.atleast_2d(np.asarray(frames, dtype=np.float64))
+    n_frames, win_size = frames.shape
+    max_lag = min(win_size // 2, int(samplerate / fmin))
+    min_lag = max(2, int(samplerate / fmax))
+    width = win_size - max_lag  # samples compared at every lag
+
+    # d(tau) = sum (x[j] - x[j + tau])^2 = energy(x[:width]) + energy(x[tau:tau + width]) - 2 r(tau)
+    n_fft = 1 << int(np.ceil(np.log2(win_size + width)))
+    spectrum = np.fft.rfft(frames, n_fft)
+    head = np.fft.rfft(frames[:, :width], n_fft)
+    corr = np.fft.irfft(np.conj(head) * spectrum, n_fft)[:, :max_lag + 1]
+    energy = np.concatenate([np.zeros((n_frames, 1)), np.cumsum(frames ** 2, axis=1)], axis=1)
+    lags = np.arange(max_lag + 1)
+    shifted_energy = energy[:, lags + width] - energy[:, lags]
+    diff = np.maximum(energy[:, width:width + 1] + shifted_energy - 2 * corr, 0.0)
+
+    # cumulative mean normalised difference, d'(0) = 1
+    cmnd = np.ones_like(diff)
+    running = np.cumsum(diff[:, 1:], axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cmnd[:, 1:] = np.where(running > 0, diff[:, 1:] * lags[1:] / running, 1.0)
+
+    # first local minimum under the threshold inside [min_lag, max_lag - 1]
+    inner = cmnd[:, min_lag:max_lag]
+    local_min = (inner <= cmnd[:, min_lag - 1:max_lag - 1]) & (inner <= cmnd[:, min_lag + 1:max_lag + 1])
+    candidates = local_min & (inner < threshold)
+    found = candidates.any(axis=1)
+    tau = np.where(found, candidates.argmax(axis=1), inner.argmin(axis=1)) + min_lag
+
+    # parabolic interpolation around the chosen lag
+    rows = np.arange(n_frames)
+    left, center, right = cmnd[rows, tau - 1], cmnd[rows, tau], cmnd[rows, tau + 1]
+    denominator = left - 2 * center + right
+    with np.errstate(divide="ignore", invalid="ignore"):
+        shift = np.where(np.abs(denominator) > 1e-12, 0.5 * (left - right) / denominator, 0.0)
+    period = tau + np.clip(shift, -1, 1)
+
+    confidence = np.clip(1.0 - center, 0.0, 1.0)
+    silent = energy[:, -1] <= 1e-10
+    pitch = np.where(silent, 0.0, samplerate / period)
+    confidence[silent] = 0.0
+    return pitch.astype(np.float32), confidence.astype(np.float32)
+
+
+class NumpyYinDetector:
+    '''YIN in numpy, same hop-by-hop interface as the aubio backends'''
+
+    def __init__(self, samplerate, hop_size=HOP_SIZE, win_size=WIN_SIZE, threshold=YIN_THRESHOLD,
+                 fmin=FMIN, fmax=FMAX):
+        self.name = "numpy_yin"
+        self.samplerate = samplerate
+        self.hop_size = hop_size
+        self.threshold = threshold
+        self.fmin, self.fmax = fmin, fmax
+        self.has_confidence = True
+        self.window = np.zeros((1, win_size), dtype=np.float64)  # last win_size samples
+
+    def __call__(self, block):
+        n = min(len(block), self.window.shape[1])
+        if n:
+            self.window[0, :-n] = self.window[0, n:]
+            self.window[0, -n:] = block[-n:]
+        pitch, confidence = yin_frames(self.window, self.samplerate, self.fmin, self.fmax, self.threshold)
+        return float(pitch[0]), float(confidence[0])
+
+
+class MultiChannelDetector:
+    '''One detector per channel (EX: one per singer), numpy_yin does every channel in one vectorised call'''
+
+    def __init__(self, method, samplerate, channels, hop_size=HOP_SIZE, win_size=WIN_SIZE, tolerance=TOLERANCE):
+        self.name = method
+        self.samplerate = samplerate
+        self.channels = channels
+        self.vectorized = method == "numpy_yin"
+        if self.vectorized:
+            self.window = np.zeros((channels, win_size), dtype=np.float64)  # last win_size samples per channel
+        else:
+            self.detectors = [make_detector(method, samplerate, hop_size, win_size, tolerance) for _ in range(channels)]
+        self.pitch = np.zeros(channels)  # reused every call
+        self.confidence = np.zeros(channels)
+
+    def __call__(self, blocks):
+        '''blocks is (channels, hop_size) float32, returns pitch and confidence arrays (overwritten next call)'''
+        if self.vectorized:
+            n = min(blocks.shape[1], self.window.shape[1])
+            if n:
+                self.window[:, :-n] = self.window[:, n:]
+                self.window[:, -n:] = blocks[:, -n:]
+            self.pitch[:], self.confidence[:] = yin_frames(self.window, self.samplerate)
+        else:
+            for i, detector in enumerate(self.detectors):
+                self.pitch[i], self.confidence[i] = detector(blocks[i])
+        return self.pitch, self.confidence
+
+
+def make_detector(method, samplerate, hop_size=HOP_SIZE, win_size=WIN_SIZE, tolerance=TOLERANCE):
+    '''Builds a detector by name (see METHODS)'''
+    if method in AUBIO_METHODS:
+        return AubioDetector(method, samplerate, hop_size, win_size, tolerance)
+    if method == "numpy_yin":
+        return NumpyYinDetector(samplerate, hop_size, win_size)
+    raise ValueError(f"unknown pitch detector {method!r}, pick one of {', '.join(METHODS)}")
+
+
+def detect_pitch(audio, samplerate, method="yin", hop_size=HOP_SIZE, win_size=WIN_SIZE, tolerance=TOLERANCE,
+                 batch_frames=4096):
+    '''Pitch and confidence for every hop of a whole signal, frame i ends at sample (i + 1) * hop_size
+
+    Same frames the live detector would see. numpy_yin runs on batches of frames instead of hop by hop.'''
+    audio = np.asarray(audio, dtype=np.float32)
+    n_hops = int(np.ceil(len(audio) / hop_size))
+    audio = np.pad(audio, (0, n_hops * hop_size - len(audio)))
+    pitch = np.zeros(n_hops, dtype=np.float32)
+    confidence = np.zeros(n_hops, dtype=np.float32)
+
+    if method == "numpy_yin":
+        padded = np.concatenate([np.zeros(max(win_size - hop_size, 0), dtype=np.float32), audio])
+        frames = np.lib.stride_tricks.sliding_window_view(padded, win_size)[::hop_size][:n_hops]
+        for start in range(0, n_hops, batch_frames):  # bounded memory for long songs
+            pitch[start:start + batch_frames], confidence[start:start + batch_frames] = \
+                yin_frames(frames[start:start + batch_frames], samplerate)
+        return pitch, confidence
+
+    detector = make_detector(method, samplerate, hop_size, win_size, tolerance)
+    for i, block in enumerate(audio.reshape(n_hops, hop_size)):
+        pitch[i], confidence[i] = detector(block)
+    return pitch, confidence
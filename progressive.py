@@ -0,0 +1,196 @@
+import queue
+import threading
+import numpy as np
+import librosa
+from separation import DEMUCS_MODEL, OVERLAP_SECONDS, DemucsSeparator, CrossFade, plan_segments
+from analysis import (HOP_SIZE, FMIN, FMAX, WHISPER_MODEL, WHISPER_SAMPLERATE, YIN_FRAME, TranscriptionService,
+                      voiced_regions)
+from lyric_index import LyricIndex
+
+# PROGRESSIVE PIPELINE
+# Instead of separating, analysing and transcribing the whole song before the first note,
+# the song is handled in chunks (20 s by default). For every chunk, in order:
+#   1. Demucs splits it into vocals / no_vocals (model stays loaded between chunks)
+#   2. YIN + RMS fill that part of the f0 / rms arrays
+#   3. the vocals are sent to the Whisper worker process, lyrics get added when it is done
+#   4. the backing track chunk is queued for playback
+# Chunks overlap by OVERLAP_SECONDS and are cross-faded like the parallel separation (see
+# separation.py), so the stems have no seam every chunk. The overlap at the end of a chunk is
+# only final once the next one is separated, until then it is lookahead for YIN (which also gets
+# the end of the previous chunk), so f0 / rms come out the same as for one long analysis.
+# Playback starts once the first lead_seconds are ready and the pipeline keeps working
+# ahead of the playhead. Only a few chunks of audio are in memory at a time: the backing
+# queue is bounded, so the pipeline waits when it gets too far ahead.
+CHUNK_SECONDS = 20
+LEAD_SECONDS = 20  # analysed audio needed before we start playing
+MAX_CHUNKS_AHEAD = 4
+
+
+class StreamingBacking:
+    '''Backing track delivered chunk by chunk, read block by block by the output callback'''
+
+    def __init__(self, max_chunks=MAX_CHUNKS_AHEAD):
+        self.chunks = queue.Queue(maxsize=max_chunks)
+        self.current = np.zeros(0, dtype=np.float32)
+        self.position = 0
+        self.finished = False  # set once the last chunk is queued
+        self.underrun_samples = 0  # silence we had to play because the pipeline was late
+
+    def put(self, chunk):
+        '''Queues the next chunk (mono float32), blocks while the queue is full'''
+        self.chunks.put(np.ascontiguousarray(chunk, dtype=np.float32))
+
+    def finish(self):
+        self.chunks.put(None)
+
+    def read(self, out):
+        '''Fills out (1-D) with the next samples, returns how many were silence because nothing was ready
+
+        Raises EOFError once the whole song has been played.'''
+        filled = 0
+        while filled < len(out):
+            if self.position >= len(self.current):
+                try:
+                    chunk = self.chunks.get_nowait()
+                except queue.Empty:
+                    if self.finished:
+                        break
+                    out[filled:] = 0  # pipeline fell behind, play silence until the next chunk arrives
+                    self.underrun_samples += len(out) - filled
+                    return len(out) - filled
+                if chunk is None:
+                    self.finished = True
+                    break
+                self.current, self.position = chunk, 0
+            n = min(len(out) - filled, len(self.current) - self.position)
+            out[filled:filled + n] = self.current[self.position:self.position + n]
+            filled += n
+            self.position += n
+        if filled < len(out):
+            out[filled:] = 0
+            if filled == 0:
+                raise EOFError
+        return 0
+
+
+class ProgressivePipeline(threading.Thread):
+    def __init__(self, input_file, output_samplerate=None, hop_size=HOP_SIZE, fmin=FMIN, fmax=FMAX,
+                 demucs_model=DEMUCS_MODEL, whisper_model=WHISPER_MODEL, chunk_seconds=CHUNK_SECONDS):
+        '''Sets up the (initially empty) reference arrays for the whole song, nothing is decoded yet'''
+        super().__init__(daemon=True)
+        self.input_file = input_file
+        self.hop_size = hop_size
+        self.fmin, self.fmax = fmin, fmax
+        self.demucs_model = demucs_model
+        self.whisper_model = whisper_model
+
+        self.input_samplerate = librosa.get_samplerate(input_file)
+        self.duration = librosa.get_duration(path=input_file)
+        self.samplerate = 44100  # Demucs output rate (same for every model), reference frames count at this rate
+        self.output_samplerate = output_samplerate or self.samplerate
+        self.chunk_samples = max(1, round(chunk_seconds * self.samplerate / hop_size)) * hop_size  # whole hops
+        self.overlap_samples = max(1, round(OVERLAP_SECONDS * self.samplerate / hop_size)) * hop_size
+
+        n_frames = int(np.ceil(self.duration * self.samplerate / hop_size)) + 1
+        self.f0 = np.zeros(n_frames, dtype=np.float32)  # 0 = unvoiced / not analysed yet
+        self.rms = np.zeros(n_frames, dtype=np.float32)
+        self.lyric_index = LyricIndex()
+        self.backing = StreamingBacking()
+
+        self.ready_seconds = 0.0
+        self.done = False
+        self.error = None
+        self.condition = threading.Condition()
+
+    def wait_ready(self, seconds=LEAD_SECONDS):
+        '''Blocks until the first seconds of the song (or the whole song) are analysed'''
+        with self.condition:
+            self.condition.wait_for(lambda: self.error or self.done
+                                    or self.ready_seconds >= min(seconds, self.duration))
+        self.check()
+
+    def check(self):
+        '''Raises what stopped the pipeline or failed a transcription, if anything did (call after the session too)'''
+        if self.error:
+            raise self.error
+
+    def run(self):
+        try:
+            self._process()
+        except Exception as error:
+            self.error = error
+        finally:
+            self.backing.finish()
+            with self.condition:
+                self.done = True
+                self.condition.notify_all()
+
+    def _process(self):
+        transcriber = TranscriptionService(self.whisper_model, use_worker=True)  # loads Whisper while Demucs loads here
+        separator = DemucsSeparator(self.demucs_model)
+        self.samplerate = separator.samplerate
+        pending_lyrics = []  # one worker -> futures finish in song order, so lines are added in order
+        total = int(round(self.duration * self.samplerate))
+        segments = plan_segments(total, self.chunk_samples + self.overlap_samples, self.overlap_samples)
+        fades = CrossFade(self.overlap_samples), CrossFade(self.overlap_samples)  # vocals, no_vocals
+        context_samples = -(-YIN_FRAME // 2 // self.hop_size) * self.hop_size  # whole hops
+        context = np.zeros(0, dtype=np.float32)  # end of the previous chunk's final vocals
+        resampler = None
+        if self.output_samplerate != self.samplerate:  # one stream for the whole song, no click at every chunk
+            import soxr  # comes with librosa
+            resampler = soxr.ResampleStream(self.samplerate, self.output_samplerate, 1, dtype="float32")
+        try:
+            for index, (start, length) in enumerate(segments):
+                mixture, _ = librosa.load(self.input_file, sr=None, mono=False,
+                                          offset=start / self.samplerate, duration=length / self.samplerate)
+                if mixture.size == 0:
+                    break
+                stems = separator.separate(np.atleast_2d(mixture), self.input_samplerate)
+                # decoders can be a few samples off, the chunk grid is what counts
+                stems = [librosa.util.fix_length(stem.mean(axis=0), size=length) for stem in stems]
+                last = index == len(segments) - 1
+                vocals, no_vocals = [fade.join(stem, last) for fade, stem in zip(fades, stems)]
+                lookahead = stems[0][len(vocals):]  # not final yet (the next chunk fades it), still good context
+
+                # Pitch + loudness of the final part of the chunk, written into the song-length arrays
+                window = np.concatenate([context, vocals, lookahead])
+                f0 = np.nan_to_num(librosa.yin(window, fmin=self.fmin, fmax=self.fmax,
+                                               sr=self.samplerate, hop_length=self.hop_size))
+                rms = librosa.feature.rms(y=window, frame_length=self.hop_size, hop_length=self.hop_size)[0]
+                skip = len(context) // self.hop_size
+                count = len(vocals) // self.hop_size + 1 if last else len(vocals) // self.hop_size
+                f0, rms = f0[skip:skip + count], rms[skip:skip + count]
+                first = start // self.hop_size
+                n = min(len(f0), len(rms), len(self.f0) - first)
+                self.f0[first:first + n] = f0[:n]
+                self.rms[first:first + n] = rms[:n]
+                context = vocals[-context_samples:].copy()
+
+                # Whisper only gets the parts of the chunk where somebody sings (nothing for instrumental chunks)
+                chunk_start = start / self.samplerate
+                whisper_vocals = librosa.resample(vocals, orig_sr=self.samplerate, target_sr=WHISPER_SAMPLERATE)
+                for region_start, region_end in voiced_regions(rms, f0, self.samplerate, self.hop_size):
+                    future = transcriber.submit(whisper_vocals[int(region_start * WHISPER_SAMPLERATE):
+                                                               int(region_end * WHISPER_SAMPLERATE)],
+                                                offset=chunk_start + region_start)
+                    future.add_done_callback(self._add_lyrics)
+                    pending_lyrics.append(future)
+
+                # blocks when we are MAX_CHUNKS_AHEAD in front of the playhead
+                if resampler is not None:
+                    no_vocals = resampler.resample_chunk(np.ascontiguousarray(no_vocals, dtype=np.float32), last=last)
+                self.backing.put(no_vocals)
+                with self.condition:
+                    self.ready_seconds = (start + len(vocals)) / self.samplerate
+                    self.condition.notify_all()
+
+            for future in pending_lyrics:
+                future.result()  # wait for the last lyrics (and raise if Whisper failed)
+        finally:
+            transcriber.close()
+
+    def _add_lyrics(self, future):
+        if future.exception() is None:
+            self.lyric_index.add(future.result())
+        elif self.error is None:  # playback goes on without these lyrics, check() reports it
+            self.error = future.exception()
@@ -0,0 +1,207 @@
+import os
+import sys
+import json
+import struct
+import numpy as np
+from note_index import NoteIndex, segment_notes
+
+# REFERENCE FILE (.vhref)
+# Compact on-disk version of everything the game needs about a song, laid out so the
+# arrays can be opened with np.memmap: opening is near instant and several sessions
+# of the same song share the same pages in memory.
+#
+#   magic "VHREF\0\0\0" | version (uint32) | header length (uint32) | json header | arrays
+#
+# Arrays (each starts on a 64 byte boundary, offsets/dtypes/shapes are in the header):
+#   f0_cents      int16    pitch in midi cents (A4 = 6900), 0 = unvoiced
+#   rms           float16  loudness
+#   voiced        uint8    voicing bitmap (np.packbits, one bit per frame)
+#   lyric_times   float32  (n_lines, 2) start / end in seconds
+#   lyric_offsets uint32   (n_lines + 1) byte offsets of each line in lyric_text
+#   lyric_text    uint8    all lyric lines, utf-8
+#   note_onsets / note_offsets  int32    first frame / frame after the last of every note (see note_index.py)
+#   note_midi                   int16    median midi note
+#   note_stability              float16  share of the note's frames held on pitch
+#   word_times    float32  (n_words, 2) start / end in seconds, only when Whisper gave word timing
+#   word_offsets  uint32   (n_words + 1) byte offsets of each word in word_text
+#   word_text     uint8    all words, utf-8
+#   word_lines    uint32   lyric line each word belongs to
+# Files written before the note arrays existed still open, their notes are worked out on load.
+# The header also has the analysis parameters (hop_size, samplerate, fmin, fmax...).
+MAGIC = b"VHREF\0\0\0"
+VERSION = 1
+ALIGNMENT = 64
+PREAMBLE = struct.Struct("<8sII")  # magic, version, header length
+
+
+def hz_to_cents(f0):
+    '''Hz -> midi cents as int16, 0 where there is no pitch'''
+    f0 = np.asarray(f0, dtype=np.float64)
+    cents = np.zeros(f0.shape, dtype=np.int16)
+    voiced = f0 > 0
+    cents[voiced] = np.round(100 * (69 + 12 * np.log2(f0[voiced] / 440.0))).astype(np.int16)
+    return cents
+
+
+def cents_to_hz(cents):
+    '''midi cents -> Hz, 0 stays 0'''
+    cents = np.asarray(cents, dtype=np.float64)
+    return np.where(cents > 0, 440.0 * 2 ** ((cents / 100 - 69) / 12), 0.0)
+
+
+class CentsAsHz:
+    '''Read-only view that looks like the old f0 array (Hz) but decodes the int16 cents on access'''
+
+    def __init__(self, cents):
+        self.cents = cents
+
+    def __len__(self):
+        return len(self.cents)
+
+    def __getitem__(self, index):
+        value = cents_to_hz(self.cents[index])
+        return float(value) if value.ndim == 0 else value
+
+    def __array__(self, dtype=None, copy=None):
+        return cents_to_hz(self.cents).astype(dtype or np.float64)
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def write_reference(path, f0, rms, lyrics, samplerate, hop_size, **params):
+    '''Writes a .vhref file from the in-memory arrays (f0 in Hz, rms, Whisper segments)'''
+    f0 = np.nan_to_num(np.asarray(f0, dtype=np.float64))
+    text = [segment["text"].encode("utf-8") for segment in lyrics]
+    f0_cents = hz_to_cents(f0)
+    notes = segment_notes(f0_cents, hop_size=hop_size)
+    words = [(line, word) for line, segment in enumerate(lyrics) for word in segment.get("words", [])]
+    word_text = [word["word"].encode("utf-8") for _, word in words]
+    arrays = {
+        "f0_cents": f0_cents,
+        "rms": np.asarray(rms, dtype=np.float16),
+        "voiced": np.packbits(f0 > 0),
+        "lyric_times": np.array([[segment["start"], segment["end"]] for segment in lyrics],
+                                dtype=np.float32).reshape(len(lyrics), 2),
+        "lyric_offsets": np.concatenate([[0], np.cumsum([len(line) for line in text])]).astype(np.uint32),
+        "lyric_text": np.frombuffer(b"".join(text), dtype=np.uint8),
+        "note_onsets": notes.onsets,
+        "note_offsets": notes.offsets,
+        "note_midi": notes.midi,
+        "note_stability": notes.stability,
+    }
+    if words:
+        arrays["word_times"] = np.array([[word["start"], word["end"]] for _, word in words],
+                                        dtype=np.float32).reshape(len(words), 2)
+        arrays["word_offsets"] = np.concatenate([[0], np.cumsum([len(word) for word in word_text])]).astype(np.uint32)
+        arrays["word_text"] = np.frombuffer(b"".join(word_text), dtype=np.uint8)
+        arrays["word_lines"] = np.array([line for line, _ in words], dtype=np.uint32)
+    header = {"samplerate": int(samplerate), "hop_size": int(hop_size), "n_frames": len(f0),
+              "params": params, "arrays": {}}
+
+    # Offsets depend on the header length, which depends on the offsets -> pad the header generously
+    def layout(header_bytes_len):
+        offset = _align(PREAMBLE.size + header_bytes_len)
+        for name, array in arrays.items():
+            header["arrays"][name] = {"offset": offset, "dtype": array.dtype.str, "shape": list(array.shape)}
+            offset = _align(offset + array.nbytes)
+        return json.dumps(header).encode("utf-8")
+
+    header_bytes = layout(0)
+    header_bytes = layout(len(header_bytes) + 256)
+    header_bytes = header_bytes.ljust(header["arrays"]["f0_cents"]["offset"] - PREAMBLE.size, b" ")
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(PREAMBLE.pack(MAGIC, VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        for name, array in arrays.items():
+            f.seek(header["arrays"][name]["offset"])
+            f.write(np.ascontiguousarray(array).tobytes())
+    os.replace(tmp_path, path)  # never leave half a file behind
+    return path
+
+
+class ReferenceFile:
+    def __init__(self, path):
+        '''Opens a .vhref file, the arrays are memory-mapped and not read until used'''
+        with open(path, "rb") as f:
+            magic, version, header_len = PREAMBLE.unpack(f.read(PREAMBLE.size))
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a VoiceHero reference file")
+            if version != VERSION:
+                raise ValueError(f"{path} is reference format version {version}, this code reads version {VERSION}")
+            header = json.loads(f.read(header_len))
+        self.path = path
+        self.header = header
+        self.samplerate = header["samplerate"]
+        self.hop_size = header["hop_size"]
+        self.params = header["params"]
+        self.arrays = {name: self._map(info) for name, info in header["arrays"].items()}
+
+        self.f0_cents = self.arrays["f0_cents"]
+        self.f0 = CentsAsHz(self.f0_cents)  # drop-in for the old f0 array
+        self.rms = self.arrays["rms"]
+        self._lyrics = None
+        self._notes = None
+
+    def _map(self, info):
+        shape = tuple(info["shape"])
+        if int(np.prod(shape)) == 0:  # mmap can't map zero bytes
+            return np.zeros(shape, dtype=info["dtype"])
+        return np.memmap(self.path, dtype=info["dtype"], mode="r", offset=info["offset"], shape=shape)
+
+    @property
+    def voiced(self):
+        '''Boolean voicing per frame'''
+        return np.unpackbits(self.arrays["voiced"], count=self.header["n_frames"]).astype(bool)
+
+    @property
+    def notes(self):
+        '''NoteIndex of the vocals, segmented from f0 for files that don't have the note arrays'''
+        if self._notes is None:
+            if "note_onsets" in self.arrays:
+                self._notes = NoteIndex(self.arrays["note_onsets"], self.arrays["note_offsets"],
+                                        self.arrays["note_midi"], self.arrays["note_stability"])
+            else:
+                self._notes = segment_notes(self.f0_cents, hop_size=self.hop_size)
+        return self._notes
+
+    @property
+    def lyrics(self):
+        '''Lyric segments as a list of dicts (start, end, text + words when the file has word timing), decoded once'''
+        if self._lyrics is None:
+            times, offsets = self.arrays["lyric_times"], self.arrays["lyric_offsets"]
+            text = bytes(self.arrays["lyric_text"])
+            self._lyrics = [{"start": float(times[i, 0]), "end": float(times[i, 1]),
+                             "text": text[offsets[i]:offsets[i + 1]].decode("utf-8")}
+                            for i in range(len(times))]
+            if "word_times" in self.arrays:
+                times, offsets = self.arrays["word_times"], self.arrays["word_offsets"]
+                text = bytes(self.arrays["word_text"])
+                for segment in self._lyrics:
+                    segment["words"] = []
+                for i, line in enumerate(self.arrays["word_lines"].tolist()):
+                    self._lyrics[line]["words"].append({"start": float(times[i, 0]), "end": float(times[i, 1]),
+                                                        "word": text[offsets[i]:offsets[i + 1]].decode("utf-8")})
+        return self._lyrics
+
+
+def convert_song_dir(song_dir):
+    '''Builds reference.vhref from a library song folder (f0.npy, rms.npy, lyrics.json, meta.json)'''
+    with open(os.path.join(song_dir, "meta.json")) as f:
+        meta = json.load(f)
+    with open(os.path.join(song_dir, "lyrics.json")) as f:
+        lyrics = json.load(f)
+    settings = meta.get("settings", {})
+    return write_reference(os.path.join(song_dir, "reference.vhref"),
+                           np.load(os.path.join(song_dir, "f0.npy")), np.load(os.path.join(song_dir, "rms.npy")),
+                           lyrics, meta["sr"], settings.get("hop_size", 512),
+                           **{key: value for key, value in settings.items() if key != "hop_size"})
+
+
+if __name__ == "__main__":
+    # EX: python reference_file.py library/*/
+    for song_dir in sys.argv[1:]:
+        print(convert_song_dir(song_dir))
@@ -0,0 +1,113 @@
+import sys
+import threading
+from collections import deque
+import pyfiglet
+
+# TERMINAL RENDERER
+# The audio callback runs ~86 times a second and must never block, so it does no
+# text formatting or printing itself. It only appends (lyric, accuracy) events to a
+# bounded deque (append/popleft are atomic, no lock needed, oldest events get dropped
+# if the renderer falls behind). A separate thread redraws the screen at a fixed
+# frame rate using banners that were all rendered once at startup.
+FPS = 30
+MAX_EVENTS = 256
+CLEAR_SCREEN = "\033[H\033[J"  # cursor home + clear, so each frame redraws in place
+
+
+def feedback_for(accuracy):
+    '''Feedback text and colour code for a score'''
+    if accuracy > 90.0:
+        return "Excellent!!!", "32"  # green
+    elif accuracy > 75.0:
+        return "good job", "33"  # yellow
+    elif accuracy > 50.0:
+        return "not very good :/", "35"  # purple
+    return "You Suck!", "31"  # red
+
+
+def render_banners():
+    '''Pre-renders the big figlet text for every score 0% to 100%'''
+    return [pyfiglet.figlet_format(f"{percent}%") for percent in range(101)]
+
+
+class Renderer(threading.Thread):
+    def __init__(self, fps=FPS, max_events=MAX_EVENTS, out=sys.stdout):
+        '''initializes the event queue and renders all banners'''
+        super().__init__(daemon=True)
+        self.period = 1.0 / fps
+        self.out = out
+        self.events = deque(maxlen=max_events)  # filled by the audio thread
+        self.statuses = deque(maxlen=max_events)  # PortAudio status flags (overflows...)
+        self.singer_events = deque(maxlen=max_events)  # group mode: one score per singer
+        self.banners = render_banners()
+        self.stop_event = threading.Event()
+        self.text = ""
+        self.accuracy = -1
+        self.status_line = ""
+        self.singer_scores = None
+
+    # AUDIO THREAD SIDE -- only appends, never formats or prints
+    def push(self, text, accuracy):
+        '''Queues a score (accuracy -1 = only the lyric changed)'''
+        self.events.append((text, accuracy))
+
+    def push_status(self, status):
+        self.statuses.append(status)
+
+    def push_singers(self, accuracies):
+        '''Queues every singer's score in group mode (-1 = that singer is not singing right now)'''
+        self.singer_events.append(tuple(accuracies))
+
+    # RENDER THREAD SIDE
+    def run(self):
+        '''Redraws at a fixed frame rate until stop() is called'''
+        while not self.stop_event.wait(self.period):
+            self.draw_pending()
+
+    def draw_pending(self):
+        '''Takes everything queued since the last frame and draws the newest state once'''
+        changed = False
+        while True:
+            try:
+                text, accuracy = self.events.popleft()
+            except IndexError:
+                break
+            if text != self.text:
+                self.text, changed = text, True
+            if accuracy != -1 and accuracy != self.accuracy:
+                self.accuracy, changed = accuracy, True
+        while True:
+            try:
+                self.status_line, changed = str(self.statuses.popleft()).strip(), True
+            except IndexError:
+                break
+        while True:
+            try:
+                self.singer_scores, changed = self.singer_events.popleft(), True
+            except IndexError:
+                break
+        if changed:
+            self.out.write(self.frame())
+            self.out.flush()
+
+    def frame(self):
+        '''Builds one full screen: score banner, feedback and lyric line'''
+        lines = [CLEAR_SCREEN]
+        if self.accuracy != -1:
+            percent = min(100, max(0, int(self.accuracy)))
+            feedback, colour = feedback_for(self.accuracy)
+            lines.append(f"\033[30;{colour}m{self.banners[percent]} \n {feedback} \033[0m\n")
+        lines.append(f"\033[1;37;90m{self.text}\033[0m\n")
+        if self.singer_scores is not None:
+            lines.append("  ".join(f"Singer {i + 1}: {int(score)}%" if score >= 0 else f"Singer {i + 1}: --"
+                                   for i, score in enumerate(self.singer_scores)) + "\n")
+        if self.status_line:
+            lines.append(f"{self.status_line}\n")
+        return "".join(lines)
+
+    def stop(self):
+        '''Stops the thread and draws whatever is still queued'''
+        self.stop_event.set()
+        if self.is_alive():
+            self.join()
+        self.draw_pending()
@@ -0,0 +1,246 @@
+import os
+import sys
+import queue
+import sqlite3
+import argparse
+import threading
+import numpy as np
+
+# RESULTS STORE
+# Every finished song goes into one SQLite database (WAL mode) instead of only being printed:
+#
+#   sessions     one row per singer per song: who, which song, when, average, frames / notes scored
+#   line_scores  average score per lyric line of a session
+#   note_scores  right / sung frames per note of a session (see note_index.py)
+#   frame_scores score of every scored frame, only when asked for (millions of rows add up fast)
+#
+# The audio callback never sees the database: it fills a preallocated per-frame score array,
+# and at the end of the song save_session() hands everything to a writer thread, which owns
+# its own connection and inserts in executemany batches, one transaction per session. WAL
+# lets the queries below (and other processes, EX: a leaderboard) read while it writes.
+# frame_scores is a WITHOUT ROWID table keyed (session, frame), so the rows of one
+# session sit together on disk and a session's frames come back with one range scan.
+#
+# EX: python results_store.py --singer christina            (best score per song)
+#     python results_store.py --song My_Song-1a2b3c4d         (score distribution of a song)
+DEFAULT_DB = os.path.join(os.path.expanduser("~"), ".voicehero_cache", "results.db")
+BATCH_ROWS = 20000  # frame rows per executemany call
+HISTOGRAM_BINS = 10  # score distribution buckets of 10%
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    singer TEXT NOT NULL,
+    song TEXT NOT NULL,
+    started REAL NOT NULL,
+    ended REAL NOT NULL,
+    average REAL,
+    scored_frames INTEGER NOT NULL,
+    notes_hit INTEGER,
+    notes_sung INTEGER,
+    reason TEXT,
+    take TEXT
+);
+CREATE INDEX IF NOT EXISTS sessions_singer_song ON sessions (singer, song, average DESC);
+CREATE INDEX IF NOT EXISTS sessions_song_average ON sessions (song, average);
+CREATE TABLE IF NOT EXISTS line_scores (
+    session_id INTEGER NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+    line INTEGER NOT NULL,
+    start REAL NOT NULL,
+    text TEXT NOT NULL,
+    score REAL,
+    frames INTEGER NOT NULL,
+    PRIMARY KEY (session_id, line)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS note_scores (
+    session_id INTEGER NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+    note INTEGER NOT NULL,
+    midi INTEGER NOT NULL,
+    onset INTEGER NOT NULL,
+    hits INTEGER NOT NULL,
+    frames INTEGER NOT NULL,
+    PRIMARY KEY (session_id, note)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS frame_scores (
+    session_id INTEGER NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+    frame INTEGER NOT NULL,
+    score REAL NOT NULL,
+    PRIMARY KEY (session_id, frame)
+) WITHOUT ROWID;
+"""
+
+
+def connect(path):
+    '''Connection with WAL on and the schema in place'''
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    connection = sqlite3.connect(path, timeout=30)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")  # WAL stays consistent, a power cut loses the last commits at most
+    connection.execute("PRAGMA foreign_keys=ON")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def average_score(frame_scores):
+    '''Mean of the scored (non-NaN) frames, None when nothing was scored'''
+    frame_scores = np.asarray(frame_scores, dtype=np.float64)
+    scored = frame_scores[~np.isnan(frame_scores)]
+    return float(scored.mean()) if len(scored) else None
+
+
+class SessionResult:
+    '''Everything stored about one singer's song, worked out after the streams are closed'''
+
+    def __init__(self, singer, song, started, ended, frame_scores, samplerate, hop_size, lines=(), notes=None,
+                 note_hits=None, note_frames=None, reason=None, take=None, keep_frames=False):
+        '''frame_scores has one score per reference frame, NaN where the singer was not scored.
+        lines are the lyric segments (start, end, text), notes / note_hits / note_frames the NoteIndex counts.'''
+        from offline_scoring import score_lines
+        self.singer, self.song, self.started, self.ended = singer, song, started, ended
+        self.reason, self.take = reason, take
+        frame_scores = np.asarray(frame_scores, dtype=np.float64)
+        scored = ~np.isnan(frame_scores)
+        self.scored_frames = int(scored.sum())
+        self.average = average_score(frame_scores)
+        self.frames = (np.flatnonzero(scored), frame_scores[scored]) if keep_frames else None
+        self.lines = score_lines(frame_scores, list(lines), samplerate, hop_size)
+        self.notes = []  # (note, midi, onset, hits, frames) of the notes that were sung
+        self.notes_hit = self.notes_sung = None
+        if notes is not None:
+            from note_index import HIT_SHARE
+            sung = np.flatnonzero(np.asarray(note_frames) > 0)
+            self.notes = [(int(i), int(notes.midi[i]), int(notes.onsets[i]), int(note_hits[i]), int(note_frames[i]))
+                          for i in sung]
+            self.notes_sung = len(sung)
+            self.notes_hit = sum(hits / frames >= HIT_SHARE for _, _, _, hits, frames in self.notes)
+
+
+class ResultsStore:
+    def __init__(self, path=DEFAULT_DB):
+        '''Opens (or creates) the database, writes go through a background writer thread'''
+        self.path = path
+        connect(path).close()  # schema in place before the first query
+        self.jobs = queue.SimpleQueue()
+        self.errors = []
+        self.writer = threading.Thread(target=self._run, daemon=True)
+        self.writer.start()
+        self._reader = None
+
+    # WRITES (writer thread)
+    def save_session(self, result):
+        '''Queues a SessionResult, returns right away'''
+        self.jobs.put(result)
+
+    def _run(self):
+        connection = connect(self.path)
+        try:
+            while True:
+                result = self.jobs.get()
+                if result is None:
+                    break
+                try:
+                    self._insert(connection, result)
+                except sqlite3.Error as error:  # keep going, close() reports it
+                    connection.rollback()
+                    self.errors.append(error)
+        finally:
+            connection.close()
+
+    def _insert(self, connection, result):
+        with connection:  # one transaction per session
+            cursor = connection.execute(
+                "INSERT INTO sessions (singer, song, started, ended, average, scored_frames, notes_hit, notes_sung,"
+                " reason, take) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (result.singer, result.song, result.started, result.ended, result.average, result.scored_frames,
+                 result.notes_hit, result.notes_sung, result.reason, result.take))
+            session_id = cursor.lastrowid
+            connection.executemany(
+                "INSERT INTO line_scores VALUES (?, ?, ?, ?, ?, ?)",
+                [(session_id, i, line["start"], line["text"], line["score"], line["frames"])
+                 for i, line in enumerate(result.lines)])
+            connection.executemany("INSERT INTO note_scores VALUES (?, ?, ?, ?, ?, ?)",
+                                   [(session_id,) + note for note in result.notes])
+            if result.frames is not None:
+                frames, scores = result.frames
+                for start in range(0, len(frames), BATCH_ROWS):
+                    batch = slice(start, start + BATCH_ROWS)
+                    connection.executemany("INSERT INTO frame_scores VALUES (?, ?, ?)",
+                                           [(session_id, frame, score) for frame, score
+                                            in zip(frames[batch].tolist(), scores[batch].tolist())])
+
+    def close(self):
+        '''Waits for the queued sessions to be written, raises the first write error if there was one'''
+        if self.writer.is_alive():
+            self.jobs.put(None)
+            self.writer.join()
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+        if self.errors:
+            raise self.errors[0]
+
+    # QUERIES (calling thread, WAL lets them run next to the writer)
+    @property
+    def reader(self):
+        if self._reader is None:
+            self._reader = connect(self.path)
+        return self._reader
+
+    def best_scores(self, singer):
+        '''(song, best average, sessions) for every song the singer sang, best first'''
+        return self.reader.execute(
+            "SELECT song, MAX(average), COUNT(*) FROM sessions WHERE singer = ? GROUP BY song ORDER BY 2 DESC",
+            (singer,)).fetchall()
+
+    def score_distribution(self, song, bins=HISTOGRAM_BINS):
+        '''Sessions per score bucket of a song - EX: [0, 0, 1, 3, ...] with bins=10 is 0-10%, 10-20%...'''
+        counts = [0] * bins
+        for bucket, count in self.reader.execute(
+                "SELECT MIN(CAST(average * ? / 100 AS INTEGER), ? - 1), COUNT(*) FROM sessions"
+                " WHERE song = ? AND average IS NOT NULL GROUP BY 1", (bins, bins, song)):
+            counts[bucket] += count
+        return counts
+
+    def line_scores(self, session_id):
+        '''(line, start, text, score) of one session'''
+        return self.reader.execute("SELECT line, start, text, score FROM line_scores WHERE session_id = ? "
+                                   "ORDER BY line", (session_id,)).fetchall()
+
+    def frame_scores(self, session_id):
+        '''frames and scores arrays of one session (empty when they were not kept)'''
+        rows = self.reader.execute("SELECT frame, score FROM frame_scores WHERE session_id = ? ORDER BY frame",
+                                   (session_id,)).fetchall()
+        frames = np.array([row[0] for row in rows], dtype=np.int64)
+        return frames, np.array([row[1] for row in rows], dtype=np.float64)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query the stored session results.")
+    parser.add_argument("--db", default=DEFAULT_DB)
+    parser.add_argument("--singer", help="best score per song of this singer")
+    parser.add_argument("--song", help="score distribution of this song (its song id, EX: My_Song-1a2b3c4d)")
+    args = parser.parse_args(argv)
+    if not (args.singer or args.song):
+        parser.error("give --singer and/or --song")
+
+    store = ResultsStore(args.db)
+    try:
+        if args.singer:
+            for song, best, sessions in store.best_scores(args.singer):
+                best = f"{best:5.1f}%" if best is not None else "    -"
+                print(f"{best}  {song}  ({sessions} sessions)")
+        if args.song:
+            counts = store.score_distribution(args.song)
+            width = max(counts) or 1
+            for i, count in enumerate(counts):
+                print(f"{i * 100 // len(counts):3d}-{(i + 1) * 100 // len(counts):3d}%  "
+                      f"{'#' * (40 * count // width):<40} {count}")
+    finally:
+        store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,290 @@
+import os
+import sys
+import json
+import time
+import struct
+import asyncio
+import argparse
+import itertools
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from reference_file import ReferenceFile
+from alignment import device_hop_size
+from offline_scoring import RULES, score_frames
+from pitch_detectors import METHODS
+from latency_profiles import PROFILES, DEFAULT_PROFILE, get_profile, decimate_f0, decimation
+
+# SCORING SERVER
+# Lets many singers share one box: each client streams its mic over TCP and gets scores back.
+# References come from the library (batch_ingest.py) and are opened once, every session of a
+# song reads the same memory-mapped .vhref. Pitch detection runs in a set of single-process
+# shards, each session stays on one shard so its detector keeps its state between chunks.
+#
+# PROTOCOL (all little-endian)
+#   client -> server  one json line {"song": "<library folder>", "samplerate": 44100}
+#   server -> client  one json line {"session": id, "samplerate": ..., "hop_size": ...} or {"error": ...}
+#   client -> server  chunks: uint32 byte length + float32 mono PCM, length 0 = end of the take
+#   server -> client  one json line per chunk {"chunk": n, "first_frame": i, "scores": [...]}
+#                     (null = frame not scored), then {"done": true, "average": ..., "metrics": {...}}
+# A {"stats": true} hello gets the metrics of every running session instead.
+#
+# Backpressure: every session has a bounded queue between the socket and the scorer. When
+# the scorer falls behind the queue fills up, we stop reading the socket and TCP slows the
+# client down. How long each session spent blocked like that is part of its metrics.
+#
+# Every session runs at the server's latency profile (mic block + detector window), the
+# reference frames are taken down to that block once per song (see latency_profiles.py).
+#
+# EX: python scoring_server.py --library library --shards 4
+#     python load_test.py takes/*.wav --song My_Song-1a2b3c4d --singers 200
+HOST = "127.0.0.1"
+PORT = 8765
+MAX_QUEUED_CHUNKS = 16  # per session, past this the socket is no longer read
+LENGTH = struct.Struct("<I")
+LATENCY_SAMPLES = 1000  # chunk latencies kept per session for the percentiles
+
+
+#SHARD WORKERS (separate processes)
+_detectors = {}  # session id -> detector, lives in the shard process
+
+
+def _worker_detect(session_id, pcm, samplerate, method, hop_size, win_size):
+    '''Pitch and confidence for every whole hop in pcm (float32 bytes), keeps the detector for the next chunk'''
+    from pitch_detectors import make_detector
+    detector = _detectors.get(session_id)
+    if detector is None:
+        detector = _detectors[session_id] = make_detector(method, samplerate, hop_size, win_size)
+    audio = np.frombuffer(pcm, dtype=np.float32)
+    n_hops = len(audio) // hop_size
+    pitch = np.zeros(n_hops, dtype=np.float32)
+    confidence = np.zeros(n_hops, dtype=np.float32)
+    for i in range(n_hops):
+        pitch[i], confidence[i] = detector(audio[i * hop_size:(i + 1) * hop_size])
+    return pitch, confidence
+
+
+def _worker_close(session_id):
+    _detectors.pop(session_id, None)
+
+
+class ReferenceStore:
+    '''Opens each song of the library once and shares it between sessions'''
+
+    def __init__(self, library_dir, hop_size=None):
+        '''hop_size = one frame of the f0 handed out, None = the resolution the song was analysed at'''
+        self.library_dir = library_dir
+        self.hop_size = hop_size
+        self.songs = {}
+
+    def get(self, song):
+        '''(ReferenceFile, f0 in Hz at hop_size) of a library folder name, raises KeyError if there is no such song'''
+        song = os.path.basename(os.path.normpath(song))  # folder name only, never a path out of the library
+        if song not in self.songs:
+            path = os.path.join(self.library_dir, song, "reference.vhref")
+            if not song or not os.path.exists(path):
+                raise KeyError(f"no song {song!r} in {self.library_dir}")
+            reference = ReferenceFile(path)
+            factor = decimation(reference.hop_size, self.hop_size or reference.hop_size)  # ValueError if it can't be
+            self.songs[song] = (reference, decimate_f0(reference.f0, factor))
+        return self.songs[song]
+
+
+class SessionMetrics:
+    def __init__(self, session_id, song):
+        self.session_id = session_id
+        self.song = song
+        self.started = time.monotonic()
+        self.chunks = 0
+        self.frames = 0
+        self.audio_seconds = 0.0
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.backpressure_seconds = 0.0  # time the socket was not read because the queue was full
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)  # chunk received -> scores sent, seconds
+
+    def report(self):
+        latencies = np.array(self.latencies) * 1000
+        elapsed = time.monotonic() - self.started
+        return {
+            "session": self.session_id, "song": self.song, "chunks": self.chunks, "frames": self.frames,
+            "audio_seconds": self.audio_seconds, "realtime_factor": self.audio_seconds / elapsed if elapsed else 0.0,
+            "queue_depth": self.queue_depth, "max_queue_depth": self.max_queue_depth,
+            "backpressure_seconds": self.backpressure_seconds,
+            "latency_ms": {"p50": float(np.percentile(latencies, 50)), "p99": float(np.percentile(latencies, 99)),
+                           "max": float(latencies.max())} if len(latencies) else None,
+        }
+
+
+class ScoringServer:
+    def __init__(self, library_dir, shards=None, method="yin", rule="percent", max_queued=MAX_QUEUED_CHUNKS,
+                 profile=DEFAULT_PROFILE):
+        self.profile = get_profile(profile)
+        self.references = ReferenceStore(library_dir, self.profile.hop_size)
+        self.shards = [ProcessPoolExecutor(max_workers=1) for _ in range(shards or os.cpu_count() or 1)]
+        self.method = method
+        self.rule = rule
+        self.max_queued = max_queued
+        self.sessions = {}  # session id -> SessionMetrics, running sessions only
+        self.ids = itertools.count(1)
+
+    def close(self):
+        for shard in self.shards:
+            shard.shutdown(cancel_futures=True)
+
+    async def _send(self, writer, message):
+        writer.write(json.dumps(message).encode() + b"\n")
+        await writer.drain()
+
+    async def handle(self, reader, writer):
+        '''One client connection = one singing session'''
+        try:
+            hello = json.loads(await reader.readline() or b"{}")
+            if hello.get("stats"):
+                await self._send(writer, {"sessions": [metrics.report() for metrics in self.sessions.values()]})
+                return
+            try:
+                reference, ref_f0 = self.references.get(hello.get("song", ""))
+            except KeyError as error:
+                await self._send(writer, {"error": str(error.args[0])})
+                return
+            except ValueError as error:  # analysed too coarse for the server's profile
+                await self._send(writer, {"error": str(error)})
+                return
+            await self._run_session(reader, writer, hello, reference, ref_f0)
+        except (ConnectionError, asyncio.IncompleteReadError, json.JSONDecodeError):
+            pass  # client went away or spoke nonsense, nothing to report back
+        except Exception as error:  # a shard failed, tell the client instead of hanging up silently
+            try:
+                await self._send(writer, {"error": f"{type(error).__name__}: {error}"})
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+
+    async def _run_session(self, reader, writer, hello, reference, ref_f0):
+        session_id = next(self.ids)
+        samplerate = int(hello.get("samplerate", reference.samplerate))
+        hop_size = device_hop_size(self.profile.hop_size, reference.samplerate, samplerate)  # same time per frame
+        win_size = device_hop_size(self.profile.win_size, reference.samplerate, samplerate)
+        shard = self.shards[session_id % len(self.shards)]
+        metrics = self.sessions[session_id] = SessionMetrics(session_id, hello["song"])
+        await self._send(writer, {"session": session_id, "samplerate": samplerate, "hop_size": hop_size})
+
+        queue = asyncio.Queue(maxsize=self.max_queued)
+        scorer = asyncio.create_task(self._score(queue, writer, metrics, shard, samplerate, hop_size, win_size,
+                                                 ref_f0))
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                (length,) = LENGTH.unpack(await reader.readexactly(LENGTH.size))
+                if length == 0:
+                    break
+                pcm = await reader.readexactly(length)
+                received = loop.time()
+                if not await self._put(queue, (received, pcm), scorer):
+                    break  # scorer died, await scorer below raises its error
+                metrics.backpressure_seconds += loop.time() - received
+                metrics.queue_depth = queue.qsize()
+                metrics.max_queue_depth = max(metrics.max_queue_depth, metrics.queue_depth)
+            await self._put(queue, None, scorer)
+            await scorer
+        finally:
+            scorer.cancel()
+            del self.sessions[session_id]
+            await loop.run_in_executor(shard, _worker_close, session_id)
+
+    async def _put(self, queue, item, scorer):
+        '''Queues item, waiting while the queue is full (-> TCP backpressure), False if the scorer stopped'''
+        if not queue.full():
+            queue.put_nowait(item)
+            return True
+        put = asyncio.ensure_future(queue.put(item))
+        await asyncio.wait({put, scorer}, return_when=asyncio.FIRST_COMPLETED)
+        if not put.done():
+            put.cancel()
+            return False
+        return True
+
+    async def _score(self, queue, writer, metrics, shard, samplerate, hop_size, win_size, ref_f0):
+        '''Takes chunks off the queue, detects pitch on the session's shard and sends the scores back'''
+        loop = asyncio.get_running_loop()
+        pending = b""  # samples that don't make a whole hop yet
+        hop_bytes = hop_size * 4
+        total, scored = 0.0, 0
+        while True:
+            item = await queue.get()
+            metrics.queue_depth = queue.qsize()
+            if item is None:
+                break
+            received, pcm = item
+            pending += pcm
+            usable = len(pending) // hop_bytes * hop_bytes
+            chunk, pending = pending[:usable], pending[usable:]
+            first_frame = metrics.frames
+            if chunk:
+                pitch, confidence = await loop.run_in_executor(
+                    shard, _worker_detect, metrics.session_id, chunk, samplerate, self.method, hop_size, win_size)
+                scores = score_frames(pitch, confidence, ref_f0[first_frame:first_frame + len(pitch)], self.rule)
+                voiced = ~np.isnan(scores)
+                total += scores[voiced].sum()
+                scored += int(voiced.sum())
+                metrics.frames += len(pitch)
+                metrics.audio_seconds += len(pitch) * hop_size / samplerate
+                message_scores = [round(float(score), 1) if ok else None for score, ok in zip(scores, voiced)]
+            else:
+                message_scores = []
+            metrics.chunks += 1
+            await self._send(writer, {"chunk": metrics.chunks - 1, "first_frame": first_frame, "scores": message_scores})
+            metrics.latencies.append(loop.time() - received)
+        await self._send(writer, {"done": True, "average": total / scored if scored else None,
+                                  "scored_frames": scored, "metrics": metrics.report()})
+
+    async def log_stats(self, every):
+        '''Prints a one line summary of the running sessions every few seconds'''
+        while True:
+            await asyncio.sleep(every)
+            reports = [metrics.report() for metrics in self.sessions.values()]
+            p99 = [r["latency_ms"]["p99"] for r in reports if r["latency_ms"]]
+            print(f"{len(reports)} sessions, queue max {max((r['max_queue_depth'] for r in reports), default=0)}, "
+                  f"worst p99 {max(p99, default=0):.1f} ms, "
+                  f"backpressure {sum(r['backpressure_seconds'] for r in reports):.2f} s", flush=True)
+
+
+async def serve(args):
+    server = ScoringServer(args.library, args.shards, args.detector, args.rule, args.max_queued, args.profile)
+    stats = None
+    try:
+        listener = await asyncio.start_server(server.handle, args.host, args.port)
+        print(f"Scoring server on {args.host}:{args.port} ({len(server.shards)} shards, {args.detector}, "
+              f"{server.profile.name} profile)", flush=True)
+        stats = asyncio.create_task(server.log_stats(args.stats_every)) if args.stats_every else None
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        if stats:
+            stats.cancel()
+        server.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score many singers streaming over TCP.")
+    parser.add_argument("--library", default="library", help="library folder made by batch_ingest.py")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--shards", type=int, default=os.cpu_count(), help="pitch detection processes")
+    parser.add_argument("--detector", choices=METHODS, default="yin")
+    parser.add_argument("--rule", choices=RULES, default="percent")
+    parser.add_argument("--profile", choices=list(PROFILES), default=DEFAULT_PROFILE, help="mic block + detector window")
+    parser.add_argument("--max-queued", type=int, default=MAX_QUEUED_CHUNKS, help="chunks buffered per session")
+    parser.add_argument("--stats-every", type=float, default=5.0, help="seconds between stats lines, 0 = off")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,409 @@
+import os
+import re
+import sys
+import shutil
+import tempfile
+import struct
+import subprocess
+import numpy as np
+from song_cache import make_key
+
+# #cite for source spereation tool (demucs) Demucs
+# #Défossez, A. (2021). Hybrid Spectrogram and Waveform Source Separation [Computer software]. Retrieved from https://github.com/facebookresearch/demucs
+
+# SEPARATION SETUP
+# Demucs runs as its own process (python -m demucs.separate) instead of inside ours.
+# That way the GUI never freezes, a separation can be cancelled by killing the process,
+# and the progress bar Demucs prints can be read back to show how far along it is.
+# Stems are float32 WAV: no lossy mp3 round trip, and reading them back is a memory map
+# instead of a decode (see read_stem). mp3 is only an optional archive copy (export_mp3).
+DEMUCS_MODEL = "mdx_extra"
+STEMS = ["vocals.wav", "no_vocals.wav"]
+ARCHIVE_STEMS = ["vocals.mp3", "no_vocals.mp3"]
+PROGRESS_PATTERN = re.compile(rb"(\d{1,3})%\|")  # tqdm progress bar - EX: " 42%|████ "
+
+
+class SeparationCancelled(Exception):
+    '''Raised when a running separation was stopped by the user'''
+
+
+def song_key(input_file, model=DEMUCS_MODEL):
+    '''Cache key for the stems of one song'''
+    return make_key(input_file, model=model, two_stems="vocals")
+
+
+def demucs_command(input_file, out_dir, model=DEMUCS_MODEL):
+    '''Command line for one Demucs run (same arguments the original in-process call used, float32 WAV instead of mp3)'''
+    return [sys.executable, "-m", "demucs.separate", "--float32", "--two-stems", "vocals",
+            "-n", model, "-o", out_dir, input_file]
+
+
+def run_demucs(input_file, out_dir, model=DEMUCS_MODEL, on_progress=None, on_start=None):
+    '''Runs Demucs on one file and returns the folder holding its stems
+
+    on_progress(percent) is called every time Demucs updates its progress bar,
+    on_start(process) gets the running process so the caller can terminate() it.'''
+    process = subprocess.Popen(demucs_command(input_file, out_dir, model),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if on_start:
+        on_start(process)
+
+    tail = b""  # last bit of stderr, kept for the error message
+    for chunk in iter(lambda: process.stderr.read1(1024), b""):
+        tail = (tail + chunk)[-2000:]
+        if on_progress:
+            matches = PROGRESS_PATTERN.findall(chunk)
+            if matches:
+                on_progress(min(int(matches[-1]), 100))
+    process.wait()
+
+    if process.returncode < 0:  # killed by a signal -> somebody cancelled it
+        raise SeparationCancelled(input_file)
+    if process.returncode != 0:
+        raise RuntimeError(f"Demucs failed on {input_file}:\n{tail.decode(errors='replace')}")
+
+    song_name = os.path.splitext(os.path.basename(input_file))[0]
+    return os.path.join(out_dir, model, song_name)
+
+
+def separate_song(input_file, cache, dest_dir=None, model=DEMUCS_MODEL, on_progress=None, on_start=None,
+                  parallel=False, memory_budget=None):
+    '''Separates one song into the cache, skipping Demucs if it is already there
+
+    The stems stay in the song's cache folder (cache.entry_dir(key)), when dest_dir is given
+    they are also copied there (EX: a library folder). parallel=True separates in
+    segments on several processes within memory_budget bytes (see run_demucs_parallel).'''
+    key = song_key(input_file, model)
+
+    if not cache.has(key, STEMS):
+        work_dir = tempfile.mkdtemp(prefix="demucs_")  # private folder, so runs never collide
+        try:
+            if parallel:
+                demucs_output_dir = run_demucs_parallel(input_file, work_dir, model, on_progress, on_start,
+                                                        memory_budget=memory_budget or MEMORY_BUDGET)
+            else:
+                demucs_output_dir = run_demucs(input_file, work_dir, model, on_progress, on_start)
+            for stem in STEMS:
+                cache.store_file(key, stem, os.path.join(demucs_output_dir, stem))
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if dest_dir:
+        for stem in STEMS:
+            shutil.copyfile(cache.path(key, stem), os.path.join(dest_dir, stem))
+    if on_progress:
+        on_progress(100)
+    return key
+
+
+#STEM FILES
+def _float_wav_layout(path):
+    '''(data offset, frames, channels, sample rate) of a float32 WAV file, None for anything else'''
+    with open(path, "rb") as f:
+        header = f.read(12)
+        if header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+            return None
+        fmt = None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                return None
+            chunk_id, size = chunk[:4], struct.unpack("<I", chunk[4:])[0]
+            if chunk_id == b"fmt ":
+                fmt = f.read(size + size % 2)
+            elif chunk_id == b"data":
+                if fmt is None:
+                    return None
+                tag, channels, samplerate, _, _, bits = struct.unpack("<HHIIHH", fmt[:16])
+                if tag == 0xFFFE and len(fmt) >= 26:  # WAVE_FORMAT_EXTENSIBLE, real format is in the sub format
+                    tag = struct.unpack("<H", fmt[24:26])[0]
+                if tag != 3 or bits != 32:  # 3 = IEEE float
+                    return None
+                offset = f.tell()
+                size = min(size, os.path.getsize(path) - offset)  # streamed files can claim more than they have
+                return offset, size // (4 * channels), channels, samplerate
+            else:
+                f.seek(size + size % 2, 1)
+
+
+def read_stem(path, mono=True):
+    '''Samples and sample rate of a stem, float32 WAVs are memory-mapped, anything else (EX: old mp3 stems) decoded
+
+    mono=False gives (samples, channels).'''
+    layout = _float_wav_layout(path)
+    if layout is None:
+        import soundfile as sf
+        try:
+            audio, samplerate = sf.read(path, dtype="float32", always_2d=True)
+        except RuntimeError:  # format soundfile can't read
+            import librosa
+            audio, samplerate = librosa.load(path, sr=None, mono=False)
+            audio = np.atleast_2d(audio).T
+    else:
+        offset, frames, channels, samplerate = layout
+        audio = np.memmap(path, dtype="<f4", mode="r", offset=offset, shape=(frames, channels))
+    if mono:
+        return (audio[:, 0] if audio.shape[1] == 1 else audio.mean(axis=1, dtype=np.float32)), samplerate
+    return audio, samplerate
+
+
+def export_mp3(stem_dir, dest_dir=None):
+    '''Writes mp3 copies of the WAV stems next to them (or into dest_dir), for archiving, returns their paths'''
+    import soundfile as sf
+    paths = []
+    for stem, archive in zip(STEMS, ARCHIVE_STEMS):
+        audio, samplerate = read_stem(os.path.join(stem_dir, stem), mono=False)
+        path = os.path.join(dest_dir or stem_dir, archive)
+        sf.write(path, audio, samplerate, compression_level=0)  # 0 = best quality, like Demucs' 320 kbps
+        paths.append(path)
+    return paths
+
+
+class Stems:
+    '''vocals and no_vocals kept in memory, (samples, channels) float32, when separation and analysis share a process'''
+
+    def __init__(self, vocals, no_vocals, samplerate):
+        self.vocals = vocals
+        self.no_vocals = no_vocals
+        self.samplerate = samplerate
+
+    def mono(self, name="vocals"):
+        audio = getattr(self, name)
+        return audio.mean(axis=1, dtype=np.float32)
+
+    def save(self, stem_dir):
+        '''Writes the stems as float32 WAV (same names as the Demucs ones)'''
+        import soundfile as sf
+        for stem, audio in zip(STEMS, (self.vocals, self.no_vocals)):
+            tmp_path = os.path.join(stem_dir, stem + ".tmp")
+            sf.write(tmp_path, audio, self.samplerate, subtype="FLOAT", format="WAV")
+            os.replace(tmp_path, os.path.join(stem_dir, stem))
+
+
+#IN-PROCESS SEPARATION (CHUNKS)
+class DemucsSeparator:
+    '''Keeps a Demucs model loaded and separates audio arrays, used when we work on chunks'''
+
+    def __init__(self, model=DEMUCS_MODEL):
+        from demucs.pretrained import get_model  # torch is only needed here, not for the subprocess path
+        self.name = model
+        self.model = get_model(model)
+        self.model.eval()
+        self.samplerate = self.model.samplerate
+        self.channels = self.model.audio_channels
+
+    def separate(self, audio, samplerate):
+        '''Splits audio (channels, samples) into vocals and no_vocals, both (channels, samples) at self.samplerate'''
+        import torch
+        from demucs.apply import apply_model
+        from demucs.audio import convert_audio
+
+        wav = convert_audio(torch.from_numpy(np.ascontiguousarray(audio, dtype=np.float32)),
+                            samplerate, self.samplerate, self.channels)
+        ref = wav.mean(0)  # same normalisation demucs.separate does
+        wav = (wav - ref.mean()) / (ref.std() + 1e-8)
+        with torch.no_grad():
+            sources = apply_model(self.model, wav[None], split=True, overlap=0.25, progress=False)[0]
+        sources = sources * (ref.std() + 1e-8) + ref.mean()
+
+        vocals_index = self.model.sources.index("vocals")
+        vocals = sources[vocals_index]
+        no_vocals = sources.sum(0) - vocals  # every other source mixed back together
+        return vocals.numpy(), no_vocals.numpy()
+
+
+#PARALLEL SEPARATION (LONG TRACKS)
+# demucs.separate loads the whole song and keeps every source of it in memory, on a 10 minute
+# live recording that is several GB and the bag of 4 models in mdx_extra only keeps a couple
+# of cores busy. Instead the song is cut into overlapping segments, a few worker processes
+# (each with its own copy of the model) separate them at the same time and the parent
+# cross-fades the overlaps and writes the stems out as the segments come back in order.
+#
+#   |---- segment 0 ----|
+#                  |---- segment 1 ----|        overlap: 0 fades out while 1 fades in
+#                                 |---- segment 2 --|
+#
+# How many workers run is set by the memory budget, not only by the cores, see plan_workers().
+SEGMENT_SECONDS = 60.0
+OVERLAP_SECONDS = 2.0  # cross-fade length, Demucs needs a bit of context on both sides anyway
+MEMORY_BUDGET = 6 * 1024 ** 3  # bytes for the whole separation, leaves room for the OS on an 8 GB node
+PREVIEW_MODEL = "htdemucs"  # one model instead of the bag of 4 in mdx_extra, ~4x faster and lighter
+# Rough peak memory of one worker with the model loaded and separating (bytes), unknown models
+# count as the biggest one. Adjust if a node runs out of memory anyway.
+MODEL_MEMORY = {
+    "htdemucs": 1.0e9, "hdemucs_mmi": 1.0e9,
+    "mdx_q": 1.0e9, "mdx_extra_q": 1.0e9,
+    "mdx": 1.6e9, "mdx_extra": 1.6e9, "htdemucs_ft": 1.6e9,
+}
+PARENT_MEMORY = 0.5e9  # this process: decoded overlaps, mp3 encoders, python itself
+MODEL_SAMPLERATE, MODEL_CHANNELS = 44100, 2  # every pretrained Demucs model, saves loading one in the parent
+BYTES_PER_SEGMENT_SECOND = MODEL_SAMPLERATE * MODEL_CHANNELS * 4 * 16  # float32 stereo copies of the segment a worker holds (input, sources, stems)
+
+
+def plan_workers(model=DEMUCS_MODEL, segment_seconds=SEGMENT_SECONDS, memory_budget=MEMORY_BUDGET, workers=None):
+    '''How many segments can be separated at once without going over memory_budget (and the cores)'''
+    per_worker = MODEL_MEMORY.get(model, max(MODEL_MEMORY.values())) + segment_seconds * BYTES_PER_SEGMENT_SECOND
+    fits = int((memory_budget - PARENT_MEMORY) // per_worker)
+    if fits < 1:
+        raise MemoryError(f"{model} needs about {(per_worker + PARENT_MEMORY) / 1e9:.1f} GB with "
+                          f"{segment_seconds:g} s segments, the budget is {memory_budget / 1e9:.1f} GB "
+                          f"(try shorter segments or {PREVIEW_MODEL})")
+    return max(1, min(workers or os.cpu_count() or 1, fits))
+
+
+def plan_segments(total_samples, segment_samples, overlap_samples):
+    '''(start, length) of every segment in samples, consecutive segments share overlap_samples'''
+    step = segment_samples - overlap_samples
+    segments = []
+    start = 0
+    while True:
+        length = min(segment_samples, total_samples - start)
+        segments.append((start, length))
+        if start + length >= total_samples:
+            return segments
+        start += step
+
+
+class CrossFade:
+    '''Joins the overlapping segments of one stem, the end of a segment fades out while the start of the next fades in'''
+
+    def __init__(self, overlap):
+        self.overlap = overlap
+        self.fade_in = np.linspace(0.0, 1.0, overlap, dtype=np.float32)
+        self.tail = None  # faded out end of the previous segment
+
+    def join(self, audio, last=False):
+        '''The part of audio (samples first) that is final now, its overlap is kept back for the next segment'''
+        fade_in = self.fade_in.reshape((-1,) + (1,) * (audio.ndim - 1))
+        if self.tail is not None:
+            audio[:self.overlap] = audio[:self.overlap] * fade_in + self.tail
+        if last:
+            self.tail = None
+            return audio
+        self.tail = audio[-self.overlap:] * (1.0 - fade_in)
+        return audio[:-self.overlap]
+
+
+class ParallelSeparation:
+    '''What on_start gets from run_demucs_parallel, terminate() cancels it like killing the Demucs process'''
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.cancelled = False
+
+    def terminate(self):
+        self.cancelled = True
+        self.pool.terminate()
+
+
+_separator = None  # this process's DemucsSeparator, loaded once (see get_separator / _init_separator)
+
+
+def get_separator(model=DEMUCS_MODEL):
+    '''DemucsSeparator of this process, the model is only loaded again when it changes'''
+    global _separator
+    if _separator is None or _separator.name != model:
+        _separator = DemucsSeparator(model)
+    return _separator
+
+
+def separate_in_process(input_file, model=DEMUCS_MODEL):
+    '''Separates a whole song in this process and returns the Stems, nothing is written or decoded again'''
+    import librosa
+    mixture, samplerate = librosa.load(input_file, sr=None, mono=False)
+    separator = get_separator(model)
+    vocals, no_vocals = separator.separate(np.atleast_2d(mixture), samplerate)
+    return Stems(np.ascontiguousarray(vocals.T), np.ascontiguousarray(no_vocals.T), separator.samplerate)
+
+
+def _init_separator(model, threads):
+    '''Pool initializer: gives the worker its share of the cores and loads the model once'''
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    import torch
+    torch.set_num_threads(threads)
+    get_separator(model)
+
+
+def _separate_segment(input_file, start_seconds, seconds, length):
+    '''Reads one segment straight from the file and separates it, stems are (length, channels) float32'''
+    import librosa
+    audio, samplerate = librosa.load(input_file, sr=None, mono=False, offset=start_seconds, duration=seconds)
+    vocals, no_vocals = _separator.separate(np.atleast_2d(audio), samplerate)
+    stems = []
+    for stem in (vocals, no_vocals):
+        stem = stem.T[:length]  # decoders can be a few samples off, the segment grid is what counts
+        if len(stem) < length:
+            stem = np.pad(stem, ((0, length - len(stem)), (0, 0)))
+        stems.append(np.ascontiguousarray(stem, dtype=np.float32))
+    return stems
+
+
+def run_demucs_parallel(input_file, out_dir, model=DEMUCS_MODEL, on_progress=None, on_start=None,
+                        segment_seconds=SEGMENT_SECONDS, overlap_seconds=OVERLAP_SECONDS,
+                        memory_budget=MEMORY_BUDGET, workers=None):
+    '''Same as run_demucs (same folder layout and stems) but in overlapping segments on several processes
+
+    Never holds more than workers segments plus one overlap per stem in memory, so the length
+    of the song doesn't matter. on_start gets a ParallelSeparation to terminate().'''
+    import librosa
+    import multiprocessing
+    import soundfile as sf
+
+    if overlap_seconds * 2 >= segment_seconds:
+        raise ValueError("segments must be more than twice as long as the overlap")
+    workers = plan_workers(model, segment_seconds, memory_budget, workers)
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    samplerate, channels = MODEL_SAMPLERATE, MODEL_CHANNELS
+    total = int(round(librosa.get_duration(path=input_file) * samplerate))
+    segment_samples = int(round(segment_seconds * samplerate))
+    overlap = int(round(overlap_seconds * samplerate))
+    segments = plan_segments(total, segment_samples, overlap)
+    workers = min(workers, len(segments))
+
+    song_name = os.path.splitext(os.path.basename(input_file))[0]
+    stem_dir = os.path.join(out_dir, model, song_name)
+    os.makedirs(stem_dir, exist_ok=True)
+    fades = [CrossFade(overlap) for _ in STEMS]
+
+    pool = multiprocessing.Pool(workers, initializer=_init_separator, initargs=(model, threads))
+    handle = ParallelSeparation(pool)
+    if on_start:
+        on_start(handle)
+    writers = [sf.SoundFile(os.path.join(stem_dir, stem), "w", samplerate=samplerate, channels=channels,
+                            subtype="FLOAT") for stem in STEMS]
+    try:
+        pending = []  # in flight, oldest first, never more than there are workers
+        queued = iter(segments)
+        for index in range(len(segments)):
+            for start, length in queued:
+                pending.append(pool.apply_async(_separate_segment,
+                                                (input_file, start / samplerate, length / samplerate, length)))
+                if len(pending) >= workers:
+                    break
+            result = pending.pop(0)
+            while not result.ready():  # a terminated pool never answers, so keep an eye on cancel
+                if handle.cancelled:
+                    raise SeparationCancelled(input_file)
+                result.wait(0.2)
+            if handle.cancelled:
+                raise SeparationCancelled(input_file)
+            stems = result.get()  # re-raises whatever went wrong in the worker
+
+            last = index == len(segments) - 1
+            for writer, fade, audio in zip(writers, fades, stems):
+                writer.write(fade.join(audio, last))
+            if on_progress:
+                on_progress(min(int((index + 1) * 100 / len(segments)), 100))
+    except SeparationCancelled:
+        raise
+    except Exception as error:
+        if handle.cancelled:
+            raise SeparationCancelled(input_file)
+        raise RuntimeError(f"Demucs failed on {input_file}: {error}") from error
+    finally:
+        pool.terminate()
+        pool.join()
+        for writer in writers:
+            writer.close()
+    return stem_dir
@@ -0,0 +1,384 @@
+import time
+import threading
+import numpy as np
+from pitch_detectors import make_detector, MultiChannelDetector
+
+# SESSION RUNTIME
+# Shared by VoiceHero.py, aubio_note.py and comparison_algorithm.py:
+#   - the pitch detector setup and mic block handling every script used to copy
+#   - frequency_to_note / hz_to_midi
+#   - Session: owns the mic stream (and the backing track stream if there is one) and
+#     lets the main thread sleep on an event until the track ends, the user presses
+#     Ctrl+C or a stream fails -- no more `while True: pass` or polling every 10 ms.
+# The streams come from the sounddevice module unless another backend with the same API is
+# passed in (EX: virtual_device.VirtualDevice to replay a take headless, faster than real time).
+#
+# duplex=True opens one sd.Stream for both directions instead: a single callback writes the
+# next backing track block and gets the mic block captured at the same moment, so what is
+# played and what is scored run on one clock, sample for sample, with no drift between
+# two independent streams. FileBacking streams the track from disk so the whole song never
+# has to be decoded into memory.
+WIN_SIZE = 1024
+HOP_SIZE = 512
+TOLERANCE = 0.8
+MIN_PITCH, MAX_PITCH = 50, 600  # Human singing range (can be adjusted during trials)
+MIN_CONFIDENCE = 0.8
+BACKING_BUFFER_SECONDS = 4.0  # FileBacking decodes this far ahead of the output callback
+BACKING_READ_FRAMES = 8192  # file frames the reader thread decodes at a time
+NOTE_NAMES = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
+
+# Why a session ended
+FINISHED = "finished"  # backing track played to the end
+INTERRUPTED = "interrupted"  # Ctrl+C or stop()
+ERROR = "error"  # a stream callback raised
+
+
+# UTILITY FUNCTIONS
+def hz_to_midi(frequency):
+    '''Frequency to (fractional) midi note, None for no pitch'''
+    if frequency <= 0:
+        return None
+    return 69 + 12 * np.log2(frequency / 440.0)
+
+
+def frequency_to_note(frequency):
+    ''' Converts frequency to Notes and octave - EX: A4'''
+    if frequency <= 0:
+        return "N/A"
+    midi_note = round(hz_to_midi(frequency))
+    note_index = midi_note % 12
+    octave = (midi_note // 12) - 1
+    return f"{NOTE_NAMES[note_index]}{octave}"
+
+
+def sounddevice():
+    '''The real audio backend, imported on first use so headless runs work without PortAudio'''
+    import sounddevice as sd
+    return sd
+
+
+def default_samplerate(audio=None):
+    '''Native sample rate of the default mic (MACOS COMPATIBILITY)'''
+    audio = audio or sounddevice()
+    return int(audio.query_devices(kind="input")["default_samplerate"])
+
+
+class PitchTracker:
+    '''Pitch detector (aubio YIN unless told otherwise, see pitch_detectors.py) plus the mic block handling around it'''
+
+    def __init__(self, samplerate, hop_size=HOP_SIZE, win_size=WIN_SIZE, tolerance=TOLERANCE, method="yin"):
+        self.hop_size = hop_size
+        self.detector = make_detector(method, samplerate, hop_size, win_size, tolerance)
+        self._block = np.zeros(hop_size, dtype=np.float32)  # reused every call
+
+    def process(self, indata):
+        '''Pitch (Hz), confidence and whether it is a confident sung note, for one mic block'''
+        self.downmix(indata)
+        return self.detect()
+
+    def downmix(self, indata):
+        '''Mono mix of the mic block into the reused buffer, padded if the block is short'''
+        n = min(len(indata), self.hop_size)
+        if indata.shape[1] == 1:
+            self._block[:n] = indata[:n, 0]
+        else:
+            np.mean(indata[:n], axis=1, out=self._block[:n])
+        self._block[n:] = 0
+
+    def detect(self):
+        '''Runs the detector on the block from downmix()'''
+        pitch, confidence = self.detector(self._block)
+        voiced = MIN_PITCH <= pitch <= MAX_PITCH and confidence > MIN_CONFIDENCE
+        return pitch, confidence, voiced
+
+
+class MultiPitchTracker:
+    '''One pitch track per input channel (group mode: one mic per singer), all from the same callback'''
+
+    def __init__(self, samplerate, channels, hop_size=HOP_SIZE, win_size=WIN_SIZE, tolerance=TOLERANCE, method="yin"):
+        self.hop_size = hop_size
+        self.detector = MultiChannelDetector(method, samplerate, channels, hop_size, win_size, tolerance)
+        self._blocks = np.zeros((channels, hop_size), dtype=np.float32)  # one contiguous row per channel
+        self.voiced = np.zeros(channels, dtype=bool)
+        self._scratch = np.zeros(channels, dtype=bool)
+
+    def process(self, indata):
+        '''Pitch (Hz), confidence and voiced arrays, one value per channel (reused, copy them to keep them)'''
+        self.split(indata)
+        return self.detect()
+
+    def split(self, indata):
+        '''Copies the interleaved mic block into one row per channel, padded if the block is short'''
+        n = min(len(indata), self.hop_size)
+        self._blocks[:, :n] = indata[:n].T
+        self._blocks[:, n:] = 0
+
+    def detect(self):
+        '''Runs the detectors on the rows from split()'''
+        pitch, confidence = self.detector(self._blocks)
+        np.greater_equal(pitch, MIN_PITCH, out=self.voiced)
+        np.less_equal(pitch, MAX_PITCH, out=self._scratch)
+        self.voiced &= self._scratch
+        np.greater(confidence, MIN_CONFIDENCE, out=self._scratch)
+        self.voiced &= self._scratch
+        return pitch, confidence, self.voiced
+
+
+class ArrayBacking:
+    '''Backing track that is already fully in memory, same read() as progressive.StreamingBacking'''
+
+    def __init__(self, audio):
+        self.audio = np.ascontiguousarray(audio, dtype=np.float32)
+        self.position = 0
+
+    def read(self, out):
+        '''Fills out with the next samples, raises EOFError once the track is over'''
+        n = min(len(out), len(self.audio) - self.position)
+        if n <= 0:
+            raise EOFError
+        out[:n] = self.audio[self.position:self.position + n]
+        out[n:] = 0
+        self.position += n
+        return 0
+
+
+class FileBacking:
+    '''Backing track streamed from a file (EX: no_vocals.wav), same read() as ArrayBacking
+
+    A reader thread decodes, downmixes and resamples the file into a fixed ring buffer, the
+    output callback only copies out of it. Memory is the same for a 3 or a 30 minute song.'''
+
+    def __init__(self, path, samplerate=None, buffer_seconds=BACKING_BUFFER_SECONDS):
+        import soundfile as sf
+        self.file = sf.SoundFile(path)
+        self.samplerate = samplerate or self.file.samplerate
+        self.resampler = None
+        if self.samplerate != self.file.samplerate:
+            import soxr  # comes with librosa
+            self.resampler = soxr.ResampleStream(self.file.samplerate, self.samplerate, 1, dtype="float32")
+        self.ring = np.zeros(max(int(buffer_seconds * self.samplerate), 4 * BACKING_READ_FRAMES), dtype=np.float32)
+        self._block = np.zeros((BACKING_READ_FRAMES, self.file.channels), dtype=np.float32)
+        self._max_out = int(np.ceil(BACKING_READ_FRAMES * self.samplerate / self.file.samplerate)) + 64
+        self.written = 0  # samples put in the ring so far (reader thread only)
+        self.position = 0  # samples taken out so far (audio thread only)
+        self.eof = False
+        self.underrun_samples = 0  # silence played because the reader fell behind
+        self.closed = False
+        while self._top_up():  # start with a full buffer
+            pass
+        self.reader = threading.Thread(target=self._read_ahead, daemon=True)
+        self.reader.start()
+
+    def _top_up(self):
+        '''Decodes one read into the ring if it fits, False when there is nothing (more) to do right now'''
+        if self.eof or len(self.ring) - (self.written - self.position) < self._max_out:
+            return False
+        frames = self.file.read(BACKING_READ_FRAMES, dtype="float32", always_2d=True, out=self._block)
+        last = len(frames) < BACKING_READ_FRAMES
+        mono = frames[:, 0] if frames.shape[1] == 1 else frames.mean(axis=1, dtype=np.float32)
+        if self.resampler is not None:
+            mono = self.resampler.resample_chunk(mono, last=last)
+        start = self.written % len(self.ring)
+        first = min(len(mono), len(self.ring) - start)
+        self.ring[start:start + first] = mono[:first]
+        self.ring[:len(mono) - first] = mono[first:]
+        self.written += len(mono)  # published before eof, read() never sees eof with samples missing
+        self.eof = last
+        return not last
+
+    def _read_ahead(self):
+        while not self.closed and not self.eof:
+            if not self._top_up():
+                time.sleep(0.01)
+
+    def read(self, out):
+        '''Fills out with the next samples, returns how many were silence because the reader was late
+
+        Raises EOFError once the whole file has been played.'''
+        eof = self.eof
+        n = min(len(out), self.written - self.position)
+        if n <= 0 and eof:
+            raise EOFError
+        start = self.position % len(self.ring)
+        first = min(n, len(self.ring) - start)
+        out[:first] = self.ring[start:start + first]
+        out[first:n] = self.ring[:n - first]
+        out[n:] = 0
+        self.position += n
+        if n < len(out) and not eof:
+            self.underrun_samples += len(out) - n
+            return len(out) - n
+        return 0
+
+    def close(self):
+        self.closed = True
+        if self.reader.is_alive():
+            self.reader.join()
+        self.file.close()
+
+
+class Session:
+    def __init__(self, callback, samplerate, blocksize=HOP_SIZE, channels=1, backing=None, on_silence=None,
+                 audio=None, profiler=None, duplex=False):
+        '''callback(indata, frames, time_info, status) gets every mic block
+
+        backing is an object with read(out) (ArrayBacking, FileBacking, StreamingBacking) played on its own
+        output stream, on_silence(seconds) is told when it had to play silence (pipeline late).
+        audio is the stream backend, sounddevice by default. profiler (instrumentation.CallbackProfiler)
+        times every mic callback and counts the xruns of both streams. duplex=True plays the backing
+        track and records the mic on one stream, in the same callback.'''
+        self.audio = audio or sounddevice()
+        self.profiler = profiler
+        self.callback = callback
+        self.samplerate = samplerate
+        self.blocksize = blocksize
+        self.channels = channels
+        self.backing = backing
+        self.on_silence = on_silence
+        self.duplex = duplex and backing is not None  # nothing to play -> just the mic
+
+        self.ended = threading.Event()
+        self.paused_at = None  # time.monotonic() of the last pause()
+        self.reason = None
+        self.error = None
+        self.input_stream = None
+        self.output_stream = None
+
+    # STREAM CALLBACKS (audio threads)
+    def _input_callback(self, indata, frames, time_info, status):
+        profiler = self.profiler
+        try:
+            if profiler is not None:
+                profiler.begin()
+                if status:
+                    profiler.count_status(status)
+            self.callback(indata, frames, time_info, status)
+            if profiler is not None:
+                profiler.end()
+        except Exception as error:
+            self._end(ERROR, error)
+            raise self.audio.CallbackAbort
+
+    def _output_callback(self, outdata, frames, time_info, status):
+        if status and self.profiler is not None:
+            self.profiler.count_status(status)
+        try:
+            silence = self.backing.read(outdata[:, 0])
+        except EOFError:
+            raise self.audio.CallbackStop  # finished_callback fires once the last block was played
+        except Exception as error:
+            self._end(ERROR, error)
+            raise self.audio.CallbackAbort
+        if silence and self.on_silence:
+            self.on_silence(silence / self.samplerate)
+
+    def _duplex_callback(self, indata, outdata, frames, time_info, status):
+        profiler = self.profiler
+        try:
+            if profiler is not None:
+                profiler.begin()
+                if status:
+                    profiler.count_status(status)
+            try:
+                silence = self.backing.read(outdata[:, 0])
+            except EOFError:
+                raise self.audio.CallbackStop  # song over, this last mic block is after the end anyway
+            if silence and self.on_silence:
+                self.on_silence(silence / self.samplerate)  # before scoring, the block still lines up
+            self.callback(indata, frames, time_info, status)
+            if profiler is not None:
+                profiler.end()
+        except self.audio.CallbackStop:
+            raise
+        except Exception as error:
+            self._end(ERROR, error)
+            raise self.audio.CallbackAbort
+
+    def _output_finished(self):
+        if self.paused_at is None:  # stopping the stream for a pause also lands here
+            self._end(FINISHED)
+
+    def _end(self, reason, error=None):
+        if not self.ended.is_set():  # first reason wins
+            self.reason, self.error = reason, error
+            self.ended.set()
+
+    # LIFECYCLE
+    def _streams(self):
+        '''Open streams, output first (one stream in duplex mode)'''
+        streams = []
+        for stream in (self.output_stream, self.input_stream):
+            if stream is not None and stream not in streams:
+                streams.append(stream)
+        return streams
+
+    def start(self):
+        '''Opens and starts the mic stream, then the backing track (or the one duplex stream)'''
+        if self.duplex:
+            self.input_stream = self.output_stream = self.audio.Stream(
+                callback=self._duplex_callback, samplerate=self.samplerate, channels=(self.channels, 1),
+                blocksize=self.blocksize, finished_callback=self._output_finished)
+            self.input_stream.start()
+            return
+        self.input_stream = self.audio.InputStream(callback=self._input_callback, samplerate=self.samplerate,
+                                                   channels=self.channels, blocksize=self.blocksize)
+        self.input_stream.start()
+        if self.backing is not None:
+            self.output_stream = self.audio.OutputStream(callback=self._output_callback, samplerate=self.samplerate,
+                                                         channels=1, blocksize=self.blocksize,
+                                                         finished_callback=self._output_finished)
+            self.output_stream.start()
+
+    def pause(self):
+        '''Stops both streams, the backing track keeps its position'''
+        if self.paused_at is not None:
+            return
+        self.paused_at = time.monotonic()
+        for stream in self._streams():
+            if stream.active:
+                stream.stop()
+
+    def resume(self):
+        '''Restarts the streams, the pause counts as silence so the song clock skips over it'''
+        if self.paused_at is None:
+            return
+        for stream in reversed(self._streams()):
+            if stream.stopped:
+                stream.start()
+        if self.on_silence:
+            self.on_silence(time.monotonic() - self.paused_at)
+        self.paused_at = None
+
+    def wait(self):
+        '''Sleeps until the session ends, returns the reason (FINISHED, INTERRUPTED or ERROR)
+
+        Wakes up twice a second at most, so Ctrl+C also works where a plain wait() is not interruptible.
+        A backend with a run() (the virtual device) is driven from here instead.'''
+        try:
+            run = getattr(self.audio, "run", None)
+            if run is not None:
+                run(self.ended)
+                self._end(FINISHED)  # nothing left to play or record
+            while not self.ended.wait(0.5):
+                pass
+        except KeyboardInterrupt:
+            self._end(INTERRUPTED)
+        return self.reason
+
+    def stop(self):
+        '''Closes the streams (safe to call more than once)'''
+        self._end(INTERRUPTED)
+        for stream in self._streams():
+            stream.close()
+        self.output_stream = self.input_stream = None
+        close = getattr(self.backing, "close", None)  # FileBacking's reader thread and file
+        if close is not None:
+            close()
+
+    def run(self):
+        '''start + wait + stop, returns the reason the session ended'''
+        self.start()
+        try:
+            return self.wait()
+        finally:
+            self.stop()
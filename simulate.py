@@ -0,0 +1,122 @@
+import os
+import sys
+import json
+import argparse
+import numpy as np
+from virtual_device import VirtualDevice, LATENCY
+from latency_profiles import PROFILES, DEFAULT_PROFILE, get_profile, reference_at
+
+# HEADLESS SIMULATION
+# Replays a whole karaoke session through the real start_audio_processing, with a
+# VirtualDevice instead of the sound card: the take (or a synthetic signal) is the mic,
+# the backing track plays into nothing and the clock only moves as fast as the callbacks
+# run. Needs no audio hardware or PortAudio, so regression runs work on any Linux box.
+#
+# EX: python simulate.py take.wav --reference library/My_Song-1a2b3c4d
+#     python simulate.py --signal vibrato --reference library/My_Song-1a2b3c4d --quiet
+#     python simulate.py take.wav --reference library/My_Song-1a2b3c4d --profile ultra-low
+
+
+def load_song(song_dir):
+    '''f0, rms, lyrics, sample rate, hop size and note index of a library song folder'''
+    vhref_path = os.path.join(song_dir, "reference.vhref")
+    if os.path.exists(vhref_path):
+        from reference_file import ReferenceFile
+        reference = ReferenceFile(vhref_path)
+        f0, rms, lyrics = reference.f0, reference.rms, reference.lyrics
+        sr, hop_size, notes = reference.samplerate, reference.hop_size, reference.notes
+    else:
+        from offline_scoring import load_reference_dir
+        f0, lyrics, sr, hop_size = load_reference_dir(song_dir)
+        rms = np.load(os.path.join(song_dir, "rms.npy"))
+        from note_index import segment_notes
+        from reference_file import hz_to_cents
+        notes = segment_notes(hz_to_cents(f0), hop_size=hop_size)
+    return f0, rms, lyrics, sr, hop_size, notes
+
+
+def load_backing(path, song_dir, samplerate, n_frames, hop_size):
+    '''Backing track to "play" (no_vocals.wav of the song by default, silence if there is none)'''
+    candidates = [path] if path else [os.path.join(song_dir, name) for name in ("no_vocals.wav", "no_vocals.mp3")]
+    for path in candidates:
+        if os.path.exists(path):
+            from separation import read_stem
+            backing, backing_samplerate = read_stem(path)
+            if backing_samplerate != samplerate:
+                import librosa
+                backing = librosa.resample(np.asarray(backing), orig_sr=backing_samplerate, target_sr=samplerate)
+            return backing
+    return np.zeros(n_frames * hop_size, dtype=np.float32)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a karaoke session headless, faster than real time.")
+    parser.add_argument("takes", nargs="*", help="recorded vocal file used as the mic, one per singer for group mode")
+    parser.add_argument("--signal", help="synthetic mic signal instead of a take (see pitch_benchmark.py)")
+    parser.add_argument("--reference", required=True, help="library song folder (see batch_ingest.py)")
+    parser.add_argument("--backing", help="backing track, default <reference>/no_vocals.wav")
+    parser.add_argument("--singers", type=int, help="group mode: number of mic channels, default one per take")
+    parser.add_argument("--parts", nargs="+", help="reference (.vhref or song folder) per singer, default the song's vocals")
+    parser.add_argument("--samplerate", type=int, help="virtual device rate, default the song's rate")
+    parser.add_argument("--duplex", action="store_true", help="backing track and mic on one duplex stream")
+    parser.add_argument("--profile", choices=list(PROFILES), default=DEFAULT_PROFILE,
+                        help="latency profile: mic block + detector window (see latency_profiles.py)")
+    parser.add_argument("--latency", type=float, default=LATENCY, help="reported latency of each direction (s)")
+    parser.add_argument("--quiet", action="store_true", help="don't draw the score while replaying")
+    parser.add_argument("--timings", help="export the callback timings (.json report or .csv per block)")
+    parser.add_argument("--record", help="record the take to this file (.flac / .wav) plus its live pitch")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--results", help="also store the session in this results database (see results_store.py)")
+    args = parser.parse_args(argv)
+    if bool(args.takes) == bool(args.signal):
+        parser.error("give either takes or --signal")
+
+    f0, rms, lyrics, sr, song_hop_size, notes = load_song(args.reference)
+    profile = get_profile(args.profile)
+    try:  # the song's frames at the profile's block
+        f0, rms, notes = reference_at(f0, rms, notes, song_hop_size, profile.hop_size)
+    except ValueError as error:
+        parser.error(str(error))
+    device_samplerate = args.samplerate or sr
+    singers = args.singers or max(1, len(args.takes))
+    if args.takes:
+        mic = args.takes if len(args.takes) > 1 else args.takes[0]
+    else:
+        from pitch_benchmark import make_signal
+        mic, _, _ = make_signal(args.signal, device_samplerate, seconds=len(f0) * song_hop_size / sr)
+    device = VirtualDevice(mic, device_samplerate, args.latency)
+    backing = load_backing(args.backing, args.reference, sr, len(f0), profile.hop_size)
+
+    import VoiceHero  # the real game loop, only the device is fake
+    parts = [VoiceHero.load_part(path, sr, profile.hop_size) for path in args.parts] if args.parts else None
+    song = os.path.basename(os.path.normpath(args.reference))  # library folders are named with song_id()
+    out = open(os.devnull, "w") if args.quiet else sys.stdout
+    try:
+        accuracies = VoiceHero.start_audio_processing(f0, rms, lyrics, sr, backing, device_samplerate,
+                                                      audio=device, out=out, timings_path=args.timings,
+                                                      singers=singers, parts=parts, duplex=args.duplex,
+                                                      notes=notes, record_path=args.record,
+                                                      song=song if args.results else None, results_path=args.results,
+                                                      profile=profile)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    per_singer = accuracies if singers > 1 else [accuracies]
+    result = {
+        "simulated_seconds": device.simulated_seconds,
+        "wall_seconds": device.wall_seconds,
+        "realtime_factor": device.realtime_factor,
+        "singers": [{"scores": len(scores), "average": float(np.mean(scores)) if scores else None}
+                    for scores in per_singer],
+    }
+    print(f"simulated {result['simulated_seconds']:.1f} s of audio in {result['wall_seconds']:.2f} s "
+          f"-> {result['realtime_factor']:.1f}x real time")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
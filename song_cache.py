@@ -0,0 +1,147 @@
+import os
+import re
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+
+# CACHE SETUP
+# Every song we process gets a folder in the cache, named after a hash of the
+# input audio plus the settings used to analyse it. Running the same song with
+# the same settings again just reads the folder back instead of redoing the work.
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".voicehero_cache")
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3  # 2 GB, oldest songs get removed past this
+
+
+def hash_file(path, chunk_size=1 << 20):
+    '''Hashes the contents of a file, reading it in chunks so big songs are fine'''
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def song_id(input_file):
+    '''Stable name of a song, the same whatever settings it is analysed with - EX: "My Song.mp3" -> "My_Song-1a2b3c4d"
+
+    Library folders are named with it and the results store keeps every session under it.'''
+    name = os.path.splitext(os.path.basename(input_file))[0]
+    name = re.sub(r"[^\w\-]+", "_", name).strip("_") or "song"
+    return f"{name}-{hash_file(input_file)[:8]}"
+
+
+def make_key(path, **params):
+    '''Builds a cache key from the audio file plus the analysis parameters - EX: hop_size=512'''
+    digest = hashlib.sha256()
+    digest.update(hash_file(path).encode())
+    digest.update(json.dumps(params, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+class SongCache:
+    def __init__(self, root=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        '''initializes the cache folder and its size limit (in bytes)'''
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(self.root, exist_ok=True)
+
+    def entry_dir(self, key):
+        '''Folder holding everything stored for one key'''
+        return os.path.join(self.root, key)
+
+    def path(self, key, name):
+        '''Path of one stored file - EX: path(key, "f0.npy")'''
+        return os.path.join(self.entry_dir(key), name)
+
+    def has(self, key, names):
+        '''True if every file in names is stored for this key (marks it as recently used)'''
+        if not all(os.path.exists(self.path(key, name)) for name in names):
+            return False
+        self.touch(key)
+        return True
+
+    def touch(self, key):
+        '''Marks an entry as recently used, the folder mtime is what LRU eviction looks at'''
+        os.utime(self.entry_dir(key), None)
+
+    def _write(self, key, name, write_fn):
+        '''Writes to a temp file first and then renames it so a crash never leaves half a file'''
+        entry = self.entry_dir(key)
+        os.makedirs(entry, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=entry, suffix=".tmp")
+        os.close(fd)
+        try:
+            write_fn(tmp_path)
+            os.replace(tmp_path, self.path(key, name))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.touch(key)
+        return self.path(key, name)
+
+    def store_file(self, key, name, src):
+        '''Copies an existing file (EX: a stem from Demucs) into the cache'''
+        path = self._write(key, name, lambda tmp: shutil.copyfile(src, tmp))
+        self.evict(keep=key)
+        return path
+
+    def save_array(self, key, name, array):
+        '''Stores a numpy array (f0, rms...)'''
+        def write(tmp):
+            with open(tmp, "wb") as f:
+                np.save(f, array)
+        path = self._write(key, name, write)
+        self.evict(keep=key)
+        return path
+
+    def load_array(self, key, name):
+        return np.load(self.path(key, name))
+
+    def save_file(self, key, name, write_fn):
+        '''Stores a file produced by write_fn(path) - EX: a .vhref reference file'''
+        path = self._write(key, name, write_fn)
+        self.evict(keep=key)
+        return path
+
+    def save_json(self, key, name, data):
+        '''Stores lyric segments or other small metadata as json'''
+        def write(tmp):
+            with open(tmp, "w") as f:
+                json.dump(data, f)
+        path = self._write(key, name, write)
+        self.evict(keep=key)
+        return path
+
+    def load_json(self, key, name):
+        with open(self.path(key, name)) as f:
+            return json.load(f)
+
+    def size(self):
+        '''Total size of the cache in bytes'''
+        return sum(self._entry_size(entry) for entry in self._entries())
+
+    def _entries(self):
+        return [os.path.join(self.root, name) for name in os.listdir(self.root)
+                if os.path.isdir(os.path.join(self.root, name))]
+
+    def _entry_size(self, entry):
+        total = 0
+        for dirpath, _, filenames in os.walk(entry):
+            for filename in filenames:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+        return total
+
+    def evict(self, keep=None):
+        '''Removes the least recently used entries until the cache fits in max_bytes'''
+        entries = [(os.path.getmtime(entry), entry, self._entry_size(entry)) for entry in self._entries()]
+        total = sum(size for _, _, size in entries)
+        for _, entry, size in sorted(entries):  # oldest first
+            if total <= self.max_bytes:
+                break
+            if keep is not None and entry == self.entry_dir(keep):
+                continue  # never evict the song we are writing right now
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
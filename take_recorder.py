@@ -0,0 +1,138 @@
+import os
+import threading
+import numpy as np
+
+# TAKE RECORDER
+# Keeps the performance instead of only the accuracy list: every mic block plus the live pitch,
+# confidence and song frame the callback worked out for it, so a take can be replayed
+# (simulate.py take.flac) or re-scored later (offline_scoring.py take.pitch.npz).
+#
+# The audio thread never allocates or touches the disk. push() copies the block into the next
+# slot of a ring buffer allocated up front and moves a counter, a writer thread drains the
+# slots to the audio file. One producer, one consumer, each side only writes its own counter.
+#
+#   callback -> push() -> [slot][slot][slot]...[slot] -> writer thread -> take.flac
+#                            ^ pushed            ^ drained               take.pitch.npz (at close)
+#
+# If the disk stalls long enough for the ring to fill up, push() drops the block and counts it
+# instead of waiting. The writer puts silence (and NaN pitch) where dropped blocks were, so the
+# file stays in step with the song.
+#
+# EX: recorder = TakeRecorder("takes/2024-05-01.flac", 44100, hop_size=512)
+#     recorder.start() ... recorder.push(indata, pitch, confidence, frame) ... recorder.close()
+BUFFER_SECONDS = 10.0  # audio the ring holds before blocks get dropped
+DRAIN_INTERVAL = 0.05  # seconds the writer sleeps when there is nothing to write
+
+
+def pitch_path(path):
+    '''Where the per-hop pitch of a take goes - EX: take.flac -> take.pitch.npz'''
+    return os.path.splitext(path)[0] + ".pitch.npz"
+
+
+class TakeRecorder:
+    def __init__(self, path, samplerate, channels=1, hop_size=512, buffer_seconds=BUFFER_SECONDS):
+        '''path is the audio file (.flac, .wav or anything soundfile writes), one mic block = hop_size samples'''
+        self.path = path
+        self.samplerate = samplerate
+        self.channels = channels
+        self.hop_size = hop_size
+        slots = max(4, int(buffer_seconds * samplerate / hop_size))
+        self.audio = np.zeros((slots, hop_size, channels), dtype=np.float32)
+        self.lengths = np.zeros(slots, dtype=np.int32)  # samples in each slot (the last block can be short)
+        self.sequence = np.zeros(slots, dtype=np.int64)  # block number of each slot, gaps = dropped blocks
+        self.pitch = np.zeros((slots, channels), dtype=np.float32)
+        self.confidence = np.zeros((slots, channels), dtype=np.float32)
+        self.frames = np.zeros(slots, dtype=np.int32)  # reference frame the block was scored against
+        self.pushed = 0  # slots filled so far (audio thread only)
+        self.drained = 0  # slots written so far (writer thread only)
+        self.blocks = 0  # blocks seen, dropped ones included (audio thread only)
+        self.dropped = 0
+        self.file = None
+        self.writer = None
+        self._stop = threading.Event()
+        self._written_blocks = 0  # writer side: blocks in the file, silence for dropped ones included
+        self._live = []  # writer side: (pitch, confidence, frame) per block, copied out of the ring
+
+    # AUDIO THREAD SIDE -- copies into preallocated slots only
+    def push(self, indata, pitch=0.0, confidence=0.0, frame=-1):
+        '''Keeps one mic block (frames x channels) and what the callback detected in it, never blocks'''
+        block = self.blocks
+        self.blocks += 1
+        if self.pushed - self.drained >= len(self.lengths):
+            self.dropped += 1  # writer is behind, losing a block beats stalling the callback
+            return
+        slot = self.pushed % len(self.lengths)
+        n = min(len(indata), self.hop_size)
+        self.audio[slot, :n] = indata[:n, :self.channels]
+        self.lengths[slot] = n
+        self.sequence[slot] = block
+        self.pitch[slot] = pitch
+        self.confidence[slot] = confidence
+        self.frames[slot] = frame
+        self.pushed += 1  # published last, the writer only reads slots below it
+
+    # WRITER THREAD
+    def start(self):
+        '''Opens the file and starts the writer thread (call before the streams start)'''
+        import soundfile as sf
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        subtype = "FLOAT" if self.path.lower().endswith(".wav") else None  # FLAC only stores integers
+        self.file = sf.SoundFile(self.path, "w", self.samplerate, self.channels, subtype)
+        self.writer = threading.Thread(target=self._run, daemon=True)
+        self.writer.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            if not self._drain():
+                self._stop.wait(DRAIN_INTERVAL)
+        self._drain()  # whatever the last callbacks pushed
+
+    def _drain(self):
+        '''Writes every pushed slot to the file, False if there was none'''
+        pushed = self.pushed
+        if pushed == self.drained:
+            return False
+        silence = np.zeros((self.hop_size, self.channels), dtype=np.float32)
+        while self.drained < pushed:
+            slot = self.drained % len(self.lengths)
+            for _ in range(int(self.sequence[slot]) - self._written_blocks):  # blocks dropped before this one
+                self.file.write(silence)
+                self._live.append((np.full(self.channels, np.nan, dtype=np.float32),
+                                   np.zeros(self.channels, dtype=np.float32), -1))
+            self.file.write(self.audio[slot, :self.lengths[slot]])
+            self._live.append((self.pitch[slot].copy(), self.confidence[slot].copy(), int(self.frames[slot])))
+            self._written_blocks = int(self.sequence[slot]) + 1
+            self.drained += 1  # slot free for the audio thread again
+        return True
+
+    def close(self):
+        '''Stops the writer after it wrote everything, saves the pitch arrays, returns the audio path'''
+        if self.writer is None:
+            return None
+        self._stop.set()
+        self.writer.join()
+        self.writer = None
+        self.file.close()
+        pitch = np.array([live[0] for live in self._live], dtype=np.float32).reshape(-1, self.channels)
+        confidence = np.array([live[1] for live in self._live], dtype=np.float32).reshape(-1, self.channels)
+        frames = np.array([live[2] for live in self._live], dtype=np.int32)
+        np.savez(pitch_path(self.path), pitch=pitch, confidence=confidence, frames=frames,
+                 samplerate=self.samplerate, hop_size=self.hop_size, dropped=self.dropped)
+        return self.path
+
+    def summary(self):
+        '''One line for the terminal'''
+        seconds = self.blocks * self.hop_size / self.samplerate
+        return f"take: {seconds:.1f} s recorded to {self.path}, {self.dropped} blocks dropped"
+
+
+def load_pitch(path):
+    '''Live pitch, confidence (frames x channels) and reference frame per hop of a recorded take
+
+    path is the audio file or its .pitch.npz.'''
+    if not path.endswith(".npz"):
+        path = pitch_path(path)
+    with np.load(path) as data:
+        return data["pitch"], data["confidence"], data["frames"]
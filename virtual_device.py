@@ -0,0 +1,204 @@
+import time
+import numpy as np
+
+# VIRTUAL AUDIO DEVICE
+# Stands in for the sounddevice module (InputStream, OutputStream, Stream, CallbackStop, CallbackAbort,
+# query_devices) so a whole session can run headless, without PortAudio or a microphone.
+# The "mic" is a recorded take (WAV / mp3 / array) or a synthetic signal, the backing track
+# goes nowhere and the clock is virtual: it moves one block per callback instead of with the
+# wall clock, so a 4 minute song replays as fast as the CPU allows.
+#
+# Nothing runs on its own thread: Session.wait() calls run(), which drives every started
+# stream from the waiting thread until the streams finish or the session ends.
+# Timestamps follow PortAudio: the mic block captured at time t has inputBufferAdcTime t and
+# the block sent to the speakers has outputBufferDacTime t + output latency. The take is
+# delayed by the output latency, like a singer who hears the backing track that much late.
+START_TIME = 1.0  # stream clocks don't start at 0 (0 means "no timestamp" to FrameAligner)
+LATENCY = 0.01  # seconds reported for each direction
+
+
+def _load(source, samplerate):
+    '''A file path (decoded and resampled to samplerate) or an array, as float32'''
+    if isinstance(source, str):
+        import librosa
+        source, _ = librosa.load(source, sr=samplerate, mono=True)
+    return np.asarray(source, dtype=np.float32)
+
+
+class CallbackStop(Exception):
+    '''Same meaning as sounddevice.CallbackStop: finish the stream after this block'''
+
+
+class CallbackAbort(Exception):
+    '''Same meaning as sounddevice.CallbackAbort: stop the stream right away'''
+
+
+class TimeInfo:
+    '''The time argument stream callbacks get'''
+
+    def __init__(self, current_time, adc_time=0.0, dac_time=0.0):
+        self.currentTime = current_time
+        self.inputBufferAdcTime = adc_time
+        self.outputBufferDacTime = dac_time
+
+
+class VirtualStream:
+    def __init__(self, device, kind, callback=None, samplerate=None, channels=1, blocksize=512,
+                 finished_callback=None, **kwargs):
+        self.device = device
+        self.kind = kind
+        self.callback = callback
+        self.samplerate = samplerate or device.samplerate
+        self.channels = channels
+        self.blocksize = blocksize
+        self.finished_callback = finished_callback
+        self.latency = (device.latency, device.latency) if kind == "duplex" else device.latency
+        self.active = False
+        self.stopped = True
+        self.closed = False
+        device.streams.append(self)
+
+    @property
+    def time(self):
+        return self.device.time
+
+    def start(self):
+        if self.samplerate != self.device.samplerate:
+            raise ValueError(f"virtual device runs at {self.device.samplerate} Hz, stream asked for {self.samplerate}")
+        self.active, self.stopped = True, False
+
+    def stop(self):
+        self._finish()
+
+    def close(self):
+        self._finish()
+        self.closed = True
+        if self in self.device.streams:
+            self.device.streams.remove(self)
+
+    def _finish(self):
+        if self.active:
+            self.active, self.stopped = False, True
+            if self.finished_callback:
+                self.finished_callback()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class VirtualDevice:
+    CallbackStop = CallbackStop
+    CallbackAbort = CallbackAbort
+
+    def __init__(self, mic=None, samplerate=44100, latency=LATENCY):
+        '''mic is a file path, an array at samplerate (samples, or samples x channels), a list of
+        those (one per input channel, EX: one take per singer) or None for silence'''
+        self.samplerate = samplerate
+        self.latency = latency
+        self.streams = []
+        self.position = 0  # samples the clock has moved since the start
+        self.played = 0  # backing track samples "played"
+        self.wall_seconds = 0.0
+        if mic is None:
+            mic = np.zeros((0, 1), dtype=np.float32)
+        elif isinstance(mic, (list, tuple)):
+            channels = [_load(source, samplerate) for source in mic]
+            mic = np.zeros((max(len(channel) for channel in channels), len(channels)), dtype=np.float32)
+            for i, channel in enumerate(channels):
+                mic[:len(channel), i] = channel
+        else:
+            mic = _load(mic, samplerate)
+        mic = mic.reshape(len(mic), -1)  # always samples x channels
+        # the singer hears the backing track output latency late, so their voice is that much late too
+        delay = np.zeros((int(round(latency * samplerate)), mic.shape[1]), dtype=np.float32)
+        self.mic = np.concatenate([delay, mic])
+
+    # sounddevice module API
+    def InputStream(self, **kwargs):
+        return VirtualStream(self, "input", **kwargs)
+
+    def OutputStream(self, **kwargs):
+        return VirtualStream(self, "output", **kwargs)
+
+    def Stream(self, **kwargs):
+        '''Duplex stream, channels is (input channels, output channels)'''
+        return VirtualStream(self, "duplex", **kwargs)
+
+    def query_devices(self, device=None, kind=None):
+        return {"name": "virtual", "default_samplerate": float(self.samplerate),
+                "max_input_channels": self.mic.shape[1], "max_output_channels": 1}
+
+    @property
+    def time(self):
+        return START_TIME + self.position / self.samplerate
+
+    @property
+    def simulated_seconds(self):
+        return self.position / self.samplerate
+
+    @property
+    def realtime_factor(self):
+        '''Simulated seconds per wall clock second (EX: 50 = a 4 minute song in under 5 s)'''
+        return self.simulated_seconds / self.wall_seconds if self.wall_seconds else 0.0
+
+    # CLOCK
+    def _mic_block(self, frames, channels):
+        '''Next block of the take, a mono take goes to every channel, missing channels stay silent'''
+        block = np.zeros((frames, channels), dtype=np.float32)
+        chunk = self.mic[self.position:self.position + frames]
+        if chunk.shape[1] == 1:
+            block[:len(chunk)] = chunk
+        else:
+            n = min(channels, chunk.shape[1])
+            block[:len(chunk), :n] = chunk[:, :n]
+        return block
+
+    def _call(self, stream, *args):
+        '''Runs one callback, CallbackStop / CallbackAbort end that stream like PortAudio does'''
+        try:
+            stream.callback(*args)
+        except (CallbackStop, CallbackAbort):
+            stream._finish()
+
+    def tick(self):
+        '''Moves the clock by one block: every active stream gets its callback. False once nothing is left to do'''
+        active = [stream for stream in self.streams if stream.active]
+        outputs = [stream for stream in active if stream.kind == "output"]
+        inputs = [stream for stream in active if stream.kind == "input"]
+        duplex = [stream for stream in active if stream.kind == "duplex"]
+        if not outputs and not duplex and (not inputs or self.position >= len(self.mic)):
+            return False  # backing track over, or no backing track and the take is over
+        frames = active[0].blocksize
+        now = self.time
+        for stream in outputs:
+            outdata = np.zeros((stream.blocksize, stream.channels), dtype=np.float32)
+            self._call(stream, outdata, stream.blocksize, TimeInfo(now, dac_time=now + self.latency), None)
+            self.played += stream.blocksize
+        for stream in inputs:
+            indata = self._mic_block(stream.blocksize, stream.channels)
+            self._call(stream, indata, stream.blocksize,
+                       TimeInfo(now + stream.blocksize / self.samplerate + self.latency, adc_time=now), None)
+        for stream in duplex:  # same block in and out, one callback
+            input_channels, output_channels = stream.channels
+            outdata = np.zeros((stream.blocksize, output_channels), dtype=np.float32)
+            indata = self._mic_block(stream.blocksize, input_channels)
+            self._call(stream, indata, outdata, stream.blocksize,
+                       TimeInfo(now + stream.blocksize / self.samplerate + self.latency,
+                                adc_time=now, dac_time=now + self.latency), None)
+            self.played += stream.blocksize
+        self.position += frames
+        return True
+
+    def run(self, stop_event=None):
+        '''Drives the started streams as fast as possible until they are done or stop_event is set'''
+        start = time.perf_counter()
+        try:
+            while not (stop_event is not None and stop_event.is_set()):
+                if not self.tick():
+                    break
+        finally:
+            self.wall_seconds += time.perf_counter() - start